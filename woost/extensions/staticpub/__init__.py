@@ -1,30 +1,61 @@
-"""
+"""The staticpub extension.
+
+Importing the package is cheap: the names it exports are imported on first
+access, and the modules that extend woost (models, controllers, settings
+and the admin UI) are registered by calling `load`. Sites call it once,
+when setting up their extensions::
+
+    from woost.extensions import staticpub
+    staticpub.load()
+
+This lets the export script parse its arguments, and the tests exercise
+the extension's pure modules, without loading the site.
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
-from . import (
-    admin,
-    app,
-    publishablecontroller,
-    csrfprotectionexemption,
-    settings,
-    publishable,
-    publishableobject,
-    publicationcontroller,
-    zipcontroller,
-    overlays
-)
-from .destination import Destination
-from .amazons3destination import AmazonS3Destination
-from .folderdestination import FolderDestination
-from .zipdestination import ZIPDestination
-from .export import Export
-from .exportjob import ExportJob, ExportedResource
-from .utils import (
-    get_current_export,
-    iter_exportable_languages,
-    iter_all_exportable_items,
-    iter_all_exportable_content
-)
-from .installation import install
+from importlib import import_module
+
+_exported_names = {
+    "Destination": ".destination",
+    "AmazonS3Destination": ".amazons3destination",
+    "FolderDestination": ".folderdestination",
+    "ZIPDestination": ".zipdestination",
+    "Export": ".export",
+    "ExportJob": ".exportjob",
+    "ExportedResource": ".exportjob",
+    "get_current_export": ".utils",
+    "iter_exportable_languages": ".utils",
+    "iter_all_exportable_items": ".utils",
+    "iter_all_exportable_content": ".utils",
+    "install": ".installation"
+}
+
+__all__ = ["load"] + list(_exported_names)
+
+
+def load():
+    """Registers the extension with woost. Calling it again has no effect.
+    """
+    from . import (
+        admin,
+        app,
+        publishablecontroller,
+        csrfprotectionexemption,
+        settings,
+        publishable,
+        publishableobject,
+        publicationcontroller,
+        zipcontroller,
+        overlays
+    )
+
 
+def __getattr__(name):
+    module_name = _exported_names.get(name)
+    if module_name is None:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        )
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
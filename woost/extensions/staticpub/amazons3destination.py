@@ -16,7 +16,10 @@ class AmazonS3Destination(Destination):
         "aws_secret_key",
         "aws_profile",
         "bucket_name",
-        "prefix"
+        "prefix",
+        "compression",
+        "html_cache_control",
+        "asset_cache_control"
     ]
 
     aws_access_key = schema.String(
@@ -41,8 +44,24 @@ class AmazonS3Destination(Destination):
         before_member="website_prefixes"
     )
 
-    def get_export_path(self, url, resolution = None):
-        path = Destination.get_export_path(self, url, resolution)
+    compression = schema.String(
+        enumeration=["gzip", "br"],
+        listed_by_default=False
+    )
+
+    html_cache_control = schema.String(
+        listed_by_default=False
+    )
+
+    asset_cache_control = schema.String(
+        listed_by_default=False
+    )
+
+    def get_export_root(self):
+        return self.prefix.strip("/").split("/") if self.prefix else ()
+
+    def get_export_path(self, url, resolution = None, **kwargs):
+        path = Destination.get_export_path(self, url, resolution, **kwargs)
         if self.prefix:
             path = self.prefix.strip("/").split("/") + path
         return path
@@ -58,7 +77,13 @@ class AmazonS3Destination(Destination):
             session_parameters["aws_secret_access_key"] = self.aws_secret_key
 
         if self.aws_profile:
-            session_parameters["profile_name"] = self.profile_name
-
-        return self.exporter_class(self.bucket_name, session_parameters)
+            session_parameters["profile_name"] = self.aws_profile
+
+        return self.exporter_class(
+            self.bucket_name,
+            session_parameters,
+            compression=self.compression,
+            html_cache_control=self.html_cache_control,
+            asset_cache_control=self.asset_cache_control
+        )
 
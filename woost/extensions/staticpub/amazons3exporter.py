@@ -2,36 +2,80 @@
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
-try:
-    import boto3
-except ImportError:
-    boto3 = None
+import gzip
+from hashlib import md5
+from importlib.util import find_spec
 
-from .exporter import Exporter
+from .exporter import Exporter, StoredFile
 
 
 class AmazonS3Exporter(Exporter):
 
+    # The maximum number of keys accepted by S3 in a DeleteObjects request
+    max_deleted_objects = 1000
+
     bucket_name = None
     session_parameters = None
     connection = None
     bucket = None
 
-    def __init__(self, bucket_name, session_parameters = None):
+    # Upload policies
+    compression = None
+    compressible_content_types = frozenset([
+        "text/html",
+        "text/css",
+        "text/plain",
+        "text/xml",
+        "text/javascript",
+        "application/javascript",
+        "application/json",
+        "application/xml",
+        "image/svg+xml"
+    ])
+    min_compressed_size = 1024
+    digest_metadata_key = "staticpub-digest"
+    html_cache_control = None
+    asset_cache_control = None
+
+    def __init__(
+        self,
+        bucket_name,
+        session_parameters = None,
+        compression = None,
+        html_cache_control = None,
+        asset_cache_control = None
+    ):
         self.bucket_name = bucket_name
         self.session_parameters = session_parameters or {}
+        self.compression = compression
+        self.html_cache_control = html_cache_control
+        self.asset_cache_control = asset_cache_control
 
     def open(self):
 
-        if boto3 is None:
+        # boto3 takes a long time to import; defer it until it is needed
+        try:
+            import boto3
+        except ImportError:
             raise ImportError("The 'boto3' package is not available")
 
+        # brotli is imported when content is first compressed; check for it
+        # upfront, rather than failing halfway through the export
+        if self.compression == "br" and find_spec("brotli") is None:
+            raise ImportError("The 'brotli' package is not available")
+
         self.session = boto3.Session(**self.session_parameters)
         self.s3 = self.session.resource("s3")
 
-    def write_file(self, path, content, content_type = None):
+    def write_file(
+        self,
+        path,
+        content,
+        content_type = None,
+        cache_control = None
+    ):
 
-        if isinstance(content, unicode):
+        if isinstance(content, str):
             content = content.encode("utf-8")
 
         key = self.s3.Object(
@@ -39,12 +83,88 @@ class AmazonS3Exporter(Exporter):
             u"/".join(path)
         )
 
-        kwargs = {"Body": content}
-        if content_type:
-            kwargs["ContentType"] = content_type
+        kwargs = self.get_upload_parameters(content_type, cache_control)
+
+        # Keep the digest of the uncompressed content, to be able to verify
+        # the object later on
+        kwargs["Metadata"] = {
+            self.digest_metadata_key: md5(content).hexdigest()
+        }
 
+        encoding = self.get_content_encoding(content, content_type)
+        if encoding:
+            content = self.encode_content(content, encoding)
+            kwargs["ContentEncoding"] = encoding
+
+        kwargs["Body"] = content
         key.put(**kwargs)
 
+    def write_stream(
+        self,
+        path,
+        stream,
+        content_type = None,
+        cache_control = None
+    ):
+
+        key = self.s3.Object(
+            self.bucket_name,
+            u"/".join(path)
+        )
+
+        # Uploaded in parts, so the stream is never held in memory at once.
+        # Streams aren't compressed, since only large files are streamed, and
+        # those are rarely text.
+        key.upload_fileobj(
+            stream,
+            ExtraArgs=self.get_upload_parameters(content_type, cache_control)
+        )
+
+    def get_upload_parameters(self, content_type = None, cache_control = None):
+
+        parameters = {}
+
+        if content_type:
+            parameters["ContentType"] = content_type
+
+        if cache_control is None:
+            if content_type == "text/html":
+                cache_control = self.html_cache_control
+            else:
+                cache_control = self.asset_cache_control
+
+        if cache_control:
+            parameters["CacheControl"] = cache_control
+
+        return parameters
+
+    def get_content_encoding(self, content, content_type = None):
+        return self.get_encoding_for_size(len(content), content_type)
+
+    def get_encoding_for_size(self, size, content_type = None):
+        if (
+            self.compression
+            and content_type in self.compressible_content_types
+            and size >= self.min_compressed_size
+        ):
+            return self.compression
+        return None
+
+    def get_stored_size(self, size, content_type = None):
+        # Compressed objects are listed with their compressed size
+        if self.get_encoding_for_size(size, content_type):
+            return None
+        return size
+
+    def encode_content(self, content, encoding):
+        if encoding == "gzip":
+            return gzip.compress(content, mtime=0)
+        elif encoding == "br":
+            import brotli
+            return brotli.compress(content, mode=brotli.MODE_TEXT)
+        else:
+            raise ValueError(f"Unknown content encoding: {encoding}")
+
     def remove_file(self, path):
         key = self.s3.Object(
             self.bucket_name,
@@ -52,3 +172,58 @@ class AmazonS3Exporter(Exporter):
         )
         key.delete()
 
+    def iter_stored_files(self, prefix = ()):
+
+        key_prefix = u"/".join(prefix)
+        if key_prefix:
+            key_prefix += "/"
+
+        bucket = self.s3.Bucket(self.bucket_name)
+
+        for obj in bucket.objects.filter(Prefix=key_prefix):
+            yield StoredFile(tuple(obj.key.split("/")), obj.size, obj.e_tag)
+
+    def get_stored_digest(self, stored_file):
+
+        # Resources aren't thread safe, but clients are
+        client = self.s3.meta.client
+        response = client.head_object(
+            Bucket=self.bucket_name,
+            Key=u"/".join(stored_file.path)
+        )
+
+        digest = response.get("Metadata", {}).get(self.digest_metadata_key)
+        if digest:
+            return digest
+
+        # Objects uploaded in a single request and without compression have
+        # the MD5 digest of their content as their ETag
+        etag = (response.get("ETag") or "").strip('"')
+        if (
+            etag
+            and "-" not in etag
+            and not response.get("ContentEncoding")
+        ):
+            return etag
+
+        return None
+
+    def remove_files(self, paths):
+
+        bucket = self.s3.Bucket(self.bucket_name)
+        keys = [{"Key": u"/".join(path)} for path in paths]
+
+        for i in range(0, len(keys), self.max_deleted_objects):
+            response = bucket.delete_objects(
+                Delete={
+                    "Objects": keys[i:i + self.max_deleted_objects],
+                    "Quiet": True
+                }
+            )
+            errors = response.get("Errors")
+            if errors:
+                raise IOError(
+                    f"Couldn't remove {len(errors)} objects from "
+                    f"{self.bucket_name}: {errors[0].get('Message')}"
+                )
+
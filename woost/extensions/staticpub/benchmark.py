@@ -0,0 +1,804 @@
+"""Throughput benchmarks for the static publisher.
+
+Generates a synthetic site, serves it from a local stub origin and exports it
+to each of the supported backends, reporting the throughput achieved by each.
+
+The benchmark needs a configured woost environment (datastore, URL mapping),
+so it should be launched from a site's shell. The transactions it commits are
+redirected to a temporary storage layered over the site's database, and
+discarded once it ends::
+
+    python -c "import mysite.scripts.shell; \\
+        from woost.extensions.staticpub.benchmark import BenchmarkCLI; \\
+        BenchmarkCLI().main()" --pages 500 --languages en es
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import os
+import sys
+import json
+import subprocess
+import tempfile
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import time
+
+import transaction as zodb_transaction
+from ZODB.DemoStorage import DemoStorage
+from cocktail.persistence import datastore
+from cocktail.styled import styled
+from cocktail.stringutils import normalize_indentation as ni
+from cocktail.urls import URL
+from woost import app
+
+from .amazons3destination import AmazonS3Destination
+from .amazons3exporter import AmazonS3Exporter
+from .destination import Destination
+from .export import Export
+from .taskmap import CompactTaskMap
+from .exporter import Exporter
+from .exportjob import ExportJob
+from .folderdestination import FolderDestination
+from .folderexporter import FolderExporter
+from .zipdestination import ZIPDestination
+from .zipexporter import ZIPExporter
+from .utils import DigestReader
+
+
+class SyntheticSite:
+    """A generated site, consisting of pages that link to each other and
+    share a set of stylesheets, scripts and images.
+    """
+
+    pages: int = 100
+    links_per_page: int = 10
+    stylesheets: int = 3
+    scripts: int = 3
+    images: int = 20
+    images_per_page: int = 4
+    image_size: int = 20 * 1024
+    languages: Sequence[str] = ("en",)
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise TypeError(f"Invalid site parameter: {key}")
+            setattr(self, key, value)
+
+    def iter_pages(self) -> Iterable['SyntheticPage']:
+        for n in range(self.pages):
+            yield SyntheticPage(self, n)
+
+    def get_page_path(self, n: int, language: str) -> str:
+        return f"/{language}/pages/{n}"
+
+    def get_stylesheet_path(self, n: int) -> str:
+        return f"/assets/styles/style-{n}.css"
+
+    def get_script_path(self, n: int) -> str:
+        return f"/assets/scripts/script-{n}.js"
+
+    def get_image_path(self, n: int) -> str:
+        return f"/assets/images/image-{n}.png"
+
+    def render(self, path: str) -> Tuple[str, bytes]:
+        """Produces the content for the given path.
+
+        :return: A tuple containing the content type and body of the
+            resource, or None if the path doesn't match any resource.
+        """
+        segments = path.strip("/").split("/")
+
+        try:
+            if len(segments) == 3 and segments[1] == "pages":
+                language = segments[0]
+                n = int(segments[2])
+                if language in self.languages and n < self.pages:
+                    return "text/html", self.render_page(n, language)
+
+            elif len(segments) == 3 and segments[0] == "assets":
+                name = segments[2]
+                n = int(name.split("-", 1)[1].split(".", 1)[0])
+
+                if segments[1] == "styles" and n < self.stylesheets:
+                    return "text/css", self.render_stylesheet(n)
+
+                if segments[1] == "scripts" and n < self.scripts:
+                    return (
+                        "application/javascript",
+                        self.render_script(n)
+                    )
+
+                if segments[1] == "images" and n < self.images:
+                    return "image/png", self.render_image(n)
+
+        except ValueError:
+            pass
+
+        return None
+
+    def render_page(self, n: int, language: str) -> bytes:
+
+        head = []
+
+        for i in range(self.stylesheets):
+            head.append(
+                f'<link rel="stylesheet" type="text/css" '
+                f'href="{self.get_stylesheet_path(i)}">'
+            )
+
+        for i in range(self.scripts):
+            head.append(
+                f'<script type="text/javascript" '
+                f'src="{self.get_script_path(i)}"></script>'
+            )
+
+        if self.images:
+            head.append(
+                "<style>body { background: "
+                f"url('{self.get_image_path(n % self.images)}'); }}</style>"
+            )
+            head.append(
+                '<script type="text/javascript">'
+                "var banner = '<img src=\""
+                f"{self.get_image_path((n + 1) % self.images)}"
+                "\">';</script>"
+            )
+
+        body = [f"<h1>Page {n} ({language})</h1>"]
+
+        if self.pages:
+            for i in range(self.links_per_page):
+                target = (n * 31 + i * 7 + 1) % self.pages
+                body.append(
+                    f'<a href="{self.get_page_path(target, language)}">'
+                    f"Page {target}</a>"
+                )
+
+        if self.images:
+            for i in range(self.images_per_page):
+                image = (n + i) % self.images
+                body.append(f'<img src="{self.get_image_path(image)}">')
+
+        body.append("<p>" + "Lorem ipsum dolor sit amet. " * 50 + "</p>")
+
+        return (
+            f'<!DOCTYPE html><html lang="{language}"><head>'
+            + "".join(head)
+            + "</head><body>"
+            + "".join(body)
+            + "</body></html>"
+        ).encode("utf-8")
+
+    def render_stylesheet(self, n: int) -> bytes:
+        rules = [f".rule-{n}-{i} {{ color: #{i:06x}; }}" for i in range(200)]
+        if self.images:
+            image = self.get_image_path(n % self.images)
+            rules.append(f".banner-{n} {{ background: url(\"{image}\"); }}")
+        return "\n".join(rules).encode("utf-8")
+
+    def render_script(self, n: int) -> bytes:
+        return "\n".join(
+            f"function f{n}_{i}(x) {{ return x * {i}; }}"
+            for i in range(200)
+        ).encode("utf-8")
+
+    def render_image(self, n: int) -> bytes:
+        seed = md5(str(n).encode("utf-8")).digest()
+        return (seed * (self.image_size // len(seed) + 1))[:self.image_size]
+
+
+class SyntheticPage:
+    """A stand-in for a publishable object, used as the subject of the tasks
+    of a benchmark export.
+    """
+
+    def __init__(self, site: SyntheticSite, n: int):
+        self.site = site
+        self.id = n
+
+    def get_path(self, language: str) -> str:
+        return self.site.get_page_path(self.id, language)
+
+    def __repr__(self):
+        return f"SyntheticPage({self.id})"
+
+
+class StubOrigin:
+    """A local HTTP server that serves a `SyntheticSite`."""
+
+    host = "127.0.0.1"
+    port = None
+    requests = 0
+    not_modified_responses = 0
+
+    def __init__(self, site: SyntheticSite):
+        self.site = site
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def start(self):
+
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                origin.requests += 1
+                result = origin.site.render(self.path.split("?", 1)[0])
+
+                if result is None:
+                    self.send_error(404)
+                    return
+
+                content_type, body = result
+                etag = '"%s"' % md5(body).hexdigest()
+
+                if self.headers.get("If-None-Match") == etag:
+                    origin.not_modified_responses += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def get_url(self, path: str) -> URL:
+        return URL(f"http://{self.host}:{self.port}{path}")
+
+
+class MeteredExporter(Exporter):
+    """Wraps an exporter, keeping track of the files and bytes written
+    through it.
+    """
+
+    def __init__(self, exporter: Exporter):
+        self.exporter = exporter
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def open(self):
+        self.exporter.open()
+
+    def close(self):
+        self.exporter.close()
+
+    def write_file(
+            self,
+            path,
+            content,
+            content_type=None,
+            cache_control=None):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.files_written += 1
+        self.bytes_written += len(content)
+        self.exporter.write_file(
+            path,
+            content,
+            content_type=content_type,
+            cache_control=cache_control
+        )
+
+    def write_stream(
+            self,
+            path,
+            stream,
+            content_type=None,
+            cache_control=None):
+        reader = DigestReader(stream)
+        self.exporter.write_stream(
+            path,
+            reader,
+            content_type=content_type,
+            cache_control=cache_control
+        )
+        self.files_written += 1
+        self.bytes_written += reader.size
+
+    def remove_file(self, path):
+        self.exporter.remove_file(path)
+
+    def __getattr__(self, key):
+        return getattr(self.exporter, key)
+
+
+class FakeS3Exporter(AmazonS3Exporter):
+    """An S3 exporter that stores objects in memory instead of uploading
+    them.
+    """
+
+    def __init__(self, bucket_name, session_parameters = None):
+        AmazonS3Exporter.__init__(self, bucket_name, session_parameters)
+        self.objects = {}
+
+    def open(self):
+        self.s3 = FakeS3Resource(self.objects)
+
+
+class FakeS3Resource:
+
+    def __init__(self, objects: Dict[Tuple[str, str], dict]):
+        self.objects = objects
+
+    def Object(self, bucket_name: str, key: str) -> 'FakeS3Object':
+        return FakeS3Object(self, bucket_name, key)
+
+    def Bucket(self, bucket_name: str) -> 'FakeS3Bucket':
+        return FakeS3Bucket(self, bucket_name)
+
+
+class FakeS3Bucket:
+
+    def __init__(self, resource: FakeS3Resource, bucket_name: str):
+        self.resource = resource
+        self.name = bucket_name
+
+    def delete_objects(self, Delete: dict) -> dict:
+        for obj in Delete["Objects"]:
+            self.resource.objects.pop((self.name, obj["Key"]), None)
+        return {}
+
+
+class FakeS3Object:
+
+    def __init__(self, resource: FakeS3Resource, bucket_name: str, key: str):
+        self.resource = resource
+        self.bucket_name = bucket_name
+        self.key = key
+
+    def put(self, **kwargs):
+        self.resource.objects[(self.bucket_name, self.key)] = kwargs
+
+    def upload_fileobj(self, stream, ExtraArgs=None):
+        self.put(Body=stream.read(), **(ExtraArgs or {}))
+
+    def delete(self):
+        self.resource.objects.pop((self.bucket_name, self.key), None)
+
+
+class CommitCounter:
+    """Counts the database transactions committed while it is registered."""
+
+    commits = 0
+
+    def __enter__(self):
+        zodb_transaction.manager.registerSynch(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        zodb_transaction.manager.unregisterSynch(self)
+
+    def newTransaction(self, txn):
+        pass
+
+    def beforeCompletion(self, txn):
+        pass
+
+    def afterCompletion(self, txn):
+        if txn.status == "Committed":
+            self.commits += 1
+
+
+class BenchmarkExportJob(ExportJob):
+    """An export job that exports the pages of a `SyntheticSite` from a
+    `StubOrigin`.
+    """
+
+    # Synthetic pages don't carry the metadata used to sort tasks
+    task_ordering = None
+
+    def __init__(
+            self,
+            export: Export,
+            origin: StubOrigin,
+            exporter: Exporter):
+
+        self.origin = origin
+        self.__exporter = MeteredExporter(exporter)
+        ExportJob.__init__(self, export)
+
+    def create_exporter(self, **kwargs) -> Exporter:
+        return self.__exporter
+
+    def get_export_urls(self, item, language):
+        return [self.origin.get_url(item.get_path(language))]
+
+    def url_is_external(self, url: URL) -> bool:
+        return bool(url.hostname) and url.hostname != self.origin.host
+
+    def resolve_url(self, url: URL):
+        return None
+
+
+class BenchmarkBackend:
+    """Creates the destination and exporter for one of the benchmarked
+    backends.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            create: Callable[[str], Tuple[Destination, Exporter]]):
+
+        self.name = name
+        self.create = create
+
+
+def _create_folder_backend(temp_folder):
+    root_folder = os.path.join(temp_folder, "folder")
+    destination = FolderDestination()
+    destination.root_folder = root_folder
+    return destination, FolderExporter(root_folder)
+
+
+def _create_zip_backend(temp_folder):
+    destination = ZIPDestination()
+    return destination, ZIPExporter(os.path.join(temp_folder, "export.zip"))
+
+
+def _create_s3_backend(temp_folder):
+    destination = AmazonS3Destination()
+    destination.bucket_name = "benchmark"
+    return destination, FakeS3Exporter("benchmark")
+
+
+backends = {
+    "folder": BenchmarkBackend("folder", _create_folder_backend),
+    "zip": BenchmarkBackend("zip", _create_zip_backend),
+    "s3": BenchmarkBackend("s3", _create_s3_backend)
+}
+
+
+@contextmanager
+def throwaway_storage():
+    """Redirects the transactions committed within the block to a temporary
+    storage, layered over the current storage of the datastore.
+
+    Objects in the database remain readable; changes to them are discarded
+    when the block ends.
+    """
+    base_storage = datastore.storage
+    datastore.abort()
+    datastore.close()
+    datastore.storage = DemoStorage(
+        base=base_storage,
+        close_base_on_close=False
+    )
+    try:
+        yield
+    finally:
+        datastore.abort()
+        datastore.close()
+        datastore.db.close()
+        datastore.storage = base_storage
+
+
+def run_benchmark(
+        site: SyntheticSite,
+        backend: BenchmarkBackend,
+        configure_job: Callable[[ExportJob], None] = None) -> Dict:
+    """Exports a synthetic site to the given backend and measures the
+    throughput of the operation.
+
+    The export is executed against a throwaway storage (see
+    `throwaway_storage`), so it leaves the database untouched.
+
+    :param site: The site to export.
+
+    :param backend: The backend to export the site to.
+
+    :param configure_job: An optional function that will receive the export
+        job before it is executed, allowing to customize its settings.
+
+    :return: A dictionary with the measured metrics. The peak memory used
+        by the export is only measured by `run_benchmark_process`.
+    """
+    with throwaway_storage(), \
+         tempfile.TemporaryDirectory() as temp_folder, \
+         StubOrigin(site) as origin:
+
+        destination, exporter = backend.create(temp_folder)
+        destination.url = origin.get_url("/")
+
+        # Create a transient export operation covering the whole site
+        export = Export()
+        export.destination = destination
+        export.tasks = CompactTaskMap()
+
+        for page in site.iter_pages():
+            for language in site.languages:
+                export.tasks.add(page, language)
+
+        job = BenchmarkExportJob(export, origin, exporter)
+        job.errors = "raise"
+
+        if configure_job:
+            configure_job(job)
+
+        with CommitCounter() as commit_counter:
+            start = time()
+            job.execute()
+            duration = time() - start
+
+        metered_exporter = job.exporter
+        pages = len(export.tasks)
+        dependencies = len(job.dependencies)
+
+        return {
+            "backend": backend.name,
+            "pages": pages,
+            "dependencies": dependencies,
+            "duration": duration,
+            "pages_per_second": pages / duration if duration else 0.0,
+            "dependencies_per_second":
+                dependencies / duration if duration else 0.0,
+            "files_written": metered_exporter.files_written,
+            "bytes_written": metered_exporter.bytes_written,
+            "requests": origin.requests,
+            "peak_memory": None,
+            "commits": commit_counter.commits
+        }
+
+
+def run_benchmark_process(
+        site: SyntheticSite,
+        backend: BenchmarkBackend,
+        shell: str = None) -> Dict:
+    """Runs `run_benchmark` on a separate process, measuring the peak memory
+    used by the process.
+
+    Each backend runs on its own process, so that the memory used by one
+    doesn't hide that of the next. The peak is the resident set size
+    reported by the operating system, which includes the memory allocated
+    by C extensions (such as lxml) and doesn't slow down the export.
+
+    :param site: The site to export.
+
+    :param backend: The backend to export the site to.
+
+    :param shell: The module that sets up the site on the new process.
+        Defaults to the ``scripts.shell`` module of the current site.
+
+    :return: A dictionary with the measured metrics.
+    """
+    if shell is None:
+        shell = f"{app.package}.scripts.shell"
+
+    with tempfile.NamedTemporaryFile(suffix=".json") as results_file:
+
+        command = [
+            sys.executable,
+            "-c",
+            f"import {shell}; "
+            "from woost.extensions.staticpub.benchmark import BenchmarkCLI; "
+            "BenchmarkCLI().main()",
+            "--pages", str(site.pages),
+            "--links", str(site.links_per_page),
+            "--stylesheets", str(site.stylesheets),
+            "--scripts", str(site.scripts),
+            "--images", str(site.images),
+            "--images-per-page", str(site.images_per_page),
+            "--image-size", str(site.image_size),
+            "--languages", *site.languages,
+            "--backends", backend.name,
+            "--in-process",
+            "--results-file", results_file.name
+        ]
+
+        with subprocess.Popen(command) as process:
+            # Reap the process with wait4, which reports the resources used
+            # by that process alone
+            pid, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+        result = json.load(results_file)[0]
+
+    # ru_maxrss is given in kilobytes on Linux, and in bytes on macOS
+    result["peak_memory"] = (
+        usage.ru_maxrss
+        if sys.platform == "darwin"
+        else usage.ru_maxrss * 1024
+    )
+    return result
+
+
+class BenchmarkCLI:
+
+    def __init__(self):
+        self.parser = self.create_arg_parser()
+
+    def create_arg_parser(self) -> ArgumentParser:
+
+        parser = ArgumentParser(
+            description=ni("""
+                Exports a synthetic site served by a local stub origin and
+                reports the throughput achieved by each backend.
+                """)
+        )
+        parser.add_argument(
+            "--pages",
+            type=int,
+            default=SyntheticSite.pages,
+            help="The number of pages of the generated site."
+        )
+        parser.add_argument(
+            "--links",
+            type=int,
+            default=SyntheticSite.links_per_page,
+            help="The number of links to other pages on each page."
+        )
+        parser.add_argument(
+            "--stylesheets",
+            type=int,
+            default=SyntheticSite.stylesheets,
+            help="The number of stylesheets shared by all pages."
+        )
+        parser.add_argument(
+            "--scripts",
+            type=int,
+            default=SyntheticSite.scripts,
+            help="The number of scripts shared by all pages."
+        )
+        parser.add_argument(
+            "--images",
+            type=int,
+            default=SyntheticSite.images,
+            help="The number of distinct images in the site."
+        )
+        parser.add_argument(
+            "--images-per-page",
+            type=int,
+            default=SyntheticSite.images_per_page,
+            help="The number of images embedded in each page."
+        )
+        parser.add_argument(
+            "--image-size",
+            type=int,
+            default=SyntheticSite.image_size,
+            help="The size of each image, in bytes."
+        )
+        parser.add_argument(
+            "--languages",
+            nargs="+",
+            default=list(SyntheticSite.languages),
+            help="The languages each page is published in."
+        )
+        parser.add_argument(
+            "--backends",
+            nargs="+",
+            choices=list(backends),
+            default=list(backends),
+            help="The backends to benchmark."
+        )
+        parser.add_argument(
+            "--in-process",
+            action="store_true",
+            help=ni("""
+                Run all the benchmarks on the current process, rather than
+                on a new process for each backend. The peak memory used by
+                each backend isn't measured.
+                """)
+        )
+        parser.add_argument(
+            "--shell",
+            help=ni("""
+                The module that sets up the site on the process of each
+                backend. Defaults to the scripts.shell module of the site.
+                """)
+        )
+        parser.add_argument(
+            "--results-file",
+            help=ni("""
+                Write the results to the given file, as JSON, instead of
+                printing them.
+                """)
+        )
+        return parser
+
+    def main(self):
+        args = self.parser.parse_args()
+
+        site = SyntheticSite(
+            pages=args.pages,
+            links_per_page=args.links,
+            stylesheets=args.stylesheets,
+            scripts=args.scripts,
+            images=args.images,
+            images_per_page=args.images_per_page,
+            image_size=args.image_size,
+            languages=args.languages
+        )
+
+        if args.in_process:
+            results = [
+                run_benchmark(site, backends[backend_name])
+                for backend_name in args.backends
+            ]
+        else:
+            results = [
+                run_benchmark_process(
+                    site,
+                    backends[backend_name],
+                    shell=args.shell
+                )
+                for backend_name in args.backends
+            ]
+
+        if args.results_file:
+            with open(args.results_file, "w") as results_file:
+                json.dump(results, results_file)
+        else:
+            self.print_results(results)
+
+    def print_results(self, results: List[Dict]):
+
+        columns = [
+            ("pages/s", "pages_per_second", "{:.1f}"),
+            ("deps/s", "dependencies_per_second", "{:.1f}"),
+            ("time", "duration", "{:.2f}s"),
+            ("files", "files_written", "{}"),
+            ("MB written", "bytes_written", "{:.2f}"),
+            ("requests", "requests", "{}"),
+            ("peak mem MB", "peak_memory", "{:.1f}"),
+            ("commits", "commits", "{}")
+        ]
+
+        print(
+            styled("backend".ljust(10), "white", "dark_gray", "bold")
+            + "".join(
+                styled(label.rjust(14), "white", "dark_gray", "bold")
+                for label, key, format in columns
+            )
+        )
+
+        for result in results:
+            print(styled(result["backend"].ljust(10), "slate_blue"), end="")
+            for label, key, format in columns:
+                value = result[key]
+                if value is None:
+                    print("-".rjust(14), end="")
+                    continue
+                if key in ("bytes_written", "peak_memory"):
+                    value /= 1024 * 1024
+                print(format.format(value).rjust(14), end="")
+            print()
+
+
+if __name__ == "__main__":
+    BenchmarkCLI().main()
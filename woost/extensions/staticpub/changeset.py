@@ -0,0 +1,83 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Dict, IO, Iterable
+import json
+
+CHANGE_ACTIONS = ("added", "modified", "deleted")
+
+
+class Changeset:
+    """The set of paths changed by an export operation.
+
+    Each change is a dictionary with the following keys:
+
+    - action: One of "added", "modified" or "deleted".
+    - path: The export path of the file, as a slash separated string.
+    - url: The source URL of the file.
+    - digest: The digest of the new content of the file (not available for
+      deleted files).
+    - size: The size of the new content of the file, in bytes (not available
+      for deleted files).
+    - content_type: The MIME type of the file (not available for deleted
+      files).
+    - previous_digest: The digest of the file before the export, if known.
+    """
+
+    def __init__(self):
+        self.__changes = {}
+
+    def __len__(self) -> int:
+        return len(self.__changes)
+
+    def __iter__(self) -> Iterable[Dict]:
+        return iter(self.__changes.values())
+
+    def add(self, change: Dict):
+
+        path = change["path"]
+        prev_change = self.__changes.get(path)
+
+        # A file that is deleted and written again by the same export has
+        # just been modified
+        if prev_change is not None:
+            if (
+                prev_change["action"] == "deleted"
+                and change["action"] != "deleted"
+            ):
+                change = dict(change, action="modified")
+            elif (
+                prev_change["action"] == "added"
+                and change["action"] == "deleted"
+            ):
+                del self.__changes[path]
+                return
+
+        self.__changes[path] = change
+
+    def get_changes(self, action: str) -> Iterable[Dict]:
+        return (
+            change
+            for change in self.__changes.values()
+            if change["action"] == action
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            action: sorted(
+                self.get_changes(action),
+                key=lambda change: change["path"]
+            )
+            for action in CHANGE_ACTIONS
+        }
+
+    def write(self, file: IO[str], **kwargs):
+        """Writes the changeset to the given file, as JSON.
+
+        :param kwargs: Additional keys to include in the JSON object.
+        """
+        data = dict(kwargs)
+        data.update(self.to_dict())
+        json.dump(data, file, indent=2)
+        file.write("\n")
@@ -19,15 +19,13 @@ from cocktail.translations import (
     translate_locale,
     set_language
 )
-from cocktail.persistence import transaction
-from woost.models import Configuration, Publishable, Document, User
-
-from .export import Export
-from .destination import Destination
-from .utils import (
-    iter_exportable_languages,
-    iter_all_exportable_content
-)
+from cocktail.pkgutils import import_object
+
+from .profiler import ExportProfiler
+
+# Models and the modules that depend on them are imported by the actions
+# that use them, so that printing help or rejecting invalid arguments
+# doesn't pay for loading them
 
 
 class CLI(object):
@@ -37,11 +35,43 @@ class CLI(object):
     tasks = None
     languages = None
     reset = False
+    force = False
+    dry_run = False
+    diff = False
+    changeset = None
+    repair = False
+    prune = False
+    prune_prefix = None
+    confirm_prune = False
+    destination = None
+    user = None
+    lane = "bulk"
     errors = None
     verbose = False
+    profile = False
+    profiled_urls = 10
+    dependency_workers = None
+    process_workers = None
+    spill = None
     start = None
     end = None
 
+    # selector -> (model, action, resolved selector type, error description)
+    content_selectors = {
+        "branch": ("woost.models.Document", "post", "branch", "branch ID"),
+        "delbranch": (
+            "woost.models.Document", "delete", "branch", "branch ID"
+        ),
+        "item": ("woost.models.Publishable", "post", "item", "item ID"),
+        "delitem": (
+            "woost.models.Publishable", "delete", "item", "item ID"
+        ),
+        "export": (
+            "woost.extensions.staticpub.export.Export", None, "export",
+            "export ID"
+        )
+    }
+
     def __init__(self):
         self.start = time()
         self.parser = self.create_arg_parser()
@@ -52,90 +82,44 @@ class CLI(object):
             formatter_class=RawTextHelpFormatter
         )
 
+        # Arguments are only parsed here; resolving them requires access to
+        # the database, which is deferred to `resolve_args`, so that
+        # printing help or rejecting invalid arguments doesn't pay for it
         def content_parser(selector):
 
-            if selector.startswith("branch:"):
-                doc_id = selector.split(":", 1)[1]
-                try:
-                    document = Document.require_instance(int(doc_id))
-                except:
-                    raise ArgumentTypeError(
-                        f"{doc_id} is not a valid branch ID"
-                    )
-                else:
-                    return ("branch", ("post", document))
-
-            elif selector.startswith("delbranch:"):
-                doc_id = selector.split(":", 1)[1]
-                try:
-                    document = Document.require_instance(int(doc_id))
-                except:
-                    raise ArgumentTypeError(
-                        f"{doc_id} is not a valid branch ID"
-                    )
-                else:
-                    return ("branch", ("delete", document))
-
-            elif selector.startswith("item:"):
-                pub_id = selector.split(":", 1)[1]
-                try:
-                    publishable = Publishable.require_instance(int(pub_id))
-                except:
-                    raise ArgumentTypeError(
-                        f"{pub_id} is not a valid branch ID"
-                    )
-                else:
-                    return ("item", ("post", publishable))
+            selector_type, colon, value = selector.partition(":")
 
-            elif selector.startswith("delitem:"):
-                pub_id = selector.split(":", 1)[1]
-                try:
-                    publishable = Publishable.require_instance(int(pub_id))
-                except:
-                    raise ArgumentTypeError(
-                        f"{pub_id} is not a valid branch ID"
-                    )
-                else:
-                    return ("item", ("delete", publishable))
-
-            elif selector.startswith("export:"):
-                export_id = selector.split(":", 1)[1]
-                try:
-                    export = Export.require_instance(int(export_id))
-                except:
-                    raise ArgumentTypeError(
-                        f"{export_id} is not a valid export ID"
-                    )
-                else:
-                    return ("export", export)
+            if not colon or selector_type not in self.content_selectors:
+                raise ArgumentTypeError(
+                    f"{selector} is not a valid content selector"
+                )
 
-        def destination_parser(id):
             try:
-                return Destination.require_instance(int(id))
-            except:
-                raise ArgumentTypeError(f"{id} is not a valid destination ID")
-
-        def user_parser(value):
+                return (selector_type, int(value))
+            except ValueError:
+                raise ArgumentTypeError(f"{value} is not a valid ID")
 
+        def id_parser(value):
             try:
-                try:
-                    id = int(value)
-                except ValueError:
-                    return User.require_instance(email=value)
-                else:
-                    return User.require_instance(id)
-            except:
-                pass
-
-            raise ArgumentTypeError(f"{id} is not a valid user ID or email")
+                return int(value)
+            except ValueError:
+                raise ArgumentTypeError(f"{value} is not a valid ID")
 
         parser.add_argument(
             "action",
-            choices=["export", "list"],
+            choices=["export", "list", "gc", "verify", "cancel"],
             help=ni("""
                 The action to perform. Use 'list' to perform a dry run without
                 actually commiting any change to the export target, or 'export'
-                to go through with the export operation.
+                to go through with the export operation. Use 'gc' to remove
+                the dependencies (images, stylesheets, scripts, etc) that are
+                no longer referenced by any exported publication from the
+                selected destination. Dependencies exported before reference
+                tracking was available are never removed. Use 'verify' to
+                compare the files at the destination with the record of the
+                files exported to it. Use 'cancel' to stop the export
+                operations selected with export:EXPORT_ID, or all the running
+                export operations for the selected destination.
                 """)
         )
         parser.add_argument(
@@ -168,14 +152,29 @@ class CLI(object):
         )
         parser.add_argument(
             "-d", "--destination",
-            type=destination_parser,
+            type=id_parser,
             help=ni("""
                 The ID of the Destination object indicating the export target.
                 """)
         )
+        parser.add_argument(
+            "-m", "--mirror",
+            dest="mirrors",
+            action="append",
+            default=[],
+            type=id_parser,
+            metavar="DESTINATION",
+            help=ni("""
+                The ID of an additional Destination that should receive the
+                same files as the export target. Each file is rendered once
+                and written to all destinations, so mirrors must share the
+                layout of the export target (file extensions, website
+                prefixes and fingerprinting settings). Can be given more than
+                once.
+                """)
+        )
         parser.add_argument(
             "-u", "--user",
-            type=user_parser,
             help=ni("""
                 The ID or email of the User that the export operation should be
                 run as. The default is to run the export as an anonymous user;
@@ -188,14 +187,14 @@ class CLI(object):
             action="store_true",
             help=ni("""
                 Limits the export operation to publishable items that have been
-                modified since the last export.
+                modified since the last export. Files whose content has changed
+                are transferred again, without exporting the documents that
+                reference them.
                 """)
         )
         parser.add_argument(
             "-l", "--languages",
             nargs="*",
-            choices=["neutral"]
-                      + list(Configuration.instance.get_enabled_languages()),
             metavar="LANGUAGE",
             help=ni("""
                 Limits the export operation to the indicated set of locales.
@@ -211,6 +210,89 @@ class CLI(object):
                 operation, essentially forcing the operation to start over.
                 """)
         )
+        parser.add_argument(
+            "-f", "--force",
+            action="store_true",
+            help=ni("""
+                Transfer all content and dependencies (stylesheets, scripts,
+                images, etc) in full, even if they were already exported to
+                the destination by a previous export operation and haven't
+                changed since.
+                """)
+        )
+        parser.add_argument(
+            "-n", "--dry-run",
+            action="store_true",
+            help=ni("""
+                With the 'export' action, render and hash all content without
+                writing anything to the destination (combine with --diff or
+                --changeset to find out what would change). With the 'gc'
+                action, list the orphaned files instead of removing them.
+                """)
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help=ni("""
+                With the 'verify' action, export again the files that are
+                missing or have been modified at the destination.
+                """)
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help=ni("""
+                With the 'verify' action, remove the files at the destination
+                that weren't exported to it. Files exported before export
+                records were kept are indistinguishable from those, so this
+                requires either --prune-prefix or --confirm-prune.
+                """)
+        )
+        parser.add_argument(
+            "--prune-prefix",
+            metavar="PATH",
+            help=ni("""
+                With --prune, only remove the files under the given path
+                (relative to the root of the destination).
+                """)
+        )
+        parser.add_argument(
+            "--confirm-prune",
+            action="store_true",
+            help=ni("""
+                With --prune, confirm the removal of all the files at the
+                destination that have no export record.
+                """)
+        )
+        parser.add_argument(
+            "--diff",
+            action="store_true",
+            help=ni("""
+                Print the paths added, modified or deleted by the export
+                operation once it ends.
+                """)
+        )
+        parser.add_argument(
+            "--changeset",
+            metavar="FILE",
+            help=ni("""
+                Write the paths added, modified or deleted by the export
+                operation, along with their digests and sizes, to the given
+                file, as JSON. Use '-' to write to the standard output.
+                """)
+        )
+        parser.add_argument(
+            "--lane",
+            choices=["bulk", "interactive"],
+            default="bulk",
+            help=ni("""
+                The lane of the export operation. Only one export operation
+                can run on each lane of a destination at a time. Bulk exports
+                pause between publications while interactive exports are
+                running, so use the interactive lane for small, urgent
+                changes.
+                """)
+        )
         parser.add_argument(
             "-e", "--errors",
             choices=["raise", "resume"],
@@ -223,15 +305,164 @@ class CLI(object):
                 Enable to show progress information for the export operation.
                 """)
         )
+        parser.add_argument(
+            "-w", "--dependency-workers",
+            type=int,
+            metavar="N",
+            help=ni("""
+                The number of threads used to download dependencies
+                (stylesheets, scripts, images, etc) while publications are
+                being exported. Set to 0 to transfer all dependencies
+                sequentially once all publications have been exported.
+                """)
+        )
+        parser.add_argument(
+            "-P", "--process-workers",
+            type=int,
+            metavar="N",
+            help=ni("""
+                The number of processes used to parse and rewrite HTML
+                documents. Defaults to 0, which processes all content in the
+                exporting process.
+                """)
+        )
+        parser.add_argument(
+            "--spill",
+            nargs="?",
+            const="",
+            metavar="FILE",
+            help=ni("""
+                Keep track of the URLs visited by the export operation using
+                an SQLite database on disk, instead of memory. Recommended for
+                very large sites. The database is stored in a temporary file
+                unless FILE is given.
+                """)
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help=ni("""
+                Measure the time spent on each phase of the export operation
+                (fetching, parsing, rewriting, writing, etc) and print a
+                report when it ends. The report is also stored with the
+                export operation, for later comparison.
+                """)
+        )
+        parser.add_argument(
+            "--profile-top",
+            type=int,
+            default=10,
+            metavar="N",
+            help=ni("""
+                The number of URLs to include in the list of slowest URLs of
+                the profiling report.
+                """)
+        )
 
         return parser
 
+    def resolve_args(self, args):
+        """Replaces the identifiers given on the command line with the
+        objects they refer to, validating them against the database.
+        """
+        from woost.models import Configuration, User
+        from .destination import Destination
+
+        args.content = [
+            self._resolve_content_selector(selector_type, id)
+            for selector_type, id in args.content
+        ]
+
+        if args.destination is not None:
+            destination = Destination.get_instance(args.destination)
+            if destination is None:
+                self.parser.error(
+                    f"argument -d/--destination: {args.destination} is not "
+                    "a valid destination ID"
+                )
+            args.destination = destination
+
+        mirrors = []
+        for mirror_id in args.mirrors:
+            mirror = Destination.get_instance(mirror_id)
+            if mirror is None:
+                self.parser.error(
+                    f"argument -m/--mirror: {mirror_id} is not a valid "
+                    "destination ID"
+                )
+            mirrors.append(mirror)
+        args.mirrors = mirrors
+
+        if args.user is not None:
+            try:
+                user = User.get_instance(int(args.user))
+            except ValueError:
+                user = User.get_instance(email=args.user)
+            if user is None:
+                self.parser.error(
+                    f"argument -u/--user: {args.user} is not a valid user ID "
+                    "or email"
+                )
+            args.user = user
+
+        if args.languages:
+            config = Configuration.instance
+            valid_languages = ["neutral", *config.get_enabled_languages()]
+            for lang in args.languages:
+                if lang not in valid_languages:
+                    choices = ", ".join(valid_languages)
+                    self.parser.error(
+                        f"argument -l/--languages: invalid choice: '{lang}' "
+                        f"(choose from {choices})"
+                    )
+
+    def _resolve_content_selector(self, selector_type, id):
+
+        model, action, resolved_type, error = \
+            self.content_selectors[selector_type]
+
+        instance = import_object(model).get_instance(id)
+        if instance is None:
+            self.parser.error(f"argument content: {id} is not a valid {error}")
+
+        if action is None:
+            return (resolved_type, instance)
+        else:
+            return (resolved_type, (action, instance))
+
     def apply_args(self, args):
 
+        from cocktail.persistence import transaction
+
         self.action = args.action
         self.reset = args.reset
+        self.force = args.force
+        self.dry_run = args.dry_run
+        self.diff = args.diff
+        self.changeset = args.changeset
+        self.repair = args.repair
+        self.prune = args.prune
+        self.confirm_prune = args.confirm_prune
+
+        if args.prune_prefix is not None:
+            self.prune_prefix = tuple(
+                part for part in args.prune_prefix.split("/") if part
+            )
+
+        if self.prune and self.prune_prefix is None and not self.confirm_prune:
+            sys.stderr.write(
+                "--prune requires either --prune-prefix or --confirm-prune\n"
+            )
+            sys.exit(1)
+        self.user = args.user
+        self.lane = args.lane
         self.errors = args.errors
         self.verbose = args.verbose
+        self.profile = args.profile
+        self.spill = args.spill
+        self.dependency_workers = args.dependency_workers
+        self.process_workers = args.process_workers
+        self.profiled_urls = args.profile_top
 
         if args.languages:
             self.languages = [
@@ -241,6 +472,7 @@ class CLI(object):
 
         if len(args.content) == 1 and args.content[0][0] == "export":
             self.export = args.content[0][1]
+            self.destination = self.export.destination
 
             if args.destination:
                 sys.stderr.write(
@@ -249,6 +481,13 @@ class CLI(object):
                 )
                 sys.exit(1)
 
+            if args.mirrors:
+                sys.stderr.write(
+                    "Can't specify --mirror when executing an existing "
+                    "export operation\n"
+                )
+                sys.exit(1)
+
             if self.languages:
                 sys.stderr.write(
                     "Can't specify --languages when executing an existing "
@@ -262,8 +501,17 @@ class CLI(object):
                     "export operation\n"
                 )
                 sys.exit(1)
+
+            if self.dry_run and self.action == "export":
+                sys.stderr.write(
+                    "Can't specify --dry-run when executing an existing "
+                    "export operation\n"
+                )
+                sys.exit(1)
         else:
             if args.destination is None:
+                from woost.models import Configuration
+                from .destination import Destination
                 args.destination = Configuration.instance.x_staticpub_default_dest
                 if args.destination is None:
                     args.destination = Destination.select()[0]
@@ -271,6 +519,16 @@ class CLI(object):
                         sys.stderr.write("No destination available\n")
                         sys.exit(1)
 
+            self.destination = args.destination
+
+            for mirror in args.mirrors:
+                if mirror.get_layout() != self.destination.get_layout():
+                    sys.stderr.write(
+                        f"Can't mirror {self.destination} to {mirror}, "
+                        "since their layouts differ\n"
+                    )
+                    sys.exit(1)
+
             if self.action == "export":
                 try:
                     self.export = transaction(
@@ -284,22 +542,44 @@ class CLI(object):
 
     def _create_export_from_args(self, args):
 
+        from .export import Export
+
         tasks = self._get_tasks_from_args(args)
+        pending_dependencies = args.pending and any(
+            destination.has_pending_dependencies()
+            for destination in [args.destination] + args.mirrors
+        )
 
-        if tasks:
+        if tasks or pending_dependencies:
             export = Export.new(destination=args.destination)
             export.user = args.user
+            export.full = not (args.content or args.pending or self.languages)
+            export.lane = self.lane
+            for mirror in args.mirrors:
+                export.add_mirror(mirror)
             for task in tasks:
                 export.add_task(*task)
+            if pending_dependencies:
+                export.add_pending_dependencies()
             return export
         else:
             raise EmptyExport()
 
     def _get_tasks_from_args(self, args):
 
+        from .utils import (
+            iter_exportable_languages,
+            iter_all_exportable_content
+        )
+
         user = args.user
         tasks = set()
 
+        # Incremental exports of the whole site only need to look at pending
+        # tasks, rather than enumerating all exportable content
+        if args.pending and not args.content:
+            return self._get_pending_tasks(args)
+
         if args.content:
             for selector_type, selector_value in args.content:
 
@@ -328,25 +608,90 @@ class CLI(object):
                     tasks.add(("post", pub, lang))
 
         if args.pending:
-            actions = {"add": "post", "mod": "post", "del": "delete"}
-            tasks.intersection_update(
-                (actions[action], pub, lang)
-                for pub, lang, action
-                in args.destination.iter_pending_tasks()
-            )
+            pending_tasks = {
+                (action, pub.id, lang)
+                for action, pub, lang in self._get_pending_tasks(args)
+            }
+            tasks = {
+                (action, pub, lang)
+                for action, pub, lang in tasks
+                if (action, pub.id, lang) in pending_tasks
+            }
+
+        return tasks
+
+    def _get_pending_tasks(self, args):
+
+        from woost.models import Publishable
+        from .utils import iter_exportable_languages
+
+        user = args.user
+        tasks = set()
+        actions = {"add": "post", "mod": "post", "del": "delete"}
+        exportable_languages = {}
+        missing_ids = set()
+
+        for action, pub_id, lang in args.destination.iter_pending_tasks(
+            languages=self.languages
+        ):
+            pub = Publishable.get_instance(pub_id)
+            if pub is None:
+                missing_ids.add(pub_id)
+                continue
+
+            action = actions[action]
+
+            if action == "post":
+                pub_languages = exportable_languages.get(pub_id)
+                if pub_languages is None:
+                    pub_languages = set(
+                        iter_exportable_languages(pub, user=user)
+                    )
+                    exportable_languages[pub_id] = pub_languages
+                if lang not in pub_languages:
+                    continue
+
+            tasks.add((action, pub, lang))
+
+        # Items that were deleted before their pending tasks were exported
+        # can't be exported anymore; forget them. Only exports do this, from
+        # within the transaction that creates the export: listing pending
+        # tasks must not modify the destination.
+        if self.action == "export":
+            for pub_id in missing_ids:
+                args.destination.discard_pending_tasks(pub_id)
 
         return tasks
 
-    def main(self):
-        args = self.parser.parse_args()
+    def parse_args(self, args=None):
+        return self.parser.parse_args(args)
+
+    def main(self, args=None):
+
+        from . import load
+
+        if args is None:
+            args = self.parse_args()
+
+        load()
+        self.resolve_args(args)
         self.apply_args(args)
 
         if self.action == "export":
             self.export_action()
         elif self.action == "list":
             self.list_action()
+        elif self.action == "gc":
+            self.gc_action()
+        elif self.action == "verify":
+            self.verify_action()
+        elif self.action == "cancel":
+            self.cancel_action()
 
     def export_action(self):
+
+        from cocktail.persistence import transaction
+
         if self.export is None:
             if self.verbose:
                 print("Nothing to export")
@@ -357,8 +702,235 @@ class CLI(object):
             if self.verbose:
                 self._track_job_progress(job)
 
+            if self.dependency_workers is not None:
+                job.dependency_workers = self.dependency_workers
+
+            if self.process_workers is not None:
+                job.process_workers = self.process_workers
+
+            if self.spill is not None:
+                job.spill = True
+                job.spill_path = self.spill or None
+
+            if self.profile:
+                job.profiler = ExportProfiler()
+                job.profiled_urls = self.profiled_urls
+
+            if self.diff or self.changeset:
+                from .changeset import Changeset
+                job.changeset = Changeset()
+
             job.reset = self.reset
-            job.execute()
+            job.reuse_exported_files = not self.force
+            job.dry_run = self.dry_run
+
+            try:
+                job.execute()
+            finally:
+                # Dry runs don't keep the export operation they create
+                if self.dry_run:
+                    transaction(self.export.delete)
+
+            if self.profile and self.export.profile:
+                self.print_profile(self.export.profile)
+
+            if self.changeset:
+                self.write_changeset(job.changeset)
+
+            if self.diff:
+                self.print_diff(job.changeset)
+
+    def write_changeset(self, changeset):
+
+        info = {
+            "export": None if self.dry_run else self.export.id,
+            "destination": self.destination.id,
+            "dry_run": self.dry_run
+        }
+
+        if self.changeset == "-":
+            changeset.write(sys.stdout, **info)
+        else:
+            with open(self.changeset, "w") as file:
+                changeset.write(file, **info)
+
+    def print_diff(self, changeset):
+
+        symbols = {
+            "added": styled("+", "green"),
+            "modified": styled("~", "slate_blue"),
+            "deleted": styled("-", "red")
+        }
+
+        changes = sorted(changeset, key=lambda change: change["path"])
+
+        for change in changes:
+            print(symbols[change["action"]], change["path"])
+
+        counts = defaultdict(int)
+        for change in changes:
+            counts[change["action"]] += 1
+
+        print(
+            f"{counts['added']} added, "
+            f"{counts['modified']} modified, "
+            f"{counts['deleted']} deleted"
+        )
+
+    def gc_action(self):
+
+        if not self.destination.references_complete:
+            sys.stderr.write(
+                f"Can't collect garbage on {self.destination} until a full "
+                "export has recorded the references between its files\n"
+            )
+            sys.exit(1)
+
+        count = 0
+
+        for url in self.destination.collect_garbage(dry_run=self.dry_run):
+            count += 1
+            if self.verbose or self.dry_run:
+                print(url)
+
+        if self.verbose:
+            if self.dry_run:
+                print(f"Found {count} orphaned files")
+            else:
+                print(f"Removed {count} orphaned files")
+
+    def verify_action(self):
+
+        from .verification import DestinationVerifier
+
+        verifier = DestinationVerifier(self.destination)
+
+        if self.verbose:
+            progress_bar = ProgressBar(
+                sum(1 for record in self.destination.iter_exported_files())
+            )
+            progress_bar.label = "Verifying exported files"
+            progress_bar.update()
+
+            @when(verifier.file_verified)
+            def file_verified(e):
+                progress_bar.update(1)
+
+        report = verifier.verify()
+
+        if self.verbose:
+            progress_bar.finish()
+
+        for label, color, exported_files in (
+            ("missing", "red", report.missing),
+            ("modified", "slate_blue", report.modified)
+        ):
+            for url, record in exported_files:
+                print(
+                    styled(label.ljust(12), color),
+                    "/".join(record["export_path"])
+                )
+
+        for stored_file in report.extraneous:
+            print(
+                styled("extraneous".ljust(12), "pink"),
+                "/".join(stored_file.path)
+            )
+
+        print(
+            f"{report.verified} verified, "
+            f"{report.unverified} unverified, "
+            f"{len(report.missing)} missing, "
+            f"{len(report.modified)} modified, "
+            f"{len(report.extraneous)} extraneous"
+        )
+
+        if self.prune:
+            verifier.prune(
+                report,
+                prefix=self.prune_prefix,
+                confirmed=self.confirm_prune
+            )
+
+        if self.repair:
+            self.export = verifier.repair(report, user=self.user)
+            self.export_action()
+
+    def cancel_action(self):
+
+        from cocktail.persistence import transaction
+
+        if self.export is not None:
+            exports = [self.export]
+        else:
+            exports = [
+                export
+                for export in self.destination.exports
+                if export.state == "running"
+            ]
+
+        @transaction
+        def not_cancelled():
+            return [export for export in exports if not export.cancel()]
+
+        for export in exports:
+            if export in not_cancelled:
+                sys.stderr.write(
+                    f"{export} was not cancelled: it is not running "
+                    f"(state: {export.state})\n"
+                )
+            elif self.verbose:
+                print(f"Cancelled {export}")
+
+        if not_cancelled:
+            sys.exit(1)
+
+    def print_profile(self, profile):
+
+        print()
+        print(styled("Profile".ljust(120), "white", "dark_gray", "bold"))
+        print(f"Total time: {profile['wall']:.2f}s")
+        print()
+
+        columns = ["count", "wall", "cpu", "p50", "p90", "p99", "max"]
+        print("Phase".ljust(22), end="")
+        for column in columns:
+            print(column.rjust(12), end="")
+        print()
+
+        phases = sorted(
+            profile["phases"].items(),
+            key=lambda item: item[1]["wall"],
+            reverse=True
+        )
+
+        for phase, phase_summary in phases:
+            print(styled(phase.ljust(22), "slate_blue"), end="")
+            for column in columns:
+                value = phase_summary[column]
+                if column == "count":
+                    print(str(value).rjust(12), end="")
+                else:
+                    print(f"{value:.3f}".rjust(12), end="")
+            print()
+
+        if profile["slowest"]:
+            print()
+            print(
+                styled(
+                    "Slowest URLs".ljust(120),
+                    "white",
+                    "dark_gray",
+                    "bold"
+                )
+            )
+            for url_summary in profile["slowest"]:
+                print(
+                    f"{url_summary['wall']:.3f}s".rjust(10),
+                    f"{url_summary['cpu']:.3f}s".rjust(10),
+                    (url_summary["kind"] or "").ljust(12),
+                    styled(url_summary["url"], "pink")
+                )
 
     def _track_job_progress(self, job):
 
@@ -380,6 +952,18 @@ class CLI(object):
                 f"in {self.end - self.start:.2f}"
             )
 
+        @when(job.waiting_for_lease)
+        def waiting_for_lease(e):
+            progress_bar.label = (
+                f"Waiting for other exports on the {self.export.lane} lane"
+            )
+            progress_bar.update()
+
+        @when(job.export_paused)
+        def export_paused(e):
+            progress_bar.label = "Paused for an interactive export"
+            progress_bar.update()
+
         @when(job.task_starting)
         def task_starting(e):
 
@@ -405,26 +989,37 @@ class CLI(object):
             progress_bar.label += " => failed (%s)" % e.task["error_message"]
             progress_bar.update(1)
 
+        # Dependencies can be transferred while publications are still being
+        # exported; only show their progress once publications are done
+        transfers = {"phase": False, "completed": 0}
+
+        def resource_transfer_ended(label):
+            transfers["completed"] += 1
+            if transfers["phase"]:
+                progress_bar.label = label
+                progress_bar.update(1)
+
         @when(job.dependency_transfers_starting)
         def resource_transfers_starting(e):
+            transfers["phase"] = True
             progress_bar.total_cycles = len(job.dependencies)
-            progress_bar.progress = 0
+            progress_bar.progress = transfers["completed"]
             progress_bar.label = "Transfering static resources"
             progress_bar.update()
 
-        @when(job.dependency_transfer_starting)
-        def resource_transfer_starting(e):
-            progress_bar.label = e.resource.source_url
-
         @when(job.dependency_transfer_successful)
         def resource_transfer_successful(e):
-            progress_bar.label += " => exported"
-            progress_bar.update(1)
+            resource_transfer_ended(f"{e.resource.source_url} => exported")
+
+        @when(job.dependency_transfer_skipped)
+        def resource_transfer_skipped(e):
+            resource_transfer_ended(f"{e.resource.source_url} => unchanged")
 
         @when(job.dependency_transfer_failed)
         def resource_transfer_failed(e):
-            progress_bar.label += f" => failed ({e.error})"
-            progress_bar.update(1)
+            resource_transfer_ended(
+                f"{e.resource.source_url} => failed ({e.error})"
+            )
 
     def list_action(self):
 
@@ -0,0 +1,289 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Any, Hashable, Union
+import os
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import RLock
+
+from cocktail.urls import URL
+
+URLKey = bytes
+
+
+def get_url_key(url: Union[URL, str]) -> URLKey:
+    """Obtains a compact, fixed size key for the given URL.
+
+    Keys are 128 bit hashes of the normalized URL string, which makes it
+    possible to keep track of very large numbers of URLs without holding on
+    to full `~cocktail.urls.URL` objects.
+    """
+    return blake2b(str(url).encode("utf-8"), digest_size=16).digest()
+
+
+class URLSet:
+    """A set of URLs, stored as hashed keys."""
+
+    def __contains__(self, url: Union[URL, str]) -> bool:
+        raise ValueError("Not implemented")
+
+    def __len__(self) -> int:
+        raise ValueError("Not implemented")
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def add(self, url: Union[URL, str]):
+        raise ValueError("Not implemented")
+
+    def discard(self, url: Union[URL, str]):
+        raise ValueError("Not implemented")
+
+
+class URLQueue(URLSet):
+    """A set of URLs that can be consumed in arbitrary order."""
+
+    def pop(self) -> URL:
+        raise ValueError("Not implemented")
+
+
+class CrawlState:
+    """Keeps track of the URLs visited by an export job.
+
+    :var document_urls: The URLs that have been exported as documents.
+    :var dependencies: The URLs that have been discovered as dependencies.
+    :var pending_dependencies: The dependencies that are yet to be
+        transferred.
+    """
+
+    document_urls: URLSet = None
+    dependencies: URLSet = None
+    pending_dependencies: URLQueue = None
+
+    def close(self):
+        pass
+
+
+class MemoryURLSet(URLSet):
+
+    def __init__(self, lock: RLock):
+        self._lock = lock
+        self._keys = set()
+
+    def __contains__(self, url):
+        return get_url_key(url) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, url):
+        key = get_url_key(url)
+        with self._lock:
+            self._keys.add(key)
+
+    def discard(self, url):
+        key = get_url_key(url)
+        with self._lock:
+            self._keys.discard(key)
+
+
+class MemoryURLQueue(URLQueue):
+
+    def __init__(self, lock: RLock):
+        self._lock = lock
+        self._urls = {}
+
+    def __contains__(self, url):
+        return get_url_key(url) in self._urls
+
+    def __len__(self):
+        return len(self._urls)
+
+    def add(self, url):
+        key = get_url_key(url)
+        with self._lock:
+            self._urls[key] = str(url)
+
+    def discard(self, url):
+        key = get_url_key(url)
+        with self._lock:
+            self._urls.pop(key, None)
+
+    def pop(self):
+        with self._lock:
+            key, url = self._urls.popitem()
+        return URL(url)
+
+
+class MemoryCrawlState(CrawlState):
+    """A crawl state that keeps hashed URL keys in memory.
+
+    Only the URLs of pending dependencies are kept in full.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self.document_urls = MemoryURLSet(self._lock)
+        self.dependencies = MemoryURLSet(self._lock)
+        self.pending_dependencies = MemoryURLQueue(self._lock)
+
+
+class SQLiteURLSet(URLSet):
+
+    def __init__(self, state: 'SQLiteCrawlState', table: str):
+        self._state = state
+        self._table = table
+
+    def __contains__(self, url):
+        return self._state.execute(
+            f"SELECT 1 FROM {self._table} WHERE key = ?",
+            (get_url_key(url),)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._state.execute(
+            f"SELECT COUNT(*) FROM {self._table}"
+        ).fetchone()[0]
+
+    def __bool__(self):
+        return self._state.execute(
+            f"SELECT 1 FROM {self._table} LIMIT 1"
+        ).fetchone() is not None
+
+    def add(self, url):
+        self._state.execute(
+            f"INSERT OR IGNORE INTO {self._table} (key) VALUES (?)",
+            (get_url_key(url),)
+        )
+
+    def discard(self, url):
+        self._state.execute(
+            f"DELETE FROM {self._table} WHERE key = ?",
+            (get_url_key(url),)
+        )
+
+
+class SQLiteURLQueue(SQLiteURLSet, URLQueue):
+
+    def add(self, url):
+        self._state.execute(
+            f"INSERT OR IGNORE INTO {self._table} (key, url) VALUES (?, ?)",
+            (get_url_key(url), str(url))
+        )
+
+    def pop(self):
+        with self._state.lock:
+            row = self._state.execute(
+                f"SELECT key, url FROM {self._table} LIMIT 1"
+            ).fetchone()
+            if row is None:
+                raise KeyError("pop from an empty queue")
+            key, url = row
+            self._state.execute(
+                f"DELETE FROM {self._table} WHERE key = ?",
+                (key,)
+            )
+        return URL(url)
+
+
+class SQLiteCrawlState(CrawlState):
+    """A crawl state that spills all visited URLs to an SQLite database on
+    disk, keeping memory usage constant regardless of the size of the site.
+
+    :param path: The path to the database file. If not given, a temporary
+        file is created, and removed when the state is closed.
+    """
+
+    def __init__(self, path: str = None):
+
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+            self._temporary = True
+        else:
+            self._temporary = False
+
+        self.path = path
+        self.lock = RLock()
+        self._connection = sqlite3.connect(
+            path,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self.execute("PRAGMA journal_mode = OFF")
+        self.execute("PRAGMA synchronous = OFF")
+
+        # Discard the state left by previous jobs using the same file
+        for table in ("document_urls", "dependencies"):
+            self.execute(f"DROP TABLE IF EXISTS {table}")
+            self.execute(
+                f"CREATE TABLE {table} "
+                "(key BLOB PRIMARY KEY) WITHOUT ROWID"
+            )
+
+        self.execute("DROP TABLE IF EXISTS pending_dependencies")
+        self.execute(
+            "CREATE TABLE pending_dependencies "
+            "(key BLOB PRIMARY KEY, url TEXT NOT NULL) WITHOUT ROWID"
+        )
+
+        self.document_urls = SQLiteURLSet(self, "document_urls")
+        self.dependencies = SQLiteURLSet(self, "dependencies")
+        self.pending_dependencies = \
+            SQLiteURLQueue(self, "pending_dependencies")
+
+    def execute(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        with self.lock:
+            return self._connection.execute(sql, parameters)
+
+    def close(self):
+        self._connection.close()
+        if self._temporary:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class LRUCache:
+    """A mapping that holds a bounded number of entries, discarding the least
+    recently used ones when it grows past its capacity.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._lock = RLock()
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
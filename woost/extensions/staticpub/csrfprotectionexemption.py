@@ -7,12 +7,15 @@ from cocktail.controllers.csrfprotection import (
     CSRFProtection,
     CSRFProtectionExemption
 )
-
 from woost import app
 
+from .utils import is_export_request
+
 
 @when(CSRFProtection.deciding_injection)
 def disable_csrf_protection_in_static_pages(e):
-    if app.x_staticpub_exporting:
+    # Checked against the request too, since the decision may be taken once
+    # the controller has finished (and reset the exporting flag)
+    if app.x_staticpub_exporting or is_export_request():
         raise CSRFProtectionExemption()
 
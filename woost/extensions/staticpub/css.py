@@ -0,0 +1,233 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Callable, Iterable, List, NamedTuple
+import re
+
+_escape_regexp = re.compile(r"\\(?:([0-9a-fA-F]{1,6})\s?|(.))", re.DOTALL)
+_url_function_regexp = re.compile(r"url\(", re.IGNORECASE)
+_image_set_regexp = re.compile(r"(?:-webkit-)?image-set\(", re.IGNORECASE)
+_import_regexp = re.compile(r"@import\b", re.IGNORECASE)
+_absolute_url_regexp = re.compile(r"^([a-zA-Z][a-zA-Z0-9+.-]*:|/)")
+
+
+class CSSReference(NamedTuple):
+    """A reference to an URL found in a stylesheet.
+
+    :var start: The offset where the reference begins.
+    :var end: The offset where the reference ends.
+    :var url: The referenced URL, with CSS escape sequences resolved.
+    :var kind: One of "url" (an url() function, spanning the whole function
+        call), "import" (the string given to an @import rule) or "image-set"
+        (a string within an image-set() function).
+    """
+    start: int
+    end: int
+    url: str
+    kind: str
+
+
+def unescape_css(value: str) -> str:
+    """Resolves the escape sequences in the given CSS string."""
+
+    def replace(match):
+        code, char = match.groups()
+        if code:
+            try:
+                return chr(int(code, 16))
+            except (ValueError, OverflowError):
+                return "\ufffd"
+        elif char == "\n":
+            return ""
+        return char
+
+    return _escape_regexp.sub(replace, value)
+
+
+def _scan_string(css: str, start: int) -> int:
+    """Finds the end of the string literal starting at the given offset.
+
+    :return: The offset immediately after the closing delimiter, or the end
+        of the text if the string is not closed.
+    """
+    delimiter = css[start]
+    i = start + 1
+    length = len(css)
+
+    while i < length:
+        c = css[i]
+        if c == "\\":
+            i += 2
+        elif c == delimiter:
+            return i + 1
+        elif c == "\n":
+            # Unclosed string
+            return i
+        else:
+            i += 1
+
+    return length
+
+
+def _skip_whitespace(css: str, i: int) -> int:
+    length = len(css)
+    while i < length and css[i] in " \t\r\n\f":
+        i += 1
+    return i
+
+
+def iter_css_references(css: str) -> Iterable[CSSReference]:
+    """Finds all the URLs referenced by a stylesheet.
+
+    The scanner runs in a single pass, skips comments and handles quoted and
+    unquoted url() functions, @import rules and image-set() functions,
+    including escaped quotes and parenthesis.
+    """
+    i = 0
+    length = len(css)
+    image_set_depth = 0
+
+    while i < length:
+        c = css[i]
+
+        # Comments
+        if c == "/" and css.startswith("/*", i):
+            end = css.find("*/", i + 2)
+            i = length if end == -1 else end + 2
+
+        # Strings (only meaningful within image-set() functions; strings
+        # following @import rules are handled below)
+        elif c == '"' or c == "'":
+            end = _scan_string(css, i)
+            if image_set_depth:
+                yield CSSReference(
+                    i,
+                    end,
+                    unescape_css(css[i + 1:end - 1]),
+                    "image-set"
+                )
+            i = end
+
+        # url() functions
+        elif (
+            (c == "u" or c == "U")
+            and _url_function_regexp.match(css, i)
+            and (i == 0 or not _is_identifier_char(css[i - 1]))
+        ):
+            start = i
+            i = _skip_whitespace(css, i + 4)
+
+            if i < length and css[i] in "\"'":
+                value_end = _scan_string(css, i)
+                value = unescape_css(css[i + 1:value_end - 1])
+                i = _skip_whitespace(css, value_end)
+            else:
+                value_start = i
+                while i < length and css[i] != ")":
+                    if css[i] == "\\":
+                        i += 1
+                    i += 1
+                value = unescape_css(css[value_start:i].rstrip())
+
+            if i < length and css[i] == ")":
+                i += 1
+                yield CSSReference(start, i, value, "url")
+
+        # @import rules with a plain string
+        elif c == "@" and _import_regexp.match(css, i):
+            i = _skip_whitespace(css, i + 7)
+            if i < length and css[i] in "\"'":
+                end = _scan_string(css, i)
+                yield CSSReference(
+                    i,
+                    end,
+                    unescape_css(css[i + 1:end - 1]),
+                    "import"
+                )
+                i = end
+
+        # image-set() functions
+        elif (
+            (c == "i" or c == "I" or c == "-")
+            and (i == 0 or not _is_identifier_char(css[i - 1]))
+            and _image_set_regexp.match(css, i)
+        ):
+            i = _image_set_regexp.match(css, i).end()
+            image_set_depth = 1
+
+        elif image_set_depth and c == "(":
+            image_set_depth += 1
+            i += 1
+
+        elif image_set_depth and c == ")":
+            image_set_depth -= 1
+            i += 1
+
+        elif c == "\\":
+            i += 2
+
+        else:
+            i += 1
+
+
+def _is_identifier_char(c: str) -> bool:
+    return c.isalnum() or c in "-_\\"
+
+
+def css_url_is_relative(url: str) -> bool:
+    """Indicates if the given URL is relative to the location of the
+    stylesheet that contains it.
+    """
+    return not _absolute_url_regexp.match(url.strip())
+
+
+def quote_css_string(value: str, delimiter: str = "'") -> str:
+    """Wraps the given value in a CSS string literal."""
+    value = (
+        value
+        .replace("\\", "\\\\")
+        .replace(delimiter, "\\" + delimiter)
+        .replace("\n", "\\a ")
+    )
+    return delimiter + value + delimiter
+
+
+def rewrite_css(
+        css: str,
+        references: List[CSSReference],
+        replace: Callable[[CSSReference], str]) -> str:
+    """Replaces the URLs referenced by a stylesheet.
+
+    :param css: The stylesheet to rewrite.
+
+    :param references: The references in the stylesheet, as produced by
+        `iter_css_references`.
+
+    :param replace: A function that receives each reference and returns its
+        replacement URL, or None to leave the reference untouched.
+
+    :return: The modified stylesheet.
+    """
+    chunks = []
+    pos = 0
+
+    for ref in references:
+        new_url = replace(ref)
+        if new_url is None:
+            continue
+
+        chunks.append(css[pos:ref.start])
+
+        if ref.kind == "url":
+            chunks.append(f"url({quote_css_string(str(new_url))})")
+        else:
+            chunks.append(quote_css_string(str(new_url), css[ref.start]))
+
+        pos = ref.end
+
+    if not chunks:
+        return css
+
+    chunks.append(css[pos:])
+    return "".join(chunks)
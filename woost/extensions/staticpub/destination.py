@@ -2,8 +2,10 @@
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
-from typing import Sequence, Union
-from collections import Iterable
+from typing import Hashable, Optional, Sequence, Tuple, Union
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from itertools import islice
 from mimetypes import guess_extension
 
 from BTrees.IOBTree import IOBTree
@@ -12,14 +14,17 @@ from cocktail.events import Event, when
 from cocktail.caching import whole_cache, normalize_scope
 from cocktail.urls import URL
 from cocktail import schema
+from cocktail.persistence import transaction
 from woost import app
 from woost.urls import URLResolution
 from woost.models import Item, Website
 from woost.admin.controllers.admincontroller import AdminController
 from woost.admin.schemaexport import SchemaExport, exports_model
 
+from .exporter import Exporter
 from .exportjob import ExportJob
-from .utils import iter_all_exportable_content
+from .lease import ExportLease
+from .utils import iter_all_exportable_content, iter_exportable_languages
 
 
 @when(AdminController.collecting_ui_components)
@@ -32,6 +37,7 @@ class Destination(Item):
 
     type_group = "staticpub"
     export_file_extension = ".html"
+    incremental = True
     export_job_class = ExportJob
     exporter_class = None
     instantiable = False
@@ -40,12 +46,22 @@ class Destination(Item):
         "PublicationState"
     )
 
+    # Fingerprinted files never change, so they can be cached indefinitely
+    fingerprinted_cache_control = "public, max-age=31536000, immutable"
+    fingerprint_length = 12
+
+    # Export lanes, from highest to lowest priority. Exports in lower
+    # priority lanes pause at task boundaries while exports in higher
+    # priority lanes are running.
+    export_lanes = ("interactive", "bulk")
+
     resolving_export_path = Event()
 
     members_order = [
         "title",
         "url",
         "website_prefixes",
+        "fingerprint_assets",
         "exports"
     ]
 
@@ -67,6 +83,12 @@ class Destination(Item):
         values=schema.String()
     )
 
+    fingerprint_assets = schema.Boolean(
+        required=True,
+        default=False,
+        listed_by_default=False
+    )
+
     exports = schema.Collection(
         items="woost.extensions.staticpub.export.Export",
         bidirectional=True,
@@ -74,11 +96,23 @@ class Destination(Item):
         editable=schema.NOT_EDITABLE
     )
 
+    # Documents exported before export records were kept don't record the
+    # dependencies they reference; until a full export has recorded all of
+    # them, no dependency can be considered orphaned
+    references_complete = False
+
     def __init__(self, *args, **kwargs):
         Item.__init__(self, *args, **kwargs)
         self._pending_tasks = IOBTree()
         self._entries_by_tag = OOBTree()
         self._entry_tags = OOBTree()
+        self._exported_files = OOBTree()
+        self._reference_counts = OOBTree()
+        self._orphaned_files = OOTreeSet()
+        self._superseded_files = OOBTree()
+        self._dependencies_by_item = OOBTree()
+        self._pending_dependencies = OOTreeSet()
+        self._leases = {}
 
     def create_exporter(self, **kwargs):
         if self.exporter_class is None:
@@ -89,25 +123,58 @@ class Destination(Item):
             self,
             url: URL,
             resolution: URLResolution = None,
-            content_type: str = None) -> URL:
+            content_type: str = None,
+            export_path: Sequence[str] = None) -> URL:
 
-        root_url = URL(self.url)
-        return root_url.copy(
-            path=root_url.path.append(
-                self.get_export_path(
-                    url,
-                    resolution=resolution,
-                    content_type=content_type
-                )
+        if export_path is None:
+            export_path = self.get_export_path(
+                url,
+                resolution=resolution,
+                content_type=content_type
             )
+
+        root_url = URL(self.url)
+        return root_url.copy(path=root_url.path.append(export_path))
+
+    def get_layout(self) -> Hashable:
+        """Describes how content is laid out and rewritten for the
+        destination.
+
+        Destinations with the same layout export files to the same paths,
+        relative to their export root, and with the same content. This makes
+        it possible to render each file once and write it to all of them
+        (see `~woost.extensions.staticpub.export.Export.mirrors`).
+        Subclasses that alter export paths or content should extend it.
+        """
+        return (
+            self.export_file_extension,
+            tuple(sorted(
+                (website.id, prefix)
+                for website, prefix in (self.website_prefixes or {}).items()
+            )),
+            self.fingerprint_assets,
+            self.fingerprint_length if self.fingerprint_assets else None
         )
 
+    def create_mirror_exporter(self, export) -> Exporter:
+        """Creates the exporter used to write the files of an export that
+        uses the destination as a mirror.
+        """
+        return self.create_exporter()
+
+    def get_export_root(self) -> Sequence[str]:
+        """Gives the path that contains all the files exported to the
+        destination.
+        """
+        return ()
+
     def get_export_path(
             self,
             url: Union[URL, str],
             resolution: URLResolution = None,
             content_type: str = None,
-            add_file_extension: bool = True) -> Sequence[str]:
+            add_file_extension: bool = True,
+            fingerprint: str = None) -> Sequence[str]:
 
         url = URL(url)
 
@@ -150,6 +217,14 @@ class Destination(Item):
             if ext:
                 export_path[-1] += ext
 
+        # Content fingerprint (name.<fingerprint>.ext)
+        if fingerprint and export_path:
+            name, dot, ext = export_path[-1].rpartition(".")
+            if dot and name:
+                export_path[-1] = f"{name}.{fingerprint}.{ext}"
+            else:
+                export_path[-1] += "." + fingerprint
+
         # Customization
         e = self.resolving_export_path(
             url=url,
@@ -169,6 +244,52 @@ class Destination(Item):
 
         return guess_extension(content_type)
 
+    def get_lease(self, lane: str) -> Optional[ExportLease]:
+        """Gets the lease held on the given lane, if it hasn't expired."""
+        lease = self._leases.get(lane)
+        if lease is None or lease.expired:
+            return None
+        return lease
+
+    def can_acquire_lease(self, export) -> bool:
+        lease = self.get_lease(export.lane)
+        return lease is None or lease.export_id == export.id
+
+    def acquire_lease(
+            self,
+            export,
+            duration: timedelta,
+            yielding: bool = False) -> bool:
+        """Claims the lane of the given export, or renews its claim.
+
+        :param duration: The time until the lease expires.
+        :param yielding: Indicates that the export has paused to let exports
+            in higher priority lanes run.
+        :return: True if the lease was acquired, False if the lane is held
+            by another export.
+        """
+        if not self.can_acquire_lease(export):
+            return False
+
+        # Leases are replaced as a whole, rather than stored in a BTree, so
+        # that exports claiming lanes concurrently are told apart by a
+        # conflict
+        leases = dict(self._leases)
+        leases[export.lane] = ExportLease(
+            export.id,
+            datetime.now() + duration,
+            yielding
+        )
+        self._leases = leases
+        return True
+
+    def release_lease(self, export):
+        lease = self._leases.get(export.lane)
+        if lease is not None and lease.export_id == export.id:
+            leases = dict(self._leases)
+            del leases[export.lane]
+            self._leases = leases
+
     def iter_pending_tasks(self, publishable=None, languages=None):
         if publishable:
             pub_tasks = self._pending_tasks.get(publishable.id)
@@ -236,6 +357,12 @@ class Destination(Item):
             pub_tasks = self._require_pub_tasks(publishable.id)
             pub_tasks[language] = task
 
+    def discard_pending_tasks(self, publishable_id: int):
+        """Removes the pending tasks for the item with the given ID, such as
+        the tasks left behind by an item that no longer exists.
+        """
+        self._pending_tasks.pop(publishable_id, None)
+
     def _require_pub_tasks(self, publishable_id):
         pub_tasks = self._pending_tasks.get(publishable_id)
         if pub_tasks is None:
@@ -243,6 +370,9 @@ class Destination(Item):
             self._pending_tasks[publishable_id] = pub_tasks
         return pub_tasks
 
+    def get_exported_content_tags(self, item, language):
+        return self._entry_tags.get((item.id, language))
+
     def set_exported_content_tags(self, item, language, tags):
 
         entry = (item.id, language)
@@ -262,6 +392,294 @@ class Destination(Item):
                 self._entries_by_tag[tag] = tag_entries
             tag_entries.insert(entry)
 
+    def get_exported_file(self, url: Union[URL, str]) -> Optional[dict]:
+        return self._exported_files.get(str(url))
+
+    def set_exported_file(self, url: Union[URL, str], record: dict):
+        key = str(url)
+        prev_record = self._exported_files.get(key)
+        self._exported_files[key] = record
+        self._update_references(
+            prev_record.get("dependencies", ()) if prev_record else (),
+            record.get("dependencies", ())
+        )
+        self._update_orphaned_file(key)
+        self._update_dependency_item(key, prev_record, record)
+        self._update_superseded_file(prev_record, record)
+
+    def remove_exported_file(self, url: Union[URL, str]):
+        key = str(url)
+
+        if self._superseded_files.pop(key, None) is not None:
+            if key in self._orphaned_files:
+                self._orphaned_files.remove(key)
+            return
+
+        prev_record = self._exported_files.pop(key, None)
+        if prev_record is not None:
+            self._update_references(prev_record.get("dependencies", ()), ())
+            self._update_orphaned_file(key)
+            self._update_dependency_item(key, prev_record, None)
+
+    def iter_exported_files(self) -> Iterable[Tuple[str, dict]]:
+        return self._exported_files.iteritems()
+
+    def clear_exported_files(self):
+        self._exported_files.clear()
+        self._reference_counts.clear()
+        self._orphaned_files.clear()
+        self._superseded_files.clear()
+        self._dependencies_by_item.clear()
+        self.references_complete = False
+
+    def get_reference_count(self, url: Union[URL, str]) -> int:
+        """Gives the number of exported files that reference the given
+        dependency.
+        """
+        return self._reference_counts.get(str(url), 0)
+
+    def iter_orphaned_files(self) -> Iterable[Tuple[str, dict]]:
+        """Iterates over the exported dependencies that are no longer
+        referenced by any other exported file.
+
+        Yields nothing until `references_complete` is set, since dependencies
+        without a recorded referrer may still be referenced by documents
+        exported before their references were recorded.
+
+        Files left behind at the previous path of a dependency (ie. when its
+        fingerprint changes) are included as well, keyed by their path, once
+        no exported content remains pending.
+        """
+        if not self.references_complete:
+            return
+
+        pending = None
+
+        for url in self._orphaned_files:
+            record = self._exported_files.get(url)
+            if record is None:
+                # Documents that reference a superseded file are invalidated
+                # along with it, but keep pointing to it until they are
+                # exported again
+                if pending is None:
+                    pending = self.has_pending_tasks()
+                if pending:
+                    continue
+                record = self._superseded_files[url]
+            yield url, record
+
+    def rebuild_reference_counts(self):
+
+        self._reference_counts.clear()
+        self._orphaned_files.clear()
+
+        for url, record in self._exported_files.iteritems():
+            for dependency in record.get("dependencies", ()):
+                self._reference_counts[dependency] = \
+                    self._reference_counts.get(dependency, 0) + 1
+
+        for url in self._exported_files.keys():
+            self._update_orphaned_file(url)
+
+        for key in self._superseded_files.keys():
+            self._orphaned_files.insert(key)
+
+    def _update_references(
+            self,
+            prev_dependencies: Sequence[str],
+            dependencies: Sequence[str]):
+
+        prev_dependencies = set(prev_dependencies)
+        dependencies = set(dependencies)
+
+        for url in dependencies - prev_dependencies:
+            self._reference_counts[url] = \
+                self._reference_counts.get(url, 0) + 1
+            self._update_orphaned_file(url)
+
+        for url in prev_dependencies - dependencies:
+            count = self._reference_counts.get(url, 0) - 1
+            if count > 0:
+                self._reference_counts[url] = count
+            else:
+                self._reference_counts.pop(url, None)
+            self._update_orphaned_file(url)
+
+    def _update_orphaned_file(self, url: str):
+
+        # Only files exported as dependencies can be orphaned; documents are
+        # removed by their own delete tasks
+        record = self._exported_files.get(url)
+        if (
+            record is not None
+            and record.get("kind") == "dependency"
+            and not self._reference_counts.get(url)
+        ):
+            self._orphaned_files.insert(url)
+        elif url in self._orphaned_files:
+            self._orphaned_files.remove(url)
+
+    def _update_superseded_file(
+            self,
+            prev_record: Optional[dict],
+            record: dict):
+
+        # Dependencies change their path along with their content when
+        # assets are fingerprinted. The file at the previous path is left
+        # behind, and becomes an orphaned file of its own.
+        path = record.get("export_path")
+
+        # A file may be exported again to a path it had superseded
+        if path is not None:
+            key = self._get_superseded_file_key(path)
+            if self._superseded_files.pop(key, None) is not None:
+                if key in self._orphaned_files:
+                    self._orphaned_files.remove(key)
+
+        if (
+            prev_record is not None
+            and prev_record.get("kind") == "dependency"
+            and prev_record.get("export_path") is not None
+            and tuple(prev_record["export_path"]) != tuple(path or ())
+        ):
+            key = self._get_superseded_file_key(prev_record["export_path"])
+            self._superseded_files[key] = prev_record
+            self._orphaned_files.insert(key)
+
+    def _get_superseded_file_key(self, export_path: Sequence[str]) -> str:
+        # Exported files are keyed by absolute URL; a path can't clash with
+        # them
+        return "/" + "/".join(export_path)
+
+    def iter_item_dependencies(self, item: Item) -> Iterable[str]:
+        """Iterates over the URLs of the files exported as dependencies
+        from the given item (ie. a file and all the renders of an image).
+        """
+        return iter(self._dependencies_by_item.get(item.id, ()))
+
+    def rebuild_dependency_items(self):
+
+        self._dependencies_by_item.clear()
+
+        for url, record in self._exported_files.iteritems():
+            self._update_dependency_item(url, None, record)
+
+    def _update_dependency_item(
+            self,
+            url: str,
+            prev_record: Optional[dict],
+            record: Optional[dict]):
+
+        def get_item_id(record):
+            if record is not None and record.get("kind") == "dependency":
+                return record.get("item")
+            return None
+
+        prev_item_id = get_item_id(prev_record)
+        item_id = get_item_id(record)
+
+        if prev_item_id == item_id:
+            return
+
+        if prev_item_id is not None:
+            urls = self._dependencies_by_item.get(prev_item_id)
+            if urls is not None and url in urls:
+                urls.remove(url)
+                if not urls:
+                    del self._dependencies_by_item[prev_item_id]
+
+        if item_id is not None:
+            urls = self._dependencies_by_item.get(item_id)
+            if urls is None:
+                urls = OOTreeSet()
+                self._dependencies_by_item[item_id] = urls
+            urls.insert(url)
+
+    def iter_pending_dependencies(self) -> Iterable[str]:
+        """Iterates over the URLs of the exported dependencies that must be
+        transferred again.
+        """
+        return iter(self._pending_dependencies)
+
+    def has_pending_dependencies(self) -> bool:
+        return bool(self._pending_dependencies)
+
+    def add_pending_dependency(self, url: Union[URL, str]):
+        self._pending_dependencies.insert(str(url))
+
+    def clear_pending_dependencies(
+            self,
+            urls: Iterable[Union[URL, str]] = None):
+        if urls is None:
+            self._pending_dependencies.clear()
+        else:
+            for url in urls:
+                key = str(url)
+                if key in self._pending_dependencies:
+                    self._pending_dependencies.remove(key)
+
+    def collect_garbage(
+            self,
+            exporter: Exporter = None,
+            batch_size: int = 1000,
+            dry_run: bool = False) -> Iterable[str]:
+        """Removes the exported dependencies that are no longer referenced by
+        any exported file.
+
+        Removing a dependency can orphan the dependencies referenced by it
+        (ie. the images used by a stylesheet), so the collection proceeds
+        until no orphaned files remain.
+
+        :param exporter: The exporter used to remove the files. Defaults to a
+            new exporter for the destination.
+
+        :param batch_size: The number of files removed with each call to
+            `~woost.extensions.staticpub.exporter.Exporter.remove_files`.
+
+        :param dry_run: If True, list the currently orphaned files without
+            removing them. Files that would become orphaned as a result of
+            removing those aren't listed.
+
+        :return: An iterable sequence with the URLs of the removed files.
+        """
+        if not self.incremental:
+            raise ValueError(
+                f"Can't collect garbage on {self}, since it doesn't support "
+                "incremental exports"
+            )
+
+        if not self.references_complete:
+            raise ValueError(
+                f"Can't collect garbage on {self} until a full export has "
+                "recorded the references between its files"
+            )
+
+        if dry_run:
+            for url, record in self.iter_orphaned_files():
+                yield url
+            return
+
+        if exporter is None:
+            exporter = self.create_exporter()
+
+        with exporter:
+            while True:
+                batch = list(islice(self.iter_orphaned_files(), batch_size))
+                if not batch:
+                    break
+
+                exporter.remove_files(
+                    [record["export_path"] for url, record in batch]
+                )
+
+                @transaction
+                def remove_records():
+                    for url, record in batch:
+                        self.remove_exported_file(url)
+
+                for url, record in batch:
+                    yield url
+
     def invalidate_exported_content(
         self,
         item,
@@ -276,6 +694,42 @@ class Destination(Item):
         )
         self._invalidate_exported_scope(scope)
 
+    def invalidate_exported_dependency(
+        self,
+        item,
+        language = None,
+        cache_part = None
+    ):
+        """Schedules the transfer of the files exported as dependencies from
+        an item whose binary content has changed, without exporting the
+        documents that reference them again.
+
+        The documents exported from the item itself are still invalidated.
+        Destinations that fingerprint their assets change the path of a file
+        whenever its content changes, so they must invalidate the documents
+        that reference the item as well. So must destinations that don't
+        know which files were exported from the item (ie. files exported
+        before their records were kept).
+        """
+        if (
+            self.fingerprint_assets
+            or item.id not in self._dependencies_by_item
+        ):
+            self.invalidate_exported_content(
+                item,
+                language=language,
+                cache_part=cache_part
+            )
+            return
+
+        for url in self.iter_item_dependencies(item):
+            self.add_pending_dependency(url)
+
+        for lang in iter_exportable_languages(item):
+            if (item.id, lang) in self._entry_tags:
+                pub_tasks = self._require_pub_tasks(item.id)
+                pub_tasks.setdefault(lang, "mod")
+
     def _invalidate_exported_scope(self, scope, task="mod"):
 
         # Invalidate everything
@@ -11,10 +11,11 @@ from BTrees.OOBTree import OOBTree
 from cocktail import schema
 from cocktail.javascriptserializer import JS
 from cocktail.events import event_handler
-from cocktail.persistence import PersistentMapping
 from woost import app
 from woost.models import Item, User, Publishable, LocaleMember
 
+from .taskmap import CompactTaskMap
+
 export_task_schema = schema.Schema(
     "woost.extensions.staticpub.export.export_task_schema",
     members = [
@@ -51,6 +52,8 @@ class Export(Item):
     members_order = [
         "user",
         "destination",
+        "mirrors",
+        "lane",
         "state",
         "tasks"
     ]
@@ -68,6 +71,26 @@ class Export(Item):
         required=True
     )
 
+    # Additional destinations that receive the same files as the main
+    # destination, sharing a single rendering of each file
+    mirrors = schema.Collection(
+        items="woost.extensions.staticpub.destination.Destination",
+        editable=schema.READ_ONLY,
+        related_end=schema.Collection()
+    )
+
+    # Exports in the interactive lane are meant for small, urgent changes;
+    # exports in the bulk lane pause at task boundaries to let them run
+    lane = schema.String(
+        editable=schema.READ_ONLY,
+        required=True,
+        default="bulk",
+        enumeration=[
+            "bulk",
+            "interactive"
+        ]
+    )
+
     state = schema.String(
         editable=schema.READ_ONLY,
         default="idle",
@@ -85,7 +108,7 @@ class Export(Item):
     tasks = schema.Mapping(
         editable=schema.NOT_EDITABLE,
         searchable=False,
-        type=OOBTree,
+        type=CompactTaskMap,
         keys=schema.Tuple(
             items=(schema.Integer(), LocaleMember())
         ),
@@ -94,6 +117,19 @@ class Export(Item):
 
     auth_token = None
 
+    # Indicates that the export covers all exportable content; completing
+    # such an export records the references of every document exported to
+    # its destinations
+    full = False
+
+    # A summary of the time spent on each phase of the export, as produced by
+    # woost.extensions.staticpub.profiler.ExportProfiler
+    profile = None
+
+    def __init__(self, *args, **kwargs):
+        Item.__init__(self, *args, **kwargs)
+        self._dependencies = OOBTree()
+
     def renew_auth_token(self):
         if self.user:
             self.auth_token = app.authentication.create_auth_token(
@@ -117,36 +153,115 @@ class Export(Item):
                 "woost.models.Publishable"
             )
 
-        key = (item.id, language)
-        task = self.tasks.get(key)
-        if task is None:
-            task = PersistentMapping({
-                "item": item,
-                "language": language
-            })
-            self.tasks[key] = task
-
+        task = self.tasks.add(item, language, action)
         task["action"] = action
         task["state"] = "pending"
         task["error_message"] = None
         return task
 
+    def get_dependency_state(self, url):
+        return self._dependencies.get(str(url))
+
+    def set_dependency_state(self, url, state):
+        """Records the transfer state of a dependency found by the export.
+
+        Dependencies are stored with the export so that resuming an
+        interrupted export can carry on transferring them, even if the
+        documents that referenced them have already been exported.
+
+        :param state: One of "pending", "success" or "failed". None removes
+            the dependency.
+        """
+        key = str(url)
+        if state is None:
+            self._dependencies.pop(key, None)
+        elif self._dependencies.get(key) != state:
+            self._dependencies[key] = state
+
     @property
-    def progress(self):
+    def destinations(self):
+        """The main destination of the export, followed by its mirrors."""
+        return [self.destination] + list(self.mirrors)
 
-        total = 0
-        completed = 0
+    def add_mirror(self, destination):
+        """Sends the files exported to the main destination to another
+        destination as well.
 
-        for task in self.tasks.itervalues():
-            total += 1
-            if task["state"] != "pending":
-                completed += 1
+        Files are rendered once and written to all destinations, so the
+        mirror must share the layout of the main destination (see
+        `~woost.extensions.staticpub.destination.Destination.get_layout`).
+        """
+        if destination is self.destination or destination in self.mirrors:
+            raise ValueError(f"{destination} is already a target of {self}")
 
+        if destination.get_layout() != self.destination.get_layout():
+            raise ValueError(
+                f"Can't mirror {self.destination} to {destination}, since "
+                "their layouts differ"
+            )
+
+        self.mirrors.append(destination)
+
+    def add_pending_dependencies(self):
+        """Schedules the transfer of the dependencies that are pending on
+        the destinations of the export.
+        """
+        for destination in self.destinations:
+            for url in destination.iter_pending_dependencies():
+                self.set_dependency_state(url, "pending")
+
+    def iter_dependencies(self):
+        return self._dependencies.items()
+
+    def clear_dependencies(self):
+        self._dependencies.clear()
+
+    @property
+    def progress(self):
+
+        total = len(self.tasks)
         if not total:
             return 0.0
 
+        completed = total - self.tasks.count("pending")
         return float(completed) / total
 
+    @property
+    def cancellation_path(self):
+        """The path of the control file that signals the cancellation of the
+        export to the job executing it.
+        """
+        return app.path("x-staticpub-cancellations", str(self.id))
+
+    def cancel(self) -> bool:
+        """Stops the execution of the export.
+
+        The export job executing the operation (possibly in another process)
+        watches for a control file, and stops within a second of its
+        creation, without having to poll the database. The state of the
+        export is changed as well, and must be committed by the caller.
+
+        Exports that are not running are left untouched.
+
+        :return: True if the export was cancelled, False if it wasn't
+            running.
+        """
+        if self.state != "running":
+            return False
+
+        path = self.cancellation_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w"):
+            pass
+        self.state = "idle"
+        return True
+
+    def clear_cancellation(self):
+        try:
+            os.remove(self.cancellation_path)
+        except FileNotFoundError:
+            pass
+
     def create_export_job(self):
         return self.destination.export_job_class(self)
 
@@ -163,6 +278,7 @@ class Export(Item):
     def handle_changed(e):
         if e.member is Export.state:
             if e.value == "running":
+                e.source.clear_cancellation()
                 if e.source.user and not e.source.auth_token:
                     e.source.renew_auth_token()
             elif e.value == "completed":
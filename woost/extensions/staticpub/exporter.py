@@ -2,10 +2,26 @@
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
+from typing import BinaryIO, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+
+class StoredFile(NamedTuple):
+    """A file found at the location targeted by an exporter.
+
+    :var path: The path of the file, relative to the root of the exporter.
+    :var size: The size of the file, in bytes, if known.
+    :var etag: An opaque validator for the content of the file, as given by
+        the storage backend (ie. the ETag of an S3 object).
+    """
+    path: Tuple[str, ...]
+    size: Optional[int] = None
+    etag: Optional[str] = None
 
 
 class Exporter:
 
+    stream_chunk_size: int = 1024 * 1024
+
     def __enter__(self):
         self.open()
         return self
@@ -19,9 +35,76 @@ class Exporter:
     def close(self):
         pass
 
-    def write_file(self, path, content, content_type=None):
+    def write_file(
+            self,
+            path,
+            content,
+            content_type=None,
+            cache_control=None):
         raise ValueError("Not implemented")
 
+    def write_stream(
+            self,
+            path: Sequence[str],
+            stream: BinaryIO,
+            content_type: str = None,
+            cache_control: str = None):
+        """Writes a file from a readable binary stream.
+
+        Exporters that can write files incrementally should override this
+        method; the default implementation reads the whole stream into memory
+        and calls `write_file`.
+        """
+        self.write_file(
+            path,
+            stream.read(),
+            content_type=content_type,
+            cache_control=cache_control
+        )
+
     def delete_file(self, path, content):
         raise ValueError("Not implemented")
 
+    def remove_files(self, paths: Iterable[Sequence[str]]):
+        """Removes several files at once.
+
+        Exporters that support removing files in bulk should override this
+        method; the default implementation calls `remove_file` for each path.
+        """
+        for path in paths:
+            self.remove_file(path)
+
+    def iter_stored_files(
+            self,
+            prefix: Sequence[str] = ()) -> Iterable[StoredFile]:
+        """Lists the files stored at the location targeted by the exporter.
+
+        :param prefix: Limits the listing to files under the given path.
+        """
+        raise ValueError("Not implemented")
+
+    def get_stored_size(
+            self,
+            size: int,
+            content_type: str = None) -> Optional[int]:
+        """Predicts the size of a file once stored by the exporter.
+
+        :param size: The size of the exported content, in bytes.
+        :param content_type: The MIME type of the exported content.
+
+        :return: The size of the stored file, or None if it can't be
+            predicted (ie. because the exporter compresses the content).
+        """
+        return size
+
+    def get_stored_digest(self, stored_file: StoredFile) -> Optional[str]:
+        """Obtains the digest of the content of a stored file, in the same
+        format produced by
+        `~woost.extensions.staticpub.utils.get_content_digest`.
+
+        Must be safe to call from multiple threads at once.
+
+        :return: The digest, or None if it can't be determined.
+        """
+        return None
+
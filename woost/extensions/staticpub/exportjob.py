@@ -2,13 +2,32 @@
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
-from typing import Dict, Iterable, Sequence, Tuple
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Dict,
+    Callable,
+    Iterable,
+    List,
+    Sequence,
+    Optional,
+    Set,
+    Tuple
+)
+import os
 import re
+import shutil
+import tempfile
 import weakref
+import multiprocessing
+from collections import deque
+from concurrent import futures
+from contextlib import ExitStack, nullcontext
+from datetime import datetime, timedelta
 from itertools import zip_longest
+from threading import Event as ThreadEvent, Thread, local
+from time import monotonic, sleep
 
-import requests
-from bs4 import BeautifulSoup, Tag
 from cocktail.events import Event
 from cocktail.translations import language_context
 from cocktail.urls import URL
@@ -17,26 +36,93 @@ from woost import app
 from woost.urls import URLResolution
 from woost.models import Configuration, File, PublishableObject
 
+from .changeset import Changeset
+from .crawlstate import (
+    CrawlState,
+    MemoryCrawlState,
+    SQLiteCrawlState,
+    LRUCache
+)
+from .css import (
+    CSSReference,
+    iter_css_references,
+    rewrite_css,
+    css_url_is_relative
+)
 from .exporter import Exporter
-from .utils import EXPORT_HEADER, USER_AGENT
-
-ResourceWithinDocument = Tuple[Tag, str, URL, str]
+from .lease import LeaseLost
+from .postprocessing import (
+    AddReference,
+    ContentPreparer,
+    ContentReference,
+    HTMLReference,
+    PreparedContent,
+    escape_reference
+)
+from .profiler import ExportProfiler
+from .taskordering import TaskOrdering, default_task_ordering
+from .utils import (
+    EXPORT_HEADER,
+    USER_AGENT,
+    DigestReader,
+    get_content_digest,
+    get_origin
+)
+
+# Parsing and HTTP libraries are slow to import; they are only loaded once an
+# export job actually runs
+if TYPE_CHECKING:
+    import requests
+    from bs4 import BeautifulSoup, Tag
+    from .destination import Destination
 
 
 class ExportJob:
 
     export = None
     exporter = None
-    dependencies = None
+    mirrors: List[Tuple['Destination', Exporter]] = None
+    crawl_state: CrawlState = None
+    spill = False
+    spill_path: str = None
+    resolution_cache_size = 10000
     reset = False
+    reuse_exported_files = True
+    conditional_requests = True
     errors = "resume" # "resume" or "raise"
     encoding = "utf-8"
+    profiler: ExportProfiler = None
+    profiled_urls = 10
+    dependency_workers = 4
+    max_queued_dependencies = 100
+    dependency_commit_size = 100
+    process_workers = 0
+    max_queued_documents = None
+    content_preparer_class = ContentPreparer
+    task_ordering: TaskOrdering = default_task_ordering
+    task_ordering_batch_size: int = 10000
+    cache_processed_css = True
+    processed_css_cache_size = 1000
+    max_embedded_javascript_size = 512 * 1024
+    stream_threshold = 8 * 1024 * 1024
+    processed_content_types = frozenset(["text/html", "text/css"])
+    prepared_content_types = frozenset(["text/html"])
+    changeset: Changeset = None
+    dry_run = False
+    lease_duration = timedelta(minutes=10)
+    lease_poll_interval = 2
+    lane_check_interval = 5
+    cancellation_check_interval = 0.5
+    state_check_interval = 30
 
     selecting_export_urls = Event()
     export_starting = Event()
     export_failed = Event()
     export_completed = Event()
     export_ended = Event()
+    waiting_for_lease = Event()
+    export_paused = Event()
+    export_resumed = Event()
     task_starting = Event()
     task_executed = Event()
     task_successful = Event()
@@ -44,8 +130,17 @@ class ExportJob:
     dependency_transfers_starting = Event()
     dependency_transfer_starting = Event()
     dependency_transfer_successful = Event()
+    dependency_transfer_skipped = Event()
     dependency_transfer_failed = Event()
+    file_changed = Event()
 
+    css_ignored_url_regexp = re.compile(
+        r"^(javascript|data|about|mailto):",
+        re.IGNORECASE
+    )
+    # No longer used by the job, which tokenizes stylesheets and scripts
+    # instead (see the css and javascript modules); kept for subclasses that
+    # refer to them
     css_url_regexp = re.compile(r"""url\(([^)]+)\)""")
     js_string_regexp = re.compile(
         r"""
@@ -56,15 +151,16 @@ class ExportJob:
         """,
         re.VERBOSE
     )
+
     js_url_regexp = re.compile(
         r"""
         (?P<head>
-            (\s+src\s*=|\s+href\s*=|\Wurl\()
+            ((?<=\s)src\s*=|(?<=\s)href\s*=|(?<=\W)url\()
             \s*
             \\?
             ['"]?
         )
-        (?P<url>.*?)
+        (?P<url>[^'"()\\\s]*)
         (?P<tail>['")\\])
         """,
         re.VERBOSE
@@ -73,14 +169,85 @@ class ExportJob:
     def __init__(self, export):
         self.export = export
         self.exporter = self.create_exporter()
-        self.document_urls = set()
-        self.dependencies = set()
-        self.pending_dependencies = set()
-        self.__url_resolutions = {}
+        self.content_preparer = self.create_content_preparer()
+        self.mirrors = [
+            (mirror, mirror.create_mirror_exporter(export))
+            for mirror in export.mirrors
+        ]
+        self.__url_resolutions = LRUCache(self.resolution_cache_size)
+        self.__css_references = LRUCache(self.processed_css_cache_size)
+        self.__processed_css = LRUCache(self.processed_css_cache_size)
+        self.__http = local()
+        self.__dependency_executor = None
+        self.__mirror_executor = None
+        self.__dependency_transfers = {}
+        self.__process_pool = None
+        self.__document_executor = None
+        self.__prefetched_documents = {}
+        self.__dependency_states = {}
+        self.__dependency_records = {}
+        self.__dependency_paths = {}
+        self.__resolving_dependencies = set()
+        self.__leased = False
+        self.__yielding = False
+        self.__lease_renewed_at = None
+        self.__lanes_checked_at = monotonic()
+        self.__state_checked_at = monotonic()
+        self.__cancellation_watcher = None
+        self.__cancellation_watcher_stop = None
+        self.cancelled = ThreadEvent()
 
     def create_exporter(self, **kwargs) -> Exporter:
         return self.export.destination.create_exporter(**kwargs)
 
+    def create_crawl_state(self) -> CrawlState:
+        # Created once the job starts executing, so that `spill` and
+        # `spill_path` can be set after creating the job
+        if self.spill:
+            return SQLiteCrawlState(self.spill_path)
+        return MemoryCrawlState()
+
+    def create_content_preparer(self) -> ContentPreparer:
+        preparer = self.content_preparer_class()
+        preparer.js_url_regexp = self.js_url_regexp
+        preparer.max_embedded_javascript_size = \
+            self.max_embedded_javascript_size
+        return preparer
+
+    def create_process_pool(self) -> futures.Executor:
+        # Forking a process with running threads is unsafe
+        return futures.ProcessPoolExecutor(
+            self.process_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def get_http_session(self) -> 'requests.Session':
+        """Gets the HTTP session used by the current thread to request
+        resources from the origin, so that connections can be reused.
+        """
+        session = getattr(self.__http, "session", None)
+        if session is None:
+            import requests
+            session = self.__http.session = requests.Session()
+        return session
+
+    @property
+    def document_urls(self):
+        return self.crawl_state.document_urls
+
+    @property
+    def dependencies(self):
+        return self.crawl_state.dependencies
+
+    @property
+    def pending_dependencies(self):
+        return self.crawl_state.pending_dependencies
+
+    def measure(self, phase: str, url: URL = None, kind: str = None):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.measure(phase, url, kind)
+
     def get_export_urls(
             self,
             item: PublishableObject,
@@ -115,45 +282,532 @@ class ExportJob:
             if self.reset:
                 for task in self.export.tasks.itervalues():
                     task["state"] = "pending"
+                self.export.clear_dependencies()
+
+        self.crawl_state = self.create_crawl_state()
 
-        with self.exporter:
+        with ExitStack() as exporters:
+
+            # Dry runs don't open the exporters, so they don't touch the
+            # destinations at all
+            if not self.dry_run:
+                exporters.enter_context(self.exporter)
+                for mirror, exporter in self.mirrors:
+                    exporters.enter_context(exporter)
+
+                if self.mirrors:
+                    self.__mirror_executor = futures.ThreadPoolExecutor(
+                        len(self.mirrors),
+                        thread_name_prefix="staticpub-mirrors"
+                    )
 
             self.export_starting()
 
+            if self.dependency_workers:
+                self.__dependency_executor = futures.ThreadPoolExecutor(
+                    self.dependency_workers,
+                    thread_name_prefix="staticpub-dependencies"
+                )
+
+            # Parsing and serializing content is CPU bound; offload it to a
+            # pool of processes, and fetch documents ahead of their tasks so
+            # that several of them can be processed at once
+            if self.process_workers:
+                self.__process_pool = self.create_process_pool()
+                self.__document_executor = futures.ThreadPoolExecutor(
+                    self.process_workers,
+                    thread_name_prefix="staticpub-documents"
+                )
+
             try:
-                for task in self.export.tasks.itervalues():
+                self.watch_cancellation()
+                self.acquire_leases()
+                self.collect_document_urls()
+                self.restore_dependency_frontier()
 
-                    # Ignore completed / failed tasks
-                    if task["state"] != "pending":
-                        continue
+                for task in self.prefetch_documents(self.iter_pending_tasks()):
 
                     # Give other scripts a chance to abort the export operation
-                    datastore.sync()
-                    if self.export.state != "running":
-                        raise Halt()
-
+                    self.check_cancellation()
+                    self.yield_to_higher_priority_exports()
                     self.execute_task(task)
 
+                    # Transfer dependencies while exporting documents
+                    self.transfer_dependencies()
+
                 if self.dependencies:
                     self.export_dependencies()
 
             except Halt:
-                pass
+                self.commit_dependencies()
+                self.export.clear_cancellation()
             except Exception as error:
+                dependency_states = self.take_dependency_states()
+                dependency_records = self.take_dependency_records()
+
                 @transaction
                 def complete():
                     self.export.state = "idle"
+                    self.store_dependency_states(
+                        dependency_states,
+                        dependency_records
+                    )
+
                 self.export_failed(error=error)
                 if self.errors == "raise":
                     raise
             else:
+                dependency_states = self.take_dependency_states()
+                dependency_records = self.take_dependency_records()
+
                 @transaction
                 def complete():
+                    self.store_dependency_states(
+                        dependency_states,
+                        dependency_records
+                    )
                     self.export.state = "completed"
+                    self.export.clear_dependencies()
+                    if (
+                        self.export.full
+                        and not self.dry_run
+                        and not self.export.tasks.count("failed")
+                    ):
+                        for destination in self.export.destinations:
+                            if destination.incremental:
+                                destination.references_complete = True
+
                 self.export_completed()
             finally:
+                self.stop_watching_cancellation()
+                if self.__dependency_executor is not None:
+                    self.__dependency_executor.shutdown(cancel_futures=True)
+                    self.__dependency_executor = None
+                    self.__dependency_transfers.clear()
+                if self.__mirror_executor is not None:
+                    self.__mirror_executor.shutdown()
+                    self.__mirror_executor = None
+                if self.__document_executor is not None:
+                    self.__document_executor.shutdown(cancel_futures=True)
+                    self.__document_executor = None
+                    self.discard_prefetched_documents()
+                if self.__process_pool is not None:
+                    self.__process_pool.shutdown(cancel_futures=True)
+                    self.__process_pool = None
+                if self.profiler is not None:
+                    self.profiler.stop()
+                    self.store_profile()
                 self.export_ended()
-                self.exporter.close()
+                if not self.dry_run:
+                    self.exporter.close()
+                self.crawl_state.close()
+                if self.__leased:
+                    transaction(self.release_leases)
+                    self.__leased = False
+
+    def acquire_leases(self):
+        """Waits until the job can write to the destinations of the export.
+
+        The job must claim the lane of the export on all its destinations,
+        and exports in lower priority lanes must have paused at a task
+        boundary.
+        """
+        if self.dry_run:
+            return
+
+        waiting = False
+
+        while True:
+            self.check_cancellation(sync=True)
+
+            if not self.__leased:
+                self.__leased = transaction(self.update_leases)
+            else:
+                self.renew_leases()
+
+            if self.__leased and self.lower_priority_exports_paused():
+                break
+
+            if not waiting:
+                waiting = True
+                self.waiting_for_lease()
+
+            sleep(self.lease_poll_interval)
+
+    def update_leases(self, yielding: bool = False) -> bool:
+        """Claims or renews the lane of the export on all its destinations.
+
+        Should be called within a transaction.
+
+        :return: True if the lane was claimed on all destinations, False if
+            another export is holding it on any of them.
+        """
+        destinations = self.export.destinations
+
+        if not all(
+            destination.can_acquire_lease(self.export)
+            for destination in destinations
+        ):
+            return False
+
+        for destination in destinations:
+            destination.acquire_lease(
+                self.export,
+                self.lease_duration,
+                yielding
+            )
+
+        self.__yielding = yielding
+        self.__lease_renewed_at = monotonic()
+        return True
+
+    def renew_leases(self, yielding: bool = None):
+        """Renews the leases held by the job before they expire."""
+
+        if yielding is None:
+            yielding = self.__yielding
+
+        renewal_due = (
+            monotonic() - self.__lease_renewed_at
+            >= self.lease_duration.total_seconds() / 2
+        )
+        if yielding == self.__yielding and not renewal_due:
+            return
+
+        if not transaction(self.update_leases, action_args=(yielding,)):
+            raise LeaseLost(
+                f"{self.export} lost its lease on the {self.export.lane} lane"
+            )
+
+    def release_leases(self):
+        for destination in self.export.destinations:
+            destination.release_lease(self.export)
+
+    def get_lanes(self) -> Tuple[Sequence[str], Sequence[str]]:
+        """Gives the lanes with a higher and a lower priority than the lane
+        of the export.
+        """
+        lanes = self.export.destination.export_lanes
+        index = lanes.index(self.export.lane)
+        return lanes[:index], lanes[index + 1:]
+
+    def higher_priority_exports_running(self) -> bool:
+        higher_lanes, lower_lanes = self.get_lanes()
+        return any(
+            destination.get_lease(lane) is not None
+            for destination in self.export.destinations
+            for lane in higher_lanes
+        )
+
+    def lower_priority_exports_paused(self) -> bool:
+        higher_lanes, lower_lanes = self.get_lanes()
+        for destination in self.export.destinations:
+            for lane in lower_lanes:
+                lease = destination.get_lease(lane)
+                if lease is not None and not lease.yielding:
+                    return False
+        return True
+
+    def yield_to_higher_priority_exports(self):
+        """Pauses the job while exports in higher priority lanes are
+        running.
+
+        Should only be called at task boundaries, when the job isn't writing
+        to its destinations.
+        """
+        self.__lanes_checked_at = monotonic()
+
+        if not self.__leased:
+            return
+
+        if not self.higher_priority_exports_running():
+            self.renew_leases()
+            return
+
+        self.renew_leases(yielding=True)
+        self.export_paused()
+
+        while True:
+            sleep(self.lease_poll_interval)
+            self.check_cancellation(sync=True)
+
+            if self.higher_priority_exports_running():
+                self.renew_leases()
+            elif transaction(self._resume):
+                break
+
+        self.export_resumed()
+
+    def _resume(self) -> bool:
+
+        # Checked again within the transaction that clears the yielding flag:
+        # an export claiming a higher priority lane at the same time causes a
+        # conflict
+        if self.higher_priority_exports_running():
+            return False
+
+        if not self.update_leases(yielding=False):
+            raise LeaseLost(
+                f"{self.export} lost its lease on the {self.export.lane} lane"
+            )
+
+        return True
+
+    def check_lanes(self):
+        """Renews leases and yields to higher priority exports during long
+        stretches of work without task boundaries, such as the transfer of
+        dependencies after all documents have been exported.
+        """
+        if monotonic() - self.__lanes_checked_at >= self.lane_check_interval:
+            datastore.sync()
+            self.yield_to_higher_priority_exports()
+
+    def watch_cancellation(self):
+        """Starts a thread that watches for the cancellation of the export
+        (see `~woost.extensions.staticpub.export.Export.cancel`).
+
+        The thread only checks for the presence of a file, so cancellations
+        take effect quickly, without polling the database.
+        """
+        self.__cancellation_watcher_stop = ThreadEvent()
+        self.__cancellation_watcher = Thread(
+            target=self._watch_cancellation,
+            args=(
+                self.export.cancellation_path,
+                self.__cancellation_watcher_stop
+            ),
+            name="staticpub-cancellation",
+            daemon=True
+        )
+        self.__cancellation_watcher.start()
+
+    def _watch_cancellation(self, path: str, stop: ThreadEvent):
+        # Runs on its own thread: shouldn't touch the database
+        while not stop.wait(self.cancellation_check_interval):
+            if os.path.exists(path):
+                self.cancelled.set()
+                break
+
+    def stop_watching_cancellation(self):
+        if self.__cancellation_watcher is not None:
+            self.__cancellation_watcher_stop.set()
+            self.__cancellation_watcher.join()
+            self.__cancellation_watcher = None
+
+    def check_cancellation(self, sync: bool = False):
+        """Raises `Halt` if the export has been cancelled.
+
+        Besides the cancellation flag, the state of the export is checked
+        against the database every `state_check_interval` seconds, or on
+        demand.
+
+        :param sync: Set to True to check the state of the export right away.
+        """
+        if self.cancelled.is_set():
+            raise Halt()
+
+        if (
+            sync
+            or monotonic() - self.__state_checked_at
+            >= self.state_check_interval
+        ):
+            datastore.sync()
+            self.__state_checked_at = monotonic()
+            if self.export.state != "running":
+                raise Halt()
+
+    def prefetch_documents(self, tasks: Iterable[dict]) -> Iterable[dict]:
+        """Starts fetching and preparing the documents for upcoming tasks
+        in the background, while the given tasks are iterated.
+
+        Only has an effect if the job uses a pool of processes (see
+        `process_workers`).
+        """
+        if self.__document_executor is None:
+            yield from tasks
+            return
+
+        max_queued = self.max_queued_documents or self.process_workers * 2
+        queue = deque()
+
+        for task in tasks:
+            queue.append(task)
+            if task["action"] == "post":
+                # Errors are reported when the task is executed
+                try:
+                    self.prefetch_task_documents(task)
+                except Exception:
+                    pass
+            if len(queue) > max_queued:
+                yield queue.popleft()
+
+        while queue:
+            yield queue.popleft()
+
+    def prefetch_task_documents(self, task: dict):
+        for source_url in self.get_export_urls(task["item"], task["language"]):
+            key = str(source_url)
+            if key not in self.__prefetched_documents:
+                resource = ExportedResource(self, source_url)
+                resource.language = task["language"]
+                self.__prefetched_documents[key] = \
+                    self.__document_executor.submit(
+                        self.fetch_document,
+                        resource,
+                        self.get_request_parameters(resource)
+                    )
+
+    def fetch_document(
+            self,
+            resource: 'ExportedResource',
+            request_parameters: dict) -> 'ExportedResource':
+        # Runs on the document workers: shouldn't touch the database
+        if self.cancelled.is_set():
+            raise Halt()
+        with self.measure("fetch", resource.source_url, "task"):
+            resource.open(**request_parameters)
+        try:
+            self.prepare_resource(resource)
+        except:
+            resource.close()
+            raise
+        return resource
+
+    def discard_prefetched_documents(self):
+        for future in self.__prefetched_documents.values():
+            if (
+                not future.cancel()
+                and not future.cancelled()
+                and future.exception() is None
+            ):
+                future.result().close()
+        self.__prefetched_documents.clear()
+
+    def prepare_resource(self, resource: 'ExportedResource'):
+        """Parses and serializes the content of a resource on the pool of
+        processes, leaving placeholders for its references.
+
+        Runs on worker threads, which wait for the pool; the references are
+        resolved later, from the main thread (see `process_resource`).
+        """
+        if (
+            self.__process_pool is not None
+            and not resource.streamed
+            and resource.status == 200
+            and resource.content_type in self.prepared_content_types
+        ):
+            with self.measure("prepare", resource.source_url):
+                resource.prepared = self.__process_pool.submit(
+                    self.content_preparer.prepare,
+                    resource.content,
+                    resource.content_type
+                ).result()
+
+    def iter_pending_tasks(self) -> Iterable[dict]:
+        """Iterates over the tasks that remain to be executed, in the order
+        established by `task_ordering`.
+
+        Tasks are sorted in batches of `task_ordering_batch_size` pending
+        tasks, taken in key order, so that the job can start exporting
+        documents without loading the items of every task first. Setting
+        the size to None sorts all the tasks at once.
+        """
+        # Ignore completed / failed tasks
+        tasks = (
+            task
+            for task in self.export.tasks.itervalues()
+            if task["state"] == "pending"
+        )
+
+        if self.task_ordering is None:
+            yield from tasks
+        elif self.task_ordering_batch_size is None:
+            yield from self.task_ordering.sort(tasks)
+        else:
+            batch = []
+            for task in tasks:
+                batch.append(task)
+                if len(batch) == self.task_ordering_batch_size:
+                    yield from self.task_ordering.sort(batch)
+                    batch = []
+            if batch:
+                yield from self.task_ordering.sort(batch)
+
+    def collect_document_urls(self):
+
+        # Knowing all documents in advance prevents them from being
+        # transferred as dependencies when they are found before their own
+        # task has been executed
+        for task in self.export.tasks.itervalues():
+            if task["action"] == "post":
+                for url in self.get_export_urls(
+                    task["item"],
+                    task["language"]
+                ):
+                    self.document_urls.add(url)
+
+    def restore_dependency_frontier(self):
+
+        # Resumed exports carry on with the dependencies found before they
+        # were interrupted, including those referenced only by documents
+        # that have already been exported
+        for url, state in self.export.iter_dependencies():
+            if url in self.document_urls:
+                continue
+            self.dependencies.add(url)
+            if state == "pending":
+                self.pending_dependencies.add(URL(url))
+
+    def take_dependency_states(self) -> Dict[str, str]:
+        """Obtains the dependency states that haven't been persisted yet,
+        clearing them from the job.
+
+        The returned states should be passed to `store_dependency_states`
+        within a transaction.
+        """
+        states = self.__dependency_states
+        self.__dependency_states = {}
+        return states
+
+    def take_dependency_records(self) -> Dict[str, dict]:
+        """Obtains the records for exported dependencies that haven't been
+        persisted yet, clearing them from the job.
+
+        The returned records should be passed to `store_dependency_states`
+        within a transaction, along with the states taken at the same time.
+        """
+        records = self.__dependency_records
+        self.__dependency_records = {}
+        return records
+
+    def store_dependency_states(
+            self,
+            states: Dict[str, str],
+            records: Dict[str, dict] = None):
+
+        if records:
+            for url, record in records.items():
+                self.set_exported_file(url, record)
+
+        completed = []
+
+        for url, state in states.items():
+            self.export.set_dependency_state(url, state)
+            if state is None or state == "success":
+                completed.append(url)
+
+        # Dry runs leave the destinations untouched
+        if completed and not self.dry_run:
+            for destination in self.export.destinations:
+                destination.clear_pending_dependencies(completed)
+
+    def store_profile(self):
+
+        profile = self.profiler.get_summary(self.profiled_urls)
+
+        @transaction
+        def store():
+            self.export.profile = profile
 
     def execute_task(self, task: dict):
 
@@ -165,69 +819,394 @@ class ExportJob:
 
         try:
             tags = set()
+            exported_files = {}
 
             for source_url in self.get_export_urls(item, language):
+                with self.measure("task", source_url, "task"):
+                    if action == "post":
+                        exported_files[source_url] = self.export_document(
+                            source_url,
+                            item,
+                            language,
+                            tags
+                        )
+                    elif action == "delete":
+                        self.delete_document(source_url)
+                        exported_files[source_url] = None
 
-                if action == "post":
-                    resource = ExportedResource(self, source_url)
-                    resource.language = language
-                    resource.open(**self.get_request_parameters(resource))
+            self.task_executed(task=task)
 
-                    url_tags = resource.headers.get("X-Woost-Cache-Tags")
-                    if url_tags:
-                        tags.update(url_tags.split())
+        except Halt:
+            raise
+        except Exception as export_error:
+            if self.errors == "raise":
+                raise
+        else:
+            export_error = None
 
-                    self.process_resource(resource)
+        dependency_states = self.take_dependency_states()
+        dependency_records = self.take_dependency_records()
+
+        with self.measure("commit"):
+            transaction(
+                self.update_task,
+                action_args=(
+                    task,
+                    tags,
+                    exported_files,
+                    export_error,
+                    dependency_states,
+                    dependency_records
+                )
+            )
 
-                    # Prevent documents from also being downloaded as
-                    # dependencies
-                    self.document_urls.add(resource.source_url)
-                    self.dependencies.discard(resource.source_url)
-                    self.pending_dependencies.discard(resource.source_url)
+        if export_error:
+            self.task_failed(task=task, error=export_error)
+        else:
+            self.task_successful(task=task)
 
-                    self.exporter.write_file(
-                        resource.export_path,
-                        resource.content,
-                        content_type=resource.content_type
+    def update_task(
+            self,
+            task: dict,
+            tags: Set[str],
+            exported_files: Dict[str, dict],
+            export_error: Exception = None,
+            dependency_states: Dict[str, str] = None,
+            dependency_records: Dict[str, dict] = None):
+
+        language = task["language"]
+
+        if dependency_states or dependency_records:
+            self.store_dependency_states(
+                dependency_states or {},
+                dependency_records
+            )
+
+        if export_error:
+            task["state"] = "failed"
+            task["error_message"] = repr(export_error)
+        else:
+            task["state"] = "success"
+
+            # Dry runs leave the destinations untouched
+            if not self.dry_run:
+                publishable = task["item"]
+                for destination in self.export.destinations:
+                    destination.set_pending_task(
+                        publishable,
+                        language,
+                        None
                     )
+                    destination.set_exported_content_tags(
+                        publishable,
+                        language,
+                        tags
+                    )
+                for url, record in exported_files.items():
+                    if record is None:
+                        self.remove_exported_file(url)
+                    else:
+                        self.set_exported_file(url, record)
 
-                elif action == "delete":
-                    export_path = \
-                        self.export.destination.get_export_path(source_url)
-                    self.exporter.remove_file(export_path)
+    def export_document(
+            self,
+            source_url: URL,
+            item: PublishableObject,
+            language: str,
+            tags: Set[str]) -> dict:
 
-            self.task_executed(task=task)
+        prefetched = self.__prefetched_documents.pop(str(source_url), None)
 
-        except Exception as export_error:
-            if self.errors == "raise":
-                raise
+        # The fetch itself is measured by the worker that prefetched the
+        # document; the main thread only waits for it
+        if prefetched is not None:
+            with self.measure("wait"):
+                resource = prefetched.result()
         else:
-            export_error = None
+            resource = ExportedResource(self, source_url)
+            resource.language = language
+            with self.measure("fetch"):
+                resource.open(**self.get_request_parameters(resource))
 
-        @transaction
-        def update_task():
+        try:
+            return self._export_document(resource, item, language, tags)
+        finally:
+            resource.close()
 
-            if export_error:
-                task["state"] = "failed"
-                task["error_message"] = repr(export_error)
-            else:
-                task["state"] = "success"
-                publishable = task["item"]
-                self.export.destination.set_pending_task(
-                    publishable,
-                    language,
-                    None
+    def _export_document(
+            self,
+            resource: 'ExportedResource',
+            item: PublishableObject,
+            language: str,
+            tags: Set[str]) -> dict:
+
+        destination = self.export.destination
+        record = self.get_reusable_record(resource.source_url)
+        exported_at = datetime.now()
+
+        # Prevent documents from also being downloaded as dependencies
+        self.document_urls.add(resource.source_url)
+        self.dependencies.discard(resource.source_url)
+        self.pending_dependencies.discard(resource.source_url)
+
+        url_tags = resource.headers.get("X-Woost-Cache-Tags")
+        if url_tags:
+            tags.update(url_tags.split())
+
+        # The destination already holds the current version of the document
+        if resource.not_modified:
+            if not url_tags:
+                tags.update(
+                    destination.get_exported_content_tags(item, language)
+                    or ()
                 )
-                self.export.destination.set_exported_content_tags(
-                    publishable,
-                    language,
-                    tags
+            self.restore_dependencies(record)
+        else:
+            self.process_resource(resource)
+            self.write_resource(resource)
+
+        record = self.create_export_record(resource, exported_at, record)
+
+        # Keep track of the task that exported each document
+        record["item"] = item.id
+        record["language"] = language
+        return record
+
+    def delete_document(self, source_url: URL):
+
+        export_path = self.export.destination.get_export_path(source_url)
+
+        if not self.dry_run:
+            with self.measure("write"):
+                self.write_to_exporters(
+                    export_path,
+                    lambda exporter, path: exporter.remove_file(path)
                 )
 
-        if export_error:
-            self.task_failed(task=task, error=export_error)
+        self.add_file_change(
+            "deleted",
+            source_url,
+            export_path,
+            previous_record=self.get_previous_record(source_url)
+        )
+
+    def write_resource(self, resource: 'ExportedResource'):
+
+        export_path = resource.export_path
+
+        if resource.fingerprint:
+            cache_control = self.export.destination.fingerprinted_cache_control
         else:
-            self.task_successful(task=task)
+            cache_control = None
+
+        with self.measure("write"):
+            # Large files are copied from the response to the exporter in
+            # chunks; their digest is computed as they are written
+            if resource.streamed:
+                reader = DigestReader(resource.stream)
+                if self.dry_run:
+                    while reader.read(self.exporter.stream_chunk_size):
+                        pass
+                elif self.mirrors:
+                    self.write_mirrored_stream(
+                        export_path,
+                        reader,
+                        content_type=resource.content_type,
+                        cache_control=cache_control
+                    )
+                else:
+                    self.exporter.write_stream(
+                        export_path,
+                        reader,
+                        content_type=resource.content_type,
+                        cache_control=cache_control
+                    )
+                resource.digest = reader.hexdigest()
+                resource.size = reader.size
+            else:
+                content = resource.content
+                if isinstance(content, str):
+                    content = content.encode(self.encoding)
+                if resource.digest is None:
+                    resource.digest = get_content_digest(content)
+                resource.size = len(content)
+                if not self.dry_run:
+                    self.write_to_exporters(
+                        export_path,
+                        lambda exporter, path: exporter.write_file(
+                            path,
+                            content,
+                            content_type=resource.content_type,
+                            cache_control=cache_control
+                        )
+                    )
+
+        # Report new files and files whose content changed
+        previous_record = self.get_previous_record(resource.source_url)
+        if (
+            previous_record is None
+            or tuple(previous_record["export_path"]) != tuple(export_path)
+        ):
+            self.add_file_change(
+                "added",
+                resource.source_url,
+                export_path,
+                resource=resource
+            )
+        elif previous_record.get("digest") != resource.digest:
+            self.add_file_change(
+                "modified",
+                resource.source_url,
+                export_path,
+                resource=resource,
+                previous_record=previous_record
+            )
+
+    def write_to_exporters(
+            self,
+            export_path: Sequence[str],
+            write: Callable[[Exporter, Sequence[str]], None]):
+        """Performs a write operation on the exporter for the destination
+        and on the exporters for its mirrors.
+
+        Mirrors are written in parallel, while the main exporter is written
+        from the current thread.
+
+        :param export_path: The path of the file on the main destination.
+
+        :param write: A function that takes an exporter and the path of the
+            file on its destination and writes it.
+        """
+        pending_writes = [
+            self.__mirror_executor.submit(
+                write,
+                exporter,
+                self.get_mirror_export_path(mirror, export_path)
+            )
+            for mirror, exporter in self.mirrors
+        ]
+
+        try:
+            write(self.exporter, export_path)
+        finally:
+            for future in futures.as_completed(pending_writes):
+                future.result()
+
+    def write_mirrored_stream(
+            self,
+            export_path: Sequence[str],
+            stream: BinaryIO,
+            content_type: str = None,
+            cache_control: str = None):
+
+        # Responses can only be read once: spool them to a temporary file, so
+        # that each exporter can read its own copy
+        with tempfile.NamedTemporaryFile(prefix="staticpub-") as spool:
+            shutil.copyfileobj(stream, spool, self.exporter.stream_chunk_size)
+            spool.flush()
+
+            def write(exporter, path):
+                with open(spool.name, "rb") as spooled_stream:
+                    exporter.write_stream(
+                        path,
+                        spooled_stream,
+                        content_type=content_type,
+                        cache_control=cache_control
+                    )
+
+            self.write_to_exporters(export_path, write)
+
+    def get_mirror_export_path(
+            self,
+            mirror: 'Destination',
+            export_path: Sequence[str]) -> Sequence[str]:
+        """Translates the path of a file on the main destination to its
+        path on a mirror.
+
+        Destinations that share a layout only differ in their export root.
+        """
+        root = self.export.destination.get_export_root()
+        return list(mirror.get_export_root()) + list(export_path[len(root):])
+
+    def set_exported_file(self, url: URL, record: dict):
+        """Stores the record for an exported file on the destination and
+        its mirrors.
+
+        Destinations that don't support incremental exports don't keep
+        records.
+        """
+        if self.export.destination.incremental:
+            self.export.destination.set_exported_file(url, record)
+        for mirror, exporter in self.mirrors:
+            if not mirror.incremental:
+                continue
+            mirror.set_exported_file(url, dict(
+                record,
+                export_path=tuple(
+                    self.get_mirror_export_path(mirror, record["export_path"])
+                )
+            ))
+
+    def remove_exported_file(self, url: URL):
+        for destination in self.export.destinations:
+            destination.remove_exported_file(url)
+
+    def get_previous_record(self, url: URL) -> dict:
+        """Obtains the record for the file exported for the given URL before
+        the current export, regardless of whether it can be reused.
+        """
+        destination = self.export.destination
+        if not destination.incremental:
+            return None
+        return destination.get_exported_file(url)
+
+    def add_file_change(
+            self,
+            action: str,
+            url: URL,
+            export_path: Sequence[str],
+            resource: 'ExportedResource' = None,
+            previous_record: dict = None):
+
+        change = {
+            "action": action,
+            "path": "/".join(export_path),
+            "url": str(url)
+        }
+
+        if resource is not None:
+            change["digest"] = resource.digest
+            change["size"] = resource.size
+            change["content_type"] = resource.content_type
+
+        if previous_record is not None:
+            change["previous_digest"] = previous_record.get("digest")
+
+        if self.changeset is not None:
+            self.changeset.add(change)
+
+        self.file_changed(change=change)
+
+    def should_stream(self, resource: 'ExportedResource') -> bool:
+        """Determines if the content of a resource should be streamed to the
+        exporter instead of being read into memory.
+
+        Only resources that don't need to be processed and declare a length
+        above `stream_threshold` are streamed.
+        """
+        if (
+            self.stream_threshold is None
+            or resource.status != 200
+            or resource.content_type in self.processed_content_types
+        ):
+            return False
+
+        try:
+            length = int(resource.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            return False
+
+        return length > self.stream_threshold
 
     def get_request_parameters(
             self,
@@ -242,183 +1221,245 @@ class ExportJob:
             headers[app.authentication.AUTH_TOKEN_HEADER] = \
                 self.export.auth_token
 
+        # Conditional requests, based on the validators obtained the last time
+        # the resource was exported to the destination
+        if self.conditional_requests:
+            record = self.get_reusable_record(resource.source_url)
+            if record and not self.references_fingerprints(record):
+                etag = record.get("etag")
+                if etag:
+                    headers["If-None-Match"] = etag
+
+                last_modified = record.get("last_modified")
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+
         return {"headers": headers}
 
     def process_resource(self, resource: 'ExportedResource'):
 
-        if resource.content_type == "text/html":
-            document = BeautifulSoup(resource.content, features="lxml")
-            self.process_html(document, resource)
-            resource.content = str(document)
+        if resource.streamed:
+            return
+
+        if resource.content_type in self.prepared_content_types:
+            prepared = resource.prepared
+            if prepared is None:
+                with self.measure("prepare"):
+                    prepared = self.content_preparer.prepare(
+                        resource.content,
+                        resource.content_type
+                    )
+            with self.measure("rewrite"):
+                resource.content = \
+                    self.fill_prepared_content(prepared, resource)
 
         elif resource.content_type == "text/css":
-            css = resource.content.decode(self.encoding)
-            css = self.process_css(css, resource)
-            resource.content = css.encode(self.encoding)
+            with self.measure("process_css"):
+                css = resource.content.decode(self.encoding)
+                css = self.process_css(css, resource)
+                resource.content = css.encode(self.encoding)
 
-    def process_html(
+    def fill_prepared_content(
             self,
-            document: BeautifulSoup,
-            resource: 'ExportedResource'):
+            prepared: PreparedContent,
+            resource: 'ExportedResource') -> str:
+        """Resolves the references found while preparing a resource, and
+        replaces their placeholders.
+        """
+        replacements = {}
 
-        # Process embedded styles
-        for element in document.find_all("style"):
-            content_type = element.get("type")
-            if (
-                (not content_type or content_type == "text/css")
-                and element.string
-            ):
-                element.string = self.process_css(element.string, resource)
+        def replace(ref: ContentReference) -> str:
+            replacement = replacements.get(ref)
+            if replacement is None:
+                replacement = self.process_reference(ref, resource)
+                replacements[ref] = replacement
+            return replacement
 
-        # Process embdded scripts
-        for element in document.find_all("script"):
-            content_type = element.get("type")
-            if (
-                (not content_type or content_type == "text/javascript")
-                and element.string
-            ):
-                element.string = self.process_embedded_javascript(
-                    element.string,
-                    resource
-                )
+        return prepared.fill([replace(ref) for ref in prepared.references])
 
-        # Transform URLs
-        for element, attr, url, content_type \
-        in self.iter_urls_in_html(document, resource):
-            self.process_html_url(
-                element,
-                attr,
-                url,
-                content_type,
-                resource
-            )
+    def process_reference(
+            self,
+            ref: ContentReference,
+            resource: 'ExportedResource') -> str:
+        """Produces the replacement for a reference found while preparing a
+        resource, collecting the dependencies it points to.
+        """
+        if ref.context == "style":
+            with self.measure("process_css"):
+                return self.process_css(ref.value, resource)
+
+        url = self.process_url_reference(
+            ref.value,
+            ref.content_type,
+            resource
+        )
+        return escape_reference(str(url), ref.context)
 
-    def iter_urls_in_html(
+    def process_url_reference(
             self,
-            document: BeautifulSoup,
-            resource: 'ExportedResource') -> Iterable[ResourceWithinDocument]:
-
-        for link in document.find_all("link"):
-            href = link.get("href")
-            if href:
-                ctype = link.get("type")
-                if not ctype:
-                    rel = link.get("rel")
-                    if rel and str(rel).lower() == "stylesheet":
-                        ctype = "text/css"
-                yield link, "href", URL(href), ctype
-
-        for script in document.find_all("script"):
-            src = script.get("src")
-            if src:
-                yield (
-                    script,
-                    "src",
-                    URL(src),
-                    script.get("type") or "application/javascript"
-                )
+            url: str,
+            content_type: Optional[str],
+            resource: 'ExportedResource') -> URL:
+        """Collects the dependency pointed to by a URL found in a resource,
+        and produces the URL that should replace it.
+        """
+        url = self.normalize_href(URL(url), resource)
 
-        for img in document.find_all("img"):
-            src = img.get("src")
-            if src:
-                yield img, "src", URL(src), None
+        # Collect dependencies
+        self.add_dependency(
+            url,
+            content_type=content_type,
+            resource=resource
+        )
 
-        for video in document.find_all("video"):
-            src = video.get("src")
-            if src:
-                yield video, "src", URL(src), video.get("type")
+        # Transform the resource URL into a relative path
+        return self.transform_href(url, resource, content_type=content_type)
 
-        for audio in document.find_all("audio"):
-            src = audio.get("src")
-            if src:
-                yield audio, "src", URL(src), audio.get("type")
+    # Documents are processed by the content preparer (see
+    # `content_preparer_class`), which is where processing should be
+    # customized. The methods below are kept for code that calls them: they
+    # delegate to the preparer, resolving references on the spot. Overriding
+    # them doesn't change how the job processes documents.
 
-        for source in document.find_all("source"):
-            src = source.get("src")
-            if src:
-                yield source, "src", URL(src), source.get("type")
+    def process_html(
+            self,
+            document: 'BeautifulSoup',
+            resource: 'ExportedResource'):
 
-        for a in document.find_all("a"):
-            href = a.get("href")
-            if href and not href.startswith("#"):
-                yield a, "href", URL(href), a.get("type")
+        self.content_preparer.process_html(
+            document,
+            self.__resolve_references(resource)
+        )
 
-        for iframe in document.find_all("iframe"):
-            src = iframe.get("src")
-            if src:
-                yield iframe, "src", URL(src), None
+    def iter_urls_in_html(
+            self,
+            document: 'BeautifulSoup',
+            resource: 'ExportedResource') -> Iterable[HTMLReference]:
+
+        return self.content_preparer.iter_urls_in_html(document)
 
     def process_html_url(
             self,
-            element: Tag,
+            element: 'Tag',
             attr: str,
-            url: URL,
-            content_type: str,
+            url: str,
+            content_type: Optional[str],
             resource: 'ExportedResource'):
 
-        if url.scheme in ("javascript", "mailto"):
-            return url
+        self.content_preparer.process_html_url(
+            element,
+            attr,
+            str(url),
+            content_type,
+            self.__resolve_references(resource)
+        )
+
+    def process_embedded_javascript(
+            self,
+            content: str,
+            resource: 'ExportedResource') -> str:
 
-        url = self.normalize_href(url, resource)
+        return self.content_preparer.process_embedded_javascript(
+            content,
+            self.__resolve_references(resource)
+        )
 
-        # Collect dependencies
-        self.add_dependency(url, content_type=content_type)
+    def __resolve_references(
+            self,
+            resource: 'ExportedResource') -> AddReference:
 
-        # Transform the resource URL into a relative path
-        url = self.transform_href(url, resource, content_type=content_type)
-        element[attr] = url
+        # Replacements are assigned to parsed elements, rather than filled
+        # into serialized markup, so they are never escaped as HTML
+        def add_reference(value, content_type, context):
+            if context == "style":
+                return self.process_css(value, resource)
+            url = self.process_url_reference(value, content_type, resource)
+            return str(url)
+
+        return add_reference
 
     def process_css(
             self,
             content: str,
             resource: 'ExportedResource') -> str:
 
-        def replace_url(match):
+        digest = get_content_digest(content, self.encoding)
 
-            value = match.group(1).strip("'").strip('"')
+        references = self.__css_references.get(digest)
+        if references is None:
+            references = list(iter_css_references(content))
+            self.__css_references[digest] = references
 
-            if value.startswith("javascript:"):
-                return value
+        # Stylesheets are rewritten once per export folder (since the
+        # rewritten URLs are relative to it) and, if they contain relative
+        # URLs, once per source folder
+        relative = any(
+            css_url_is_relative(ref.url)
+            for ref in references
+            if self.should_process_css_reference(ref)
+        )
+        if relative:
+            source = str(resource.base_url)
+        else:
+            source = get_origin(resource.base_url)
 
-            url = URL(value)
-            url = self.normalize_href(url, resource)
-            self.add_dependency(url, content_type="text/css")
-            url = self.transform_href(url, resource, content_type="text/css")
-            return f"url('{url}')"
+        cache_key = (
+            digest,
+            resource.language,
+            tuple(resource.export_folder),
+            source
+        )
 
-        return self.css_url_regexp.sub(replace_url, content)
+        if self.cache_processed_css:
+            cached_css = self.__processed_css.get(cache_key)
+            if cached_css is not None:
+                css, dependencies = cached_css
+                for url, content_type in dependencies:
+                    self.add_dependency(
+                        URL(url),
+                        content_type=content_type,
+                        resource=resource
+                    )
+                return css
 
-    def process_embedded_javascript(
-            self,
-            content: str,
-            resource: 'ExportedResource') -> str:
+        dependencies = []
 
-        def process_strings(match):
-            c = match.group("delim")
-            return (
-                c
-                + self.js_url_regexp.sub(replace_url, match.group("value"))
-                + c
-            )
+        def replace_url(ref):
 
-        def replace_url(match):
+            if not self.should_process_css_reference(ref):
+                return None
 
-            value = match.group("url")
+            content_type = "text/css"
+            url = URL(ref.url)
+            url = self.normalize_href(url, resource)
 
-            if value.startswith("javascript:"):
-                return match.group(0)
+            if self.add_dependency(
+                url,
+                content_type=content_type,
+                resource=resource
+            ):
+                dependencies.append((str(url), content_type))
 
-            url = URL(value)
-            url = self.normalize_href(url, resource)
-            self.add_dependency(url, content_type="application/javascript")
-            url = self.transform_href(
+            return self.transform_href(
                 url,
                 resource,
-                content_type="application/javascript"
+                content_type=content_type
             )
-            return match.group("head") + url + match.group("tail")
 
-        return self.js_string_regexp.sub(process_strings, content)
+        css = rewrite_css(content, references, replace_url)
+
+        if self.cache_processed_css:
+            self.__processed_css[cache_key] = (css, dependencies)
+
+        return css
+
+    def should_process_css_reference(self, ref: CSSReference) -> bool:
+        url = ref.url.strip()
+        return bool(
+            url
+            and not url.startswith("#")
+            and not self.css_ignored_url_regexp.match(url)
+        )
 
     def get_base_url(self, url: URL) -> URL:
         if len(url.path) > 1:
@@ -438,14 +1479,15 @@ class ExportJob:
             )
 
         # Normalize URLs to their canonical form
-        if not self.url_is_external(url):
-            resolution = self.resolve_url(url)
-            if resolution and resolution.publishable:
-                url = app.url_mapping.get_canonical_url(
-                    url,
-                    language=resource.language,
-                    preserve_extra_path=True
-                )
+        with self.measure("resolve_urls"):
+            if not self.url_is_external(url):
+                resolution = self.resolve_url(url)
+                if resolution and resolution.publishable:
+                    url = app.url_mapping.get_canonical_url(
+                        url,
+                        language=resource.language,
+                        preserve_extra_path=True
+                    )
 
         return url
 
@@ -455,13 +1497,13 @@ class ExportJob:
             resource: "ExportedResource",
             content_type: str = None) -> URL:
 
-        if self.url_is_external(url):
-            return url
-        else:
-            if self.should_make_url_absolute(url, resource):
+        with self.measure("resolve_urls"):
+            if self.url_is_external(url):
+                return url
+            elif self.should_make_url_absolute(url, resource):
                 return self.export.destination.get_export_url(
                     url,
-                    content_type=content_type
+                    export_path=self.get_href_export_path(url, content_type)
                 )
             else:
                 return self.get_relative_url(
@@ -484,10 +1526,7 @@ class ExportJob:
             content_type: str = None) -> URL:
 
         # Express URLs as paths relative to the exported document
-        url_export_path = self.export.destination.get_export_path(
-            url,
-            content_type=content_type
-        )
+        url_export_path = self.get_href_export_path(url, content_type)
 
         i = 0
         for a, b in zip_longest(resource.export_folder, url_export_path):
@@ -506,6 +1545,81 @@ class ExportJob:
             fragment=url.fragment
         )
 
+    def get_href_export_path(
+            self,
+            url: URL,
+            content_type: str = None) -> Sequence[str]:
+
+        # References to fingerprinted dependencies point to the path of their
+        # current content
+        if (
+            self.export.destination.fingerprint_assets
+            and url in self.dependencies
+        ):
+            export_path = self.require_dependency_export_path(url)
+            if export_path is not None:
+                return list(export_path)
+
+        return self.export.destination.get_export_path(
+            url,
+            resolution=self.resolve_url(url),
+            content_type=content_type
+        )
+
+    def require_dependency_export_path(self, url: URL) -> Sequence[str]:
+        """Obtains the path where a dependency has been exported, transferring
+        it first if necessary.
+
+        Used to resolve the fingerprinted paths of dependencies before the
+        resources that reference them are written.
+
+        :return: The export path for the dependency, or None if it couldn't
+            be transferred or there's a circular reference to it.
+        """
+        key = str(url)
+
+        if (
+            key not in self.__dependency_paths
+            and key not in self.__resolving_dependencies
+        ):
+            self.__resolving_dependencies.add(key)
+            try:
+                # Finish the transfer if it's already in progress, or
+                # transfer the dependency right away otherwise
+                transfers = list(self.__dependency_transfers.items())
+                for future, transfer in transfers:
+                    if str(transfer.resource.source_url) == key:
+                        del self.__dependency_transfers[future]
+                        self.complete_dependency_transfer(transfer, future)
+                        break
+                else:
+                    self.pending_dependencies.discard(url)
+                    self.begin_dependency_transfer(url, inline=True)
+            finally:
+                self.__resolving_dependencies.discard(key)
+
+        return self.__dependency_paths.get(key)
+
+    def fingerprints_resource(self, resource: 'ExportedResource') -> bool:
+        return (
+            self.export.destination.fingerprint_assets
+            and not resource.streamed
+            and resource.content_type != "text/html"
+        )
+
+    def references_fingerprints(self, record: dict) -> bool:
+        """Indicates if the content of an exported file may include references
+        to fingerprinted paths.
+
+        Fingerprinted paths change along with the content of the referenced
+        files, so these files must be processed again even if their own
+        content didn't change.
+        """
+        return (
+            self.export.destination.fingerprint_assets
+            and record.get("content_type") in self.processed_content_types
+        )
+
     def url_is_external(self, url: URL) -> bool:
 
         if not url.hostname:
@@ -535,70 +1649,446 @@ class ExportJob:
         )
 
     def resolve_url(self, url: URL) -> URLResolution:
+        key = str(url)
         try:
-            return self.__url_resolutions[url]
+            return self.__url_resolutions[key]
         except KeyError:
             resolution = app.url_mapping.resolve(url)
-            self.__url_resolutions[url] = resolution
+            self.__url_resolutions[key] = resolution
             return resolution
 
     def add_dependency(
             self,
             url: URL,
-            content_type: str = None):
+            content_type: str = None,
+            resource: 'ExportedResource' = None) -> bool:
+
+        if url in self.dependencies:
+            is_dependency = True
+        elif url in self.document_urls:
+            is_dependency = False
+        elif self.url_is_exportable_dependency(url, content_type):
+            self.dependencies.add(url)
+            self.pending_dependencies.add(url)
+            self.__dependency_states[str(url)] = "pending"
+            is_dependency = True
+        else:
+            is_dependency = False
 
-        if url not in self.dependencies and url not in self.document_urls:
-            if self.url_is_exportable_dependency(url, content_type):
-                self.dependencies.add(url)
-                self.pending_dependencies.add(url)
+        # Keep track of the dependencies of each resource
+        if is_dependency and resource is not None:
+            resource.dependencies.add(str(url))
+
+        return is_dependency
 
     def export_dependencies(self):
 
         if self.dependencies:
             self.dependency_transfers_starting()
 
-        while self.pending_dependencies:
+        self.transfer_dependencies(wait=True)
+
+    def transfer_dependencies(self, wait: bool = False):
+        """Transfers pending dependencies.
+
+        :param wait: If True, the method won't return until all pending
+            dependencies (including those discovered while transferring other
+            dependencies) have been transferred. Otherwise, new transfers are
+            started in the background and the method returns immediately,
+            after completing those transfers that have already finished.
+            Without a pool of dependency workers, calls that don't wait are
+            ignored.
+        """
+        executor = self.__dependency_executor
+
+        if executor is None:
+            if wait:
+                while self.pending_dependencies:
+                    self.check_cancellation()
+                    self.check_lanes()
+                    self.begin_dependency_transfer(
+                        self.pending_dependencies.pop()
+                    )
+            return
 
-            source_url = self.pending_dependencies.pop()
-            resource = ExportedResource(self, source_url)
-            self.dependency_transfer_starting(resource=resource)
+        transfers = self.__dependency_transfers
 
-            try:
-                resource.open(**self.get_request_parameters(resource))
-                self.process_resource(resource)
-                self.exporter.write_file(
-                    resource.export_path,
-                    resource.content,
-                    content_type=resource.content_type
+        while True:
+
+            self.check_cancellation()
+
+            if wait:
+                self.check_lanes()
+
+            # Start transfers for newly discovered dependencies
+            while (
+                self.pending_dependencies
+                and len(transfers) < self.max_queued_dependencies
+            ):
+                self.begin_dependency_transfer(
+                    self.pending_dependencies.pop()
                 )
-            except Exception as export_error:
-                self.dependency_transfer_failed(
-                    resource=resource,
-                    error=export_error
+
+            if not transfers:
+                break
+
+            if wait:
+                # Wake up periodically to notice cancellations
+                done, not_done = futures.wait(
+                    list(transfers),
+                    timeout=self.cancellation_check_interval,
+                    return_when=futures.FIRST_COMPLETED
                 )
-                if self.errors == "raise":
-                    raise
             else:
+                done = [future for future in transfers if future.done()]
+                if not done:
+                    break
+
+            for future in done:
+                # Transfers can be completed ahead of time, when their
+                # fingerprinted path is required
+                transfer = transfers.pop(future, None)
+                if transfer is not None:
+                    self.complete_dependency_transfer(transfer, future)
+
+    def begin_dependency_transfer(
+            self,
+            source_url: URL,
+            inline: bool = False):
+
+        resource = ExportedResource(self, source_url)
+        self.dependency_transfer_starting(resource=resource)
+
+        try:
+            record = self.get_reusable_record(source_url)
+
+            # Dependencies that haven't changed since they were last exported
+            # don't need to be requested again; their own dependencies must
+            # still be checked, though
+            if (
+                record
+                and not self.references_fingerprints(record)
+                and self.dependency_is_unchanged(resource, record)
+            ):
+                self.restore_dependencies(record)
+                self.__dependency_states[str(source_url)] = "success"
+                if self.export.destination.fingerprint_assets:
+                    self.__dependency_paths[str(source_url)] = \
+                        record["export_path"]
+                self.dependency_transfer_skipped(resource=resource)
+                return
+
+            transfer = DependencyTransfer(
+                resource,
+                record,
+                datetime.now(),
+                self.get_request_parameters(resource)
+            )
+        except Exception as export_error:
+            self.__dependency_states[str(source_url)] = "failed"
+            self.dependency_transfer_failed(
+                resource=resource,
+                error=export_error
+            )
+            if self.errors == "raise":
+                raise
+        else:
+            executor = None if inline else self.__dependency_executor
+            if executor is None:
+                self.complete_dependency_transfer(transfer)
+            else:
+                future = executor.submit(
+                    self.fetch_dependency,
+                    transfer,
+                    spool=True
+                )
+                self.__dependency_transfers[future] = transfer
+
+    def fetch_dependency(
+            self,
+            transfer: 'DependencyTransfer',
+            spool: bool = False):
+        """Requests a dependency, and prepares its content.
+
+        :param spool: If True, streamed responses are read into a temporary
+            file, so that their connection is released before the transfer
+            is completed. Transfers executed by the dependency workers can
+            wait a long time for the main thread to complete them, and they
+            would otherwise hold on to their connections in the meantime.
+        """
+        # Runs on the dependency workers: shouldn't touch the database
+        if self.cancelled.is_set():
+            raise Halt()
+        resource = transfer.resource
+        with self.measure("fetch", resource.source_url, "dependency"):
+            resource.open(**transfer.request_parameters)
+
+            # Error pages mustn't be exported (nor recorded, which would
+            # keep them from being requested again)
+            if resource.status >= 400:
+                resource.close()
+                raise DependencyRequestError(
+                    f"Requesting {resource.source_url} failed with status "
+                    f"{resource.status}"
+                )
+
+            if spool and resource.streamed:
+                try:
+                    resource.spool()
+                except:
+                    resource.close()
+                    raise
+        self.prepare_resource(resource)
+
+    def complete_dependency_transfer(
+            self,
+            transfer: 'DependencyTransfer',
+            future: futures.Future = None):
+
+        resource = transfer.resource
+
+        try:
+            with self.measure("dependency", resource.source_url, "dependency"):
+                if future is None:
+                    self.fetch_dependency(transfer)
+                else:
+                    with self.measure("wait"):
+                        future.result()
+
+                try:
+                    transferred = self.export_dependency(transfer)
+                finally:
+                    resource.close()
+
+        except Halt:
+            raise
+        except Exception as export_error:
+            self.__dependency_states[str(resource.source_url)] = "failed"
+            if self.export.destination.fingerprint_assets:
+                self.__dependency_paths[str(resource.source_url)] = None
+            self.dependency_transfer_failed(
+                resource=resource,
+                error=export_error
+            )
+            if self.errors == "raise":
+                raise
+        else:
+            if transferred:
                 self.dependency_transfer_successful(resource=resource)
+            else:
+                self.dependency_transfer_skipped(resource=resource)
+
+    def export_dependency(self, transfer: 'DependencyTransfer') -> bool:
+
+        resource = transfer.resource
+        record = transfer.record
+
+        # Resources that have turned out to be documents are exported by their
+        # own task
+        if resource.source_url in self.document_urls:
+            self.__dependency_states[str(resource.source_url)] = None
+            if self.export.destination.fingerprint_assets:
+                self.__dependency_paths[str(resource.source_url)] = None
+            return False
+
+        if resource.not_modified:
+            self.restore_dependencies(record)
+            transferred = False
+        else:
+            self.process_resource(resource)
+
+            if not resource.streamed:
+                resource.digest = get_content_digest(
+                    resource.content,
+                    self.encoding
+                )
+                if self.fingerprints_resource(resource):
+                    resource.fingerprint = resource.digest[
+                        :self.export.destination.fingerprint_length
+                    ]
+
+            # Avoid rewriting files with identical content. The digest of
+            # streamed files is only known once they have been written.
+            if (
+                not resource.streamed
+                and record
+                and record.get("digest") == resource.digest
+                and record.get("export_path") == tuple(resource.export_path)
+            ):
+                resource.size = record.get("size")
+                transferred = False
+            else:
+                self.write_resource(resource)
+                transferred = True
+
+        record = self.create_export_record(
+            resource,
+            transfer.exported_at,
+            record,
+            kind="dependency"
+        )
+
+        # Keep track of the item that produced the dependency, so that
+        # changes to its content can be transferred on their own
+        resolution = self.resolve_url(resource.source_url)
+        if resolution and resolution.publishable:
+            record["item"] = resolution.publishable.id
+
+        if self.export.destination.fingerprint_assets:
+            self.__dependency_paths[str(resource.source_url)] = \
+                record["export_path"]
+
+        # The record is persisted along with the next task, or once enough
+        # dependencies have been transferred
+        self.__dependency_states[str(resource.source_url)] = "success"
+        if not self.dry_run and any(
+            destination.incremental
+            for destination in self.export.destinations
+        ):
+            self.__dependency_records[str(resource.source_url)] = record
+
+        if len(self.__dependency_records) >= self.dependency_commit_size:
+            self.commit_dependencies()
+
+        return transferred
+
+    def commit_dependencies(self):
+        """Persists the dependency states and records gathered since the
+        last commit.
+        """
+        dependency_states = self.take_dependency_states()
+        dependency_records = self.take_dependency_records()
+
+        with self.measure("commit"):
+            transaction(
+                self.store_dependency_states,
+                action_args=(dependency_states, dependency_records)
+            )
+
+    def get_reusable_record(self, url: URL) -> dict:
+
+        if not self.reuse_exported_files:
+            return None
+
+        destination = self.export.destination
+        if not destination.incremental:
+            return None
+
+        record = destination.get_exported_file(url)
+
+        # Files are only skipped if all mirrors hold the same version
+        if record is not None:
+            for mirror, exporter in self.mirrors:
+                mirror_record = (
+                    mirror.incremental
+                    and mirror.get_exported_file(url)
+                )
+                if (
+                    not mirror_record
+                    or mirror_record.get("digest") != record.get("digest")
+                ):
+                    return None
+
+        return record
+
+    def dependency_is_unchanged(
+            self,
+            resource: 'ExportedResource',
+            record: dict) -> bool:
+
+        # Only dependencies backed by a publishable object can be checked
+        # without requesting them
+        resolution = self.resolve_url(resource.source_url)
+        publishable = resolution and resolution.publishable
+        if publishable is None:
+            return False
+
+        last_update_time = getattr(publishable, "last_update_time", None)
+        exported_at = record.get("exported_at")
+        return (
+            last_update_time is not None
+            and exported_at is not None
+            and last_update_time <= exported_at
+        )
+
+    def restore_dependencies(self, record: dict):
+        if record:
+            for url in record.get("dependencies", ()):
+                self.add_dependency(URL(url))
+
+    def create_export_record(
+            self,
+            resource: 'ExportedResource',
+            exported_at: datetime,
+            previous_record: dict = None,
+            kind: str = "document") -> dict:
+
+        # Resources that weren't modified keep their previous record
+        if resource.not_modified and previous_record:
+            record = previous_record.copy()
+            record["exported_at"] = exported_at
+            record["kind"] = kind
+            return record
+
+        headers = resource.headers or {}
+        return {
+            "kind": kind,
+            "export_path": tuple(resource.export_path),
+            "content_type": resource.content_type,
+            "digest": resource.digest,
+            "size": resource.size,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "exported_at": exported_at,
+            "dependencies": tuple(sorted(resource.dependencies))
+        }
 
 
 class Halt(Exception):
     pass
 
 
+class DependencyRequestError(Exception):
+    pass
+
+
+class DependencyTransfer:
+
+    def __init__(
+            self,
+            resource: 'ExportedResource',
+            record: dict,
+            exported_at: datetime,
+            request_parameters: dict):
+
+        self.resource = resource
+        self.record = record
+        self.exported_at = exported_at
+        self.request_parameters = request_parameters
+
+
 class ExportedResource:
 
     __export_job = None
     __export_path = None
     __export_folder = None
+    __response = None
+    __spool = None
 
     publishable: PublishableObject = None
     language: str = None
     source_url: URL = None
     base_url: URL = None
+    status: int = None
     headers: Dict[str, str] = None
     content_type: str = None
     content: bytes = None
+    stream: BinaryIO = None
+    prepared: PreparedContent = None
+    digest: str = None
+    size: int = None
+    fingerprint: str = None
+    dependencies: Set[str] = None
 
     def __init__(self, export_job: ExportJob, source_url: URL):
 
@@ -606,27 +2096,78 @@ class ExportedResource:
         self.source_url = source_url
         self.base_url = export_job.get_base_url(source_url)
         self.__export_job = weakref.ref(export_job)
+        self.dependencies = set()
 
     def open(self, **kwargs):
 
-        response = requests.get(self.source_url, **kwargs)
+        job = self.__export_job()
+        response = job.get_http_session().get(
+            self.source_url,
+            stream=True,
+            **kwargs
+        )
+        self.status = response.status_code
         self.headers = response.headers
-        self.content = response.content
 
         self.content_type = self.headers.get("Content-Type")
         if self.content_type:
             self.content_type = self.content_type.split(";", 1)[0]
 
+        if job.should_stream(self):
+            response.raw.decode_content = True
+            self.__response = response
+            self.stream = response.raw
+        else:
+            self.content = response.content
+
+    def spool(self):
+        """Reads the stream of the resource into a temporary file, closing
+        its HTTP response.
+        """
+        spool = tempfile.TemporaryFile()
+        try:
+            shutil.copyfileobj(self.stream, spool)
+            spool.seek(0)
+        except:
+            spool.close()
+            raise
+
+        self.close()
+        self.__spool = spool
+        self.stream = spool
+
+    def close(self):
+        if self.__response is not None:
+            self.__response.close()
+            self.__response = None
+        if self.__spool is not None:
+            self.__spool.close()
+            self.__spool = None
+
+    @property
+    def streamed(self) -> bool:
+        """Indicates if the content of the resource is read from a stream."""
+        return self.stream is not None
+
+    @property
+    def not_modified(self) -> bool:
+        """Indicates if the resource was requested conditionally and the
+        server reported that it hasn't changed.
+        """
+        return self.status == 304
+
     @property
     def export_folder(self) -> Sequence[str]:
 
         if self.__export_folder is None:
             job = self.__export_job()
             get_export_path = job.export.destination.get_export_path
-            self.__export_folder = get_export_path(
-                self.base_url,
-                add_file_extension=False
-            )
+            with job.measure("resolve_urls"):
+                self.__export_folder = get_export_path(
+                    self.base_url,
+                    resolution=job.resolve_url(self.base_url),
+                    add_file_extension=False
+                )
 
         return self.__export_folder
 
@@ -636,10 +2177,13 @@ class ExportedResource:
         if self.__export_path is None:
             job = self.__export_job()
             get_export_path = job.export.destination.get_export_path
-            self.__export_path = get_export_path(
-                self.source_url,
-                content_type=self.content_type
-            )
+            with job.measure("resolve_urls"):
+                self.__export_path = get_export_path(
+                    self.source_url,
+                    resolution=job.resolve_url(self.source_url),
+                    content_type=self.content_type,
+                    fingerprint=self.fingerprint
+                )
 
         return self.__export_path
 
@@ -3,8 +3,10 @@
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
 import os
+import shutil
+from hashlib import md5
 
-from .exporter import Exporter
+from .exporter import Exporter, StoredFile
 
 
 class FolderExporter(Exporter):
@@ -15,12 +17,14 @@ class FolderExporter(Exporter):
     def __init__(self, root_folder):
         self.root_folder = root_folder
 
-    def write_file(self, path, content, content_type=None):
+    def write_file(
+            self,
+            path,
+            content,
+            content_type=None,
+            cache_control=None):
 
-        folder = os.path.join(self.root_folder, *path[:-1])
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        file_path = os.path.join(self.root_folder, *path)
+        file_path = self._prepare_file_path(path)
 
         if isinstance(content, str):
             content = content.encode(self.encoding)
@@ -28,6 +32,56 @@ class FolderExporter(Exporter):
         with open(file_path, "wb") as file:
             file.write(content)
 
+    def write_stream(
+            self,
+            path,
+            stream,
+            content_type=None,
+            cache_control=None):
+        file_path = self._prepare_file_path(path)
+        with open(file_path, "wb") as file:
+            shutil.copyfileobj(stream, file, self.stream_chunk_size)
+
+    def _prepare_file_path(self, path):
+        folder = os.path.join(self.root_folder, *path[:-1])
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return os.path.join(self.root_folder, *path)
+
+    def iter_stored_files(self, prefix=()):
+
+        root = os.path.join(self.root_folder, *prefix)
+
+        for folder, subfolders, files in os.walk(root):
+            rel_folder = os.path.relpath(folder, self.root_folder)
+            folder_path = () if rel_folder == "." else tuple(
+                rel_folder.split(os.sep)
+            )
+            for file_name in files:
+                file_path = os.path.join(folder, file_name)
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
+                    continue
+                yield StoredFile(folder_path + (file_name,), size)
+
+    def get_stored_digest(self, stored_file):
+
+        file_path = os.path.join(self.root_folder, *stored_file.path)
+        hash = md5()
+
+        try:
+            with open(file_path, "rb") as file:
+                while True:
+                    chunk = file.read(self.stream_chunk_size)
+                    if not chunk:
+                        break
+                    hash.update(chunk)
+        except OSError:
+            return None
+
+        return hash.hexdigest()
+
     def remove_file(self, path):
         file_path = os.path.join(self.root_folder, *path)
         try:
@@ -18,11 +18,13 @@ from .exportpermission import ExportPermission
 EXPORT_SCRIPT_TEMPLATE = normalize_indentation(
     """
     #!/usr/bin/env python
-    import %(package)s.scripts.shell
     from woost.extensions.staticpub.cli import CLI
 
     if __name__ == "__main__":
-        CLI().main()
+        cli = CLI()
+        args = cli.parse_args()
+        import %(package)s.scripts.shell
+        cli.main(args)
     """
 ).lstrip()
 
@@ -4,7 +4,7 @@
 """
 from cocktail.events import when
 from cocktail.caching import whole_cache
-from woost.models import Item, User, Publishable
+from woost.models import Item, User, Publishable, File
 
 from .destination import Destination
 from .utils import iter_exportable_languages
@@ -17,6 +17,14 @@ members_affecting_publication_state = {
     Publishable.x_staticpub_exportable
 }
 
+# Members that only alter the binary content of a file. Changing them doesn't
+# require exporting the documents that embed or link to the file again, only
+# transferring the file itself.
+members_affecting_dependency_content = {
+    File.file_size,
+    File.file_hash
+}
+
 
 @when(Publishable.changing)
 def _track_publication_state(e):
@@ -62,12 +70,20 @@ def _invalidate_modified_objects(e):
         e.source.is_inserted
         and e.member.invalidates_cache
     ):
-        for destination in Destination.select():
-            destination.invalidate_exported_content(
-                e.source,
-                language=e.language,
-                cache_part=e.member.cache_part
-            )
+        if e.member in members_affecting_dependency_content:
+            for destination in Destination.select():
+                destination.invalidate_exported_dependency(
+                    e.source,
+                    language=e.language,
+                    cache_part=e.member.cache_part
+                )
+        else:
+            for destination in Destination.select():
+                destination.invalidate_exported_content(
+                    e.source,
+                    language=e.language,
+                    cache_part=e.member.cache_part
+                )
 
 
 @when(Item.deleted)
@@ -0,0 +1,224 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Iterable, NamedTuple
+
+# Keywords after which a slash starts a regular expression literal, rather
+# than a division operator
+_regexp_keywords = frozenset([
+    "await",
+    "case",
+    "delete",
+    "do",
+    "else",
+    "in",
+    "instanceof",
+    "new",
+    "of",
+    "return",
+    "throw",
+    "typeof",
+    "void",
+    "yield"
+])
+
+
+class JavaScriptString(NamedTuple):
+    """The text of a string literal found in a script.
+
+    :var start: The offset where the text of the string begins (after its
+        opening delimiter).
+    :var end: The offset where the text of the string ends (before its
+        closing delimiter).
+    """
+    start: int
+    end: int
+
+
+def _is_identifier_char(c: str) -> bool:
+    return c.isalnum() or c == "_" or c == "$"
+
+
+def _scan_string(js: str, start: int) -> int:
+    """Finds the end of the quoted string literal starting at the given
+    offset.
+
+    :return: The offset of the closing delimiter, or of the end of the line
+        (or text) if the string is not closed.
+    """
+    delimiter = js[start]
+    i = start + 1
+    length = len(js)
+
+    while i < length:
+        c = js[i]
+        if c == "\\":
+            i += 2
+        elif c == delimiter or c == "\n":
+            return i
+        else:
+            i += 1
+
+    return length
+
+
+def _scan_template(js: str, start: int) -> int:
+    """Finds the end of a chunk of text in a template literal.
+
+    :return: The offset of the closing backtick, of the next substitution
+        (``${``) or of the end of the text.
+    """
+    i = start
+    length = len(js)
+
+    while i < length:
+        c = js[i]
+        if c == "\\":
+            i += 2
+        elif c == "`" or (c == "$" and js.startswith("${", i)):
+            return i
+        else:
+            i += 1
+
+    return length
+
+
+def _scan_regexp(js: str, start: int) -> int:
+    """Finds the end of the regular expression literal starting at the given
+    offset.
+
+    :return: The offset immediately after the literal (including its flags),
+        or None if the literal is not closed on the same line.
+    """
+    i = start + 1
+    length = len(js)
+    in_class = False
+
+    while i < length:
+        c = js[i]
+        if c == "\\":
+            i += 2
+            continue
+        elif c == "\n":
+            return None
+        elif in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+        elif c == "/":
+            i += 1
+            while i < length and _is_identifier_char(js[i]):
+                i += 1
+            return i
+        i += 1
+
+    return None
+
+
+def iter_javascript_strings(js: str) -> Iterable[JavaScriptString]:
+    """Finds the text of all the string literals in a script.
+
+    The scanner runs in a single pass, so its cost is linear on the size of
+    the script. It skips comments and regular expression literals, and
+    handles template literals, including nested substitutions; each chunk
+    of text in a template literal is reported as a separate string.
+    """
+    i = 0
+    length = len(js)
+    regexp_allowed = True
+
+    # When a regular expression literal is left unclosed, slashes up to the
+    # end of its line are taken as division operators; scanning for a
+    # literal from each one of them would make the cost quadratic
+    no_regexp_until = 0
+
+    # The brace depth of each template substitution being parsed
+    substitutions = []
+
+    while i < length:
+        c = js[i]
+
+        if c in " \t\r\n\f\v":
+            i += 1
+
+        # Comments, regular expressions and the division operator
+        elif c == "/":
+            if js.startswith("//", i):
+                end = js.find("\n", i + 2)
+                i = length if end == -1 else end + 1
+            elif js.startswith("/*", i):
+                end = js.find("*/", i + 2)
+                i = length if end == -1 else end + 2
+            else:
+                if regexp_allowed and i >= no_regexp_until:
+                    end = _scan_regexp(js, i)
+                    if end is None:
+                        no_regexp_until = js.find("\n", i)
+                        if no_regexp_until == -1:
+                            no_regexp_until = length
+                else:
+                    end = None
+                if end is None:
+                    i += 1
+                    regexp_allowed = True
+                else:
+                    i = end
+                    regexp_allowed = False
+
+        # Quoted strings
+        elif c == '"' or c == "'":
+            end = _scan_string(js, i)
+            yield JavaScriptString(i + 1, end)
+            i = end + 1
+            regexp_allowed = False
+
+        # Template literals
+        elif c == "`":
+            i = yield from _iter_template_chunk(js, i + 1, substitutions)
+            regexp_allowed = False
+
+        elif c == "{":
+            if substitutions:
+                substitutions[-1] += 1
+            i += 1
+            regexp_allowed = True
+
+        elif c == "}":
+            if substitutions and not substitutions[-1]:
+                # End of a template substitution: resume the template
+                substitutions.pop()
+                i = yield from _iter_template_chunk(js, i + 1, substitutions)
+                regexp_allowed = False
+            else:
+                if substitutions:
+                    substitutions[-1] -= 1
+                i += 1
+                regexp_allowed = True
+
+        elif _is_identifier_char(c):
+            start = i
+            i += 1
+            while i < length and _is_identifier_char(js[i]):
+                i += 1
+            regexp_allowed = js[start:i] in _regexp_keywords
+
+        elif c == ")" or c == "]":
+            i += 1
+            regexp_allowed = False
+
+        else:
+            i += 1
+            regexp_allowed = True
+
+
+def _iter_template_chunk(js, start, substitutions):
+    end = _scan_template(js, start)
+    yield JavaScriptString(start, end)
+
+    if js.startswith("${", end):
+        substitutions.append(0)
+        return end + 2
+
+    return end + 1
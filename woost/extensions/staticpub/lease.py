@@ -0,0 +1,33 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import NamedTuple
+from datetime import datetime
+
+
+class ExportLease(NamedTuple):
+    """A claim by an export operation on one of the lanes of a destination.
+
+    Only one export operation can hold each lane at a time. Leases expire
+    unless they are renewed, so that exports that are interrupted abruptly
+    don't block their lane forever.
+
+    :var export_id: The ID of the export operation holding the lane.
+    :var expiration: The moment when the lease expires.
+    :var yielding: Indicates that the export has paused at a task boundary
+        to let exports in higher priority lanes write to the destination.
+    """
+    export_id: int
+    expiration: datetime
+    yielding: bool = False
+
+    @property
+    def expired(self) -> bool:
+        return self.expiration <= datetime.now()
+
+
+class LeaseLost(Exception):
+    """Raised when an export operation finds that its lease on a lane has
+    expired and has been claimed by another export.
+    """
@@ -35,3 +35,160 @@ def preserve_woost2_info(e):
         else:
             pub.x_staticpub_exportable = value
 
+
+
+@migration_step
+def add_exported_files_record(e):
+
+    from BTrees.OOBTree import OOBTree
+    from woost.extensions.staticpub.destination import Destination
+
+    for destination in Destination.select():
+        if not hasattr(destination, "_exported_files"):
+            destination._exported_files = OOBTree()
+
+
+@migration_step
+def add_export_dependencies(e):
+
+    from BTrees.OOBTree import OOBTree
+    from woost.extensions.staticpub.export import Export
+
+    for export in Export.select():
+        if not hasattr(export, "_dependencies"):
+            export._dependencies = OOBTree()
+
+
+@migration_step
+def add_exported_file_references(e):
+
+    from BTrees.OOBTree import OOBTree, OOTreeSet
+    from woost.extensions.staticpub.destination import Destination
+
+    for destination in Destination.select():
+        destination._reference_counts = OOBTree()
+        destination._orphaned_files = OOTreeSet()
+        destination.rebuild_reference_counts()
+
+
+@migration_step
+def add_pending_dependencies(e):
+
+    from BTrees.OOBTree import OOBTree, OOTreeSet
+    from cocktail.urls import URL
+    from woost import app
+    from woost.extensions.staticpub.destination import Destination
+
+    for destination in Destination.select():
+
+        # Records for dependencies didn't keep track of their item
+        for url, record in list(destination.iter_exported_files()):
+            if record.get("kind") == "dependency" and "item" not in record:
+                resolution = app.url_mapping.resolve(URL(url))
+                if resolution and resolution.publishable:
+                    record = record.copy()
+                    record["item"] = resolution.publishable.id
+                    destination._exported_files[url] = record
+
+        destination._dependencies_by_item = OOBTree()
+        destination._pending_dependencies = OOTreeSet()
+        destination.rebuild_dependency_items()
+
+
+@migration_step
+def add_export_mirrors(e):
+
+    from woost.extensions.staticpub.export import Export
+
+    for export in Export.select():
+        if not hasattr(export, "_mirrors"):
+            export.mirrors = []
+
+
+@migration_step
+def add_export_lanes(e):
+
+    from woost.extensions.staticpub.destination import Destination
+    from woost.extensions.staticpub.export import Export
+
+    for destination in Destination.select():
+        if not hasattr(destination, "_leases"):
+            destination._leases = {}
+
+    for export in Export.select():
+        if not hasattr(export, "_lane"):
+            export.lane = "bulk"
+
+
+@migration_step
+def compact_export_tasks(e):
+
+    from woost.extensions.staticpub.export import Export
+    from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+    for export in Export.select():
+        tasks = export.tasks
+        if tasks is not None and not isinstance(tasks, CompactTaskMap):
+            compact_tasks = CompactTaskMap()
+            for task in tasks.values():
+                compact_task = compact_tasks.add(
+                    task["item"],
+                    task["language"],
+                    task["action"]
+                )
+                compact_task["state"] = task["state"]
+                compact_task["error_message"] = task.get("error_message")
+            export.tasks = compact_tasks
+
+
+@migration_step
+def add_superseded_files(e):
+
+    from BTrees.OOBTree import OOBTree
+    from woost.extensions.staticpub.destination import Destination
+
+    for destination in Destination.select():
+        if not hasattr(destination, "_superseded_files"):
+            destination._superseded_files = OOBTree()
+
+
+@migration_step
+def split_task_bucket_status(e):
+
+    from BTrees.Length import Length
+    from woost.extensions.staticpub.export import Export
+    from woost.extensions.staticpub.taskmap import (
+        CompactTaskMap,
+        TaskBucketStatus
+    )
+
+    for export in Export.select():
+        tasks = export.tasks
+        if not isinstance(tasks, CompactTaskMap):
+            continue
+
+        for bucket in tasks._buckets.values():
+            if not hasattr(bucket, "status"):
+                status = TaskBucketStatus()
+                status.actions = bucket.actions
+                status.states = bucket.states
+                status.error_messages = bucket.error_messages
+                del bucket.actions
+                del bucket.states
+                del bucket.error_messages
+                bucket.status = status
+
+        tasks._state_counts = {
+            state: count if isinstance(count, Length) else Length(count)
+            for state, count in tasks._state_counts.items()
+        }
+
+
+@migration_step
+def add_publishable_priority(e):
+
+    from woost.models import Publishable
+
+    for pub in Publishable.select():
+        if not hasattr(pub, "_x_staticpub_priority"):
+            pub.x_staticpub_priority = 0
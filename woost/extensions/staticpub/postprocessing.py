@@ -0,0 +1,284 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Tuple
+)
+import re
+import secrets
+
+from cocktail.urls import URL
+
+from .javascript import iter_javascript_strings
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup, Tag
+
+HTMLReference = Tuple['Tag', str, str, Optional[str]]
+AddReference = Callable[[str, Optional[str], str], str]
+
+
+def iter_html_references(
+        document: 'BeautifulSoup') -> Iterable[HTMLReference]:
+    """Finds the URLs referenced by the attributes of an HTML document.
+
+    :return: An iterable sequence of (element, attribute, URL, content type)
+        tuples.
+    """
+    for link in document.find_all("link"):
+        href = link.get("href")
+        if href:
+            ctype = link.get("type")
+            if not ctype:
+                rel = link.get("rel")
+                if rel and str(rel).lower() == "stylesheet":
+                    ctype = "text/css"
+            yield link, "href", href, ctype
+
+    for script in document.find_all("script"):
+        src = script.get("src")
+        if src:
+            yield (
+                script,
+                "src",
+                src,
+                script.get("type") or "application/javascript"
+            )
+
+    for img in document.find_all("img"):
+        src = img.get("src")
+        if src:
+            yield img, "src", src, None
+
+    for video in document.find_all("video"):
+        src = video.get("src")
+        if src:
+            yield video, "src", src, video.get("type")
+
+    for audio in document.find_all("audio"):
+        src = audio.get("src")
+        if src:
+            yield audio, "src", src, audio.get("type")
+
+    for source in document.find_all("source"):
+        src = source.get("src")
+        if src:
+            yield source, "src", src, source.get("type")
+
+    for a in document.find_all("a"):
+        href = a.get("href")
+        if href and not href.startswith("#"):
+            yield a, "href", href, a.get("type")
+
+    for iframe in document.find_all("iframe"):
+        src = iframe.get("src")
+        if src:
+            yield iframe, "src", src, None
+
+
+class ContentReference(NamedTuple):
+    """A reference found while preparing a resource.
+
+    :var value: The URL, as found in the resource. For embedded stylesheets,
+        the source of the stylesheet.
+    :var content_type: The expected content type of the URL, if known.
+    :var context: The syntax surrounding the reference, which determines how
+        its replacement must be escaped: one of "html" (an attribute value),
+        "js" (a string in a script) or "style" (an embedded stylesheet, which
+        the export job processes as a whole).
+    """
+    value: str
+    content_type: Optional[str]
+    context: str
+
+
+class PreparedContent(NamedTuple):
+    """A resource whose URLs have been replaced with placeholders.
+
+    :var template: The processed content of the resource, with a placeholder
+        in place of each of its references.
+    :var token: A random token that tells the placeholders apart from the
+        rest of the content.
+    :var references: The references in the resource, in the order of their
+        placeholders.
+    """
+    template: str
+    token: str
+    references: List[ContentReference]
+
+    def fill(self, replacements: List[str]) -> str:
+        """Replaces each placeholder with the URL at the same position in
+        the given list. Replacements must be escaped by the caller.
+        """
+        return re.sub(
+            f"{self.token}(\\d+)",
+            lambda match: replacements[int(match.group(1))],
+            self.template
+        )
+
+
+def escape_reference(value: str, context: str) -> str:
+    """Escapes a replacement for the syntax surrounding a placeholder."""
+
+    if context == "html":
+        return (
+            value
+            .replace("&", "&amp;")
+            .replace("<", "&lt;")
+            .replace(">", "&gt;")
+            .replace('"', "&quot;")
+        )
+
+    return value
+
+
+class ContentPreparer:
+    """Parses and serializes HTML documents, leaving placeholders in place of
+    the URLs they reference.
+
+    This is the CPU intensive part of rewriting exported documents, and it
+    doesn't require access to the database, so export jobs can run it on a
+    pool of processes. Resolving the references and filling the placeholders
+    is left to the export job; so is the processing of embedded stylesheets,
+    which shares the job's cache of processed stylesheets.
+
+    Export jobs prepare their documents through a preparer whether they use
+    a pool of processes or not, so customizations to the rewriting of
+    documents belong in subclasses (see `ExportJob.content_preparer_class`).
+    Instances are sent to worker processes, so they must be picklable.
+    """
+
+    js_url_regexp: Pattern = None
+    max_embedded_javascript_size: int = None
+
+    def prepare(self, content: bytes, content_type: str) -> PreparedContent:
+
+        token = secrets.token_hex(8)
+        references = []
+
+        def add_reference(value, content_type, context):
+            references.append(ContentReference(value, content_type, context))
+            return f"{token}{len(references) - 1}"
+
+        if content_type == "text/html":
+            template = self.prepare_html(content, add_reference)
+        else:
+            raise ValueError(f"Can't prepare resources of type {content_type}")
+
+        return PreparedContent(template, token, references)
+
+    def prepare_html(self, content: bytes, add_reference: AddReference) -> str:
+        document = self.parse_html(content)
+        self.process_html(document, add_reference)
+        return self.serialize_html(document)
+
+    def parse_html(self, content: bytes) -> 'BeautifulSoup':
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(content, features="lxml")
+
+    def serialize_html(self, document: 'BeautifulSoup') -> str:
+        return str(document)
+
+    def process_html(
+            self,
+            document: 'BeautifulSoup',
+            add_reference: AddReference):
+
+        # Embedded styles are processed by the export job
+        for element in document.find_all("style"):
+            content_type = element.get("type")
+            if (
+                (not content_type or content_type == "text/css")
+                and element.string
+            ):
+                element.string = \
+                    add_reference(element.string, "text/css", "style")
+
+        # Process embdded scripts
+        for element in document.find_all("script"):
+            content_type = element.get("type")
+            if (
+                (not content_type or content_type == "text/javascript")
+                and element.string
+            ):
+                element.string = self.process_embedded_javascript(
+                    element.string,
+                    add_reference
+                )
+
+        # Transform URLs
+        for element, attr, url, content_type \
+        in self.iter_urls_in_html(document):
+            self.process_html_url(
+                element,
+                attr,
+                url,
+                content_type,
+                add_reference
+            )
+
+    def iter_urls_in_html(
+            self,
+            document: 'BeautifulSoup') -> Iterable[HTMLReference]:
+        return iter_html_references(document)
+
+    def process_html_url(
+            self,
+            element: 'Tag',
+            attr: str,
+            url: str,
+            content_type: Optional[str],
+            add_reference: AddReference):
+
+        if URL(url).scheme not in ("javascript", "mailto"):
+            element[attr] = add_reference(url, content_type, "html")
+
+    def process_embedded_javascript(
+            self,
+            content: str,
+            add_reference: AddReference) -> str:
+
+        # Leave very large scripts (typically serialized state) untouched
+        if (
+            self.js_url_regexp is None
+            or (
+                self.max_embedded_javascript_size is not None
+                and len(content) > self.max_embedded_javascript_size
+            )
+        ):
+            return content
+
+        def replace_url(match):
+            value = match.group("url")
+            if not value or value.startswith("javascript:"):
+                return match.group(0)
+            return (
+                match.group("head")
+                + add_reference(value, "application/javascript", "js")
+                + match.group("tail")
+            )
+
+        chunks = []
+        pos = 0
+
+        for string in iter_javascript_strings(content):
+            value = content[string.start:string.end]
+            new_value = self.js_url_regexp.sub(replace_url, value)
+            if new_value != value:
+                chunks.append(content[pos:string.start])
+                chunks.append(new_value)
+                pos = string.end
+
+        if not chunks:
+            return content
+
+        chunks.append(content[pos:])
+        return "".join(chunks)
@@ -0,0 +1,199 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Dict, Sequence
+from collections import defaultdict
+from heapq import nlargest
+from operator import itemgetter
+from math import ceil, log
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter, thread_time
+
+
+class ExportProfiler:
+    """Collects wall and CPU time for the different phases of an export job.
+
+    Phases can be nested; the time spent in a nested phase is subtracted from
+    its parent, so that the time reported for each phase is exclusive. Time is
+    also aggregated by URL, attributing each phase to the URL of the innermost
+    phase that declared one; only the totals of the slowest URLs are kept
+    (see `tracked_urls`).
+    """
+
+    percentiles: Sequence[int] = (50, 90, 99)
+
+    # The number of URLs whose totals are kept. Once twice as many are being
+    # tracked, only the slowest ones are retained.
+    tracked_urls: int = 1000
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__local = local()
+        self.__start = perf_counter()
+        self.__end = None
+        self.__phases = defaultdict(PhaseStats)
+        self.__urls = {}
+
+    @contextmanager
+    def measure(self, phase: str, url: str = None, kind: str = None):
+
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = self.__local.stack = []
+
+        parent = stack[-1] if stack else None
+        if url is None and parent is not None:
+            url = parent["url"]
+            kind = parent["kind"]
+
+        frame = {
+            "url": url,
+            "kind": kind,
+            "child_wall": 0.0,
+            "child_cpu": 0.0
+        }
+        stack.append(frame)
+        wall_start = perf_counter()
+        cpu_start = thread_time()
+
+        try:
+            yield
+        finally:
+            wall = perf_counter() - wall_start
+            cpu = thread_time() - cpu_start
+            stack.pop()
+
+            if parent is not None:
+                parent["child_wall"] += wall
+                parent["child_cpu"] += cpu
+
+            self.__add(
+                phase,
+                url,
+                kind,
+                wall - frame["child_wall"],
+                cpu - frame["child_cpu"]
+            )
+
+    def __add(self, phase, url, kind, wall, cpu):
+        with self.__lock:
+            self.__phases[phase].add(wall, cpu)
+            if url is not None:
+                key = str(url)
+                url_totals = self.__urls.get(key)
+                if url_totals is None:
+                    url_totals = self.__urls[key] = {
+                        "url": key,
+                        "kind": kind,
+                        "wall": 0.0,
+                        "cpu": 0.0,
+                        "phases": defaultdict(float)
+                    }
+                    if len(self.__urls) > 2 * self.tracked_urls:
+                        self.__urls = self.__get_slowest_urls(
+                            self.tracked_urls
+                        )
+                url_totals["wall"] += wall
+                url_totals["cpu"] += cpu
+                url_totals["phases"][phase] += wall
+
+    def __get_slowest_urls(self, count):
+        return {
+            url_totals["url"]: url_totals
+            for url_totals in nlargest(
+                count,
+                self.__urls.values(),
+                key=itemgetter("wall")
+            )
+        }
+
+    def stop(self):
+        self.__end = perf_counter()
+
+    def get_summary(self, slowest: int = 10) -> Dict:
+        """Produces a summary of the collected measurements.
+
+        :param slowest: The number of URLs to include in the list of slowest
+            URLs.
+
+        :return: A dictionary containing only primitive types, suitable for
+            storage and comparison between different runs.
+        """
+        with self.__lock:
+            end = self.__end if self.__end is not None else perf_counter()
+            phases = {}
+
+            for phase, stats in self.__phases.items():
+                phase_summary = {
+                    "count": stats.count,
+                    "wall": stats.wall,
+                    "cpu": stats.cpu,
+                    "max": stats.max
+                }
+                for p in self.percentiles:
+                    phase_summary[f"p{p}"] = stats.get_percentile(p)
+                phases[phase] = phase_summary
+
+            slowest_urls = self.__get_slowest_urls(slowest).values()
+
+            return {
+                "wall": end - self.__start,
+                "phases": phases,
+                "slowest": [
+                    dict(url_totals, phases=dict(url_totals["phases"]))
+                    for url_totals in slowest_urls
+                ]
+            }
+
+
+class PhaseStats:
+    """Running aggregates for the measurements of a phase.
+
+    Long exports measure millions of operations, so individual measurements
+    aren't kept. Percentiles are estimated from a histogram of wall times,
+    with logarithmic buckets; estimates are within `resolution` of the
+    actual value.
+    """
+
+    min_time: float = 1e-6
+    resolution: float = 0.05
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.max = 0.0
+        self.buckets = defaultdict(int)
+
+    def add(self, wall: float, cpu: float):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        if wall > self.max:
+            self.max = wall
+        self.buckets[self.get_bucket(wall)] += 1
+
+    def get_bucket(self, value: float) -> int:
+        if value <= self.min_time:
+            return 0
+        return ceil(log(value / self.min_time, 1 + self.resolution))
+
+    def get_percentile(self, percentile: int) -> float:
+        """Estimates a percentile of the wall times, using the nearest rank
+        method.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = max(1, -(-percentile * self.count // 100))
+        seen = 0
+
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                upper_bound = self.min_time * (1 + self.resolution) ** bucket
+                return min(upper_bound, self.max)
+
+        return self.max
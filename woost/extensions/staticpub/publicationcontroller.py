@@ -2,11 +2,14 @@
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
+from typing import Any, Dict, Iterable, List, Tuple
+from time import monotonic
+import json
+
 import cherrypy
 from cocktail.translations import translations, set_language
 from cocktail import schema
-from cocktail.urls import URL
-from cocktail.persistence import transaction
+from cocktail.persistence import datastore, transaction
 from cocktail.controllers import (
     Controller,
     request_property,
@@ -17,6 +20,7 @@ from woost import app
 from woost.models import (
     Item,
     Document,
+    Publishable,
     LocaleMember,
     changeset_context
 )
@@ -26,6 +30,7 @@ from woost.admin.dataexport import Export as DataExport
 from woost.extensions.staticpub.destination import Destination
 from woost.extensions.staticpub.export import Export
 from woost.extensions.staticpub.exportpermission import ExportPermission
+from .crawlstate import LRUCache
 from .utils import iter_exportable_languages, iter_all_exportable_items
 
 translations.load_bundle("woost.extensions.staticpub.publicationcontroller")
@@ -54,6 +59,9 @@ class ExportStateController(Controller):
             destination=destination
         )
 
+        if cherrypy.request.method == "DELETE":
+            transaction(export.cancel)
+
         export_object = DataExport(include_paths=True).export_object
         tasks = []
         data = {
@@ -78,55 +86,179 @@ class PublicationController(Controller):
 
     state = ExportStateController
 
-    @json_out
+    # Task lists computed for previews, reused while paging through them
+    preview_cache = LRUCache(20)
+    preview_cache_ttl = 60
+
     def __call__(self, lang, **kwargs):
 
         set_language(lang)
 
         if cherrypy.request.method == "GET":
-            return self.preview()
+            if self.stream:
+                return self.stream_preview()
+            return self.respond(self.preview())
         elif cherrypy.request.method == "POST":
             export = self.begin()
-            return {"export_id": export.id}
+            return self.respond({"export_id": export.id})
+
+    @json_out
+    def respond(self, data):
+        return data
 
     def preview(self):
 
-        records = []
-        current_publishable = None
-        current_record = None
+        tasks = self.get_preview_tasks()
+        data = self.get_preview_summary(tasks)
+
+        if not self.summary_only:
+            data["tasks"] = list(self.iter_preview_records(tasks))
+
+        return data
+
+    def stream_preview(self):
+        """Sends the preview as a sequence of JSON documents, one per line:
+        the summary of the preview, followed by a record for each item.
+        """
+        tasks = self.get_preview_tasks()
+        summary = self.get_preview_summary(tasks)
+        records = (
+            () if self.summary_only
+            else self.iter_preview_records(tasks)
+        )
+
+        cherrypy.response.headers["Content-Type"] = "application/x-ndjson"
+        cherrypy.response.stream = True
+
+        def generate():
+            yield (json.dumps(summary, default=str) + "\n").encode("utf-8")
+            for record in records:
+                yield (json.dumps(record, default=str) + "\n").encode("utf-8")
+
+        return generate()
+
+    def get_preview_tasks(self) -> List[Tuple[str, int, str]]:
+        """Obtains the tasks for the selection, as (action, publishable ID,
+        language) tuples.
+
+        Enumerating the tasks for a large selection is expensive, so the
+        list is cached for a short while, to page through it. Pending tasks
+        change with every edit, and are recorded and exported by other
+        processes; lists of pending tasks are only reused until the next
+        transaction is committed to the database.
+        """
         destination = self.destination
-        dest_url = (
-            URL(destination.url)
-            if destination and destination.url
-            else None
+        app.user.require_permission(ExportPermission, destination=destination)
+
+        cache_key = (
+            app.user.id,
+            destination.id,
+            tuple(item.id for item in self.selection or ()),
+            self.pending_only,
+            datastore.db.lastTransaction() if self.pending_only else None,
+            self.include_descendants,
+            self.language_mode,
+            tuple(self.language_subset or ()),
+            self.include_neutral_language
         )
 
-        def finish_record():
-            if current_record:
-                current_record["language_count"] = translations(
-                    "woost.extensions.staticpub.publicationcontroller."
-                    "PublicationController.language_count",
-                    count=len(current_record["languages"])
-                )
+        entry = self.preview_cache.get(cache_key)
+        if entry is not None:
+            created, tasks = entry
+            if monotonic() - created < self.preview_cache_ttl:
+                return tasks
+
+        tasks = [
+            (action, publishable.id, language)
+            for action, publishable, language in self.iter_tasks()
+        ]
+        self.preview_cache[cache_key] = (monotonic(), tasks)
+        return tasks
+
+    def get_preview_summary(
+            self,
+            tasks: List[Tuple[str, int, str]]) -> Dict[str, Any]:
+
+        counts = {}
+        for action, publishable_id, language in tasks:
+            action_counts = counts.setdefault(action, {})
+            language_key = language or ""
+            action_counts[language_key] = \
+                action_counts.get(language_key, 0) + 1
+
+        summary = {
+            "summary": translations(
+                "woost.extensions.staticpub.publicationcontroller."
+                "PublicationController.task_count",
+                count=len(tasks),
+                pending_only=self.pending_only
+            ),
+            "task_count": len(tasks),
+            "counts": counts
+        }
+
+        if self.page_size:
+            summary["page"] = self.page
+            summary["page_size"] = self.page_size
+            summary["page_count"] = -(-len(tasks) // self.page_size)
+
+        return summary
+
+    def iter_preview_records(
+            self,
+            tasks: List[Tuple[str, int, str]]) -> Iterable[Dict[str, Any]]:
+        """Produces a record for each item in the requested page of tasks.
 
-        task_count = 0
+        Items with several languages yield a single record; at page
+        boundaries, an item may be split across two records.
+        """
+        if self.page_size:
+            start = self.page * self.page_size
+            tasks = tasks[start:start + self.page_size]
+
+        destination = self.destination
         export_object = DataExport(include_paths=True).export_object
 
-        for action, publishable, language in self.iter_tasks():
-            task_count += 1
+        # Most items share their ancestors; serialize each chain once
+        parent_chains = {}
+
+        def get_parents(publishable):
+            parent = publishable.parent
+            if parent is None:
+                return []
+            parents = parent_chains.get(parent.id)
+            if parents is None:
+                parents = \
+                    [export_object(parent, ref=True)] + get_parents(parent)
+                parent_chains[parent.id] = parents
+            return parents
+
+        def finish_record(record):
+            record["language_count"] = translations(
+                "woost.extensions.staticpub.publicationcontroller."
+                "PublicationController.language_count",
+                count=len(record["languages"])
+            )
+            return record
+
+        current_id = None
+        current_record = None
+
+        for action, publishable_id, language in tasks:
+
+            publishable = Publishable.get_instance(publishable_id)
+            if publishable is None:
+                continue
 
-            if publishable is not current_publishable:
-                finish_record()
-                current_publishable = publishable
+            if publishable_id != current_id:
+                if current_record:
+                    yield finish_record(current_record)
+                current_id = publishable_id
                 current_record = {
                     "publishable": export_object(publishable, ref=True),
-                    "parents": [
-                        export_object(parent, ref=True)
-                        for parent in publishable.ascend_tree()
-                    ],
+                    "parents": get_parents(publishable),
                     "languages": {}
                 }
-                records.append(current_record)
 
             source_url = publishable.get_uri(language=language)
             export_url = destination.get_export_url(source_url)
@@ -138,17 +270,8 @@ class PublicationController(Controller):
                 "export_url": export_url
             }
 
-        finish_record()
-
-        return {
-            "summary": translations(
-                "woost.extensions.staticpub.publicationcontroller."
-                "PublicationController.task_count",
-                count=task_count,
-                pending_only=self.pending_only
-            ),
-            "tasks": records
-        }
+        if current_record:
+            yield finish_record(current_record)
 
     def begin(self):
 
@@ -157,11 +280,23 @@ class PublicationController(Controller):
                 export = Export.new()
                 export.destination = self.destination
                 export.user = app.user
+                export.lane = "interactive"
+                export.full = not (
+                    self.selection
+                    or self.pending_only
+                    or self.language_mode != "all"
+                    or not self.include_neutral_language
+                )
                 for action, publishable, language in self.iter_tasks():
                     export.add_task(action, publishable, language)
+                if self.pending_only:
+                    export.add_pending_dependencies()
             return export
 
         export = transaction(create_export)
+
+        # Previews of the selection are outdated once the export is created
+        self.preview_cache.clear()
         export.execute_in_subprocess()
         return export
 
@@ -282,6 +417,52 @@ class PublicationController(Controller):
             errors="raise"
         )
 
+    @request_property
+    def page(self):
+        return get_parameter(
+            schema.Integer(
+                "page",
+                required=True,
+                min=0,
+                default=0
+            ),
+            errors="raise"
+        )
+
+    @request_property
+    def page_size(self):
+        return get_parameter(
+            schema.Integer(
+                "page_size",
+                min=1
+            ),
+            errors="raise"
+        )
+
+    @request_property
+    def summary_only(self):
+        return get_parameter(
+            schema.Boolean(
+                "summary_only",
+                required=True,
+                default=False
+            ),
+            implicit_booleans=False,
+            errors="raise"
+        )
+
+    @request_property
+    def stream(self):
+        return get_parameter(
+            schema.Boolean(
+                "stream",
+                required=True,
+                default=False
+            ),
+            implicit_booleans=False,
+            errors="raise"
+        )
+
     @request_property
     def include_neutral_language(self):
         return get_parameter(
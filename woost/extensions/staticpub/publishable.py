@@ -21,5 +21,16 @@ Publishable.add_member(
     )
 )
 
+Publishable.add_member(
+    schema.Integer(
+        "x_staticpub_priority",
+        required=True,
+        default=0,
+        affects_cache_invalidation=False,
+        listed_by_default=False,
+        member_group="publication"
+    )
+)
+
 URI.default_x_staticpub_exportable = False
 
@@ -5,8 +5,29 @@
 import cherrypy
 from cocktail.translations import get_language
 from woost import app
+from woost.models import CachingPolicy
 from woost.controllers.publishablecontroller import PublishableController
 
+from .utils import is_export_request
+
+# Flag requests issued by the static publisher, before the server side cache
+# is consulted. The flag is restored afterwards, so that it doesn't leak into
+# later requests handled by the same thread.
+
+base_call = PublishableController.__call__
+
+def __call__(self, **kwargs):
+
+    prev_exporting = app.x_staticpub_exporting
+    app.x_staticpub_exporting = is_export_request()
+
+    try:
+        return base_call(self, **kwargs)
+    finally:
+        app.x_staticpub_exporting = prev_exporting
+
+PublishableController.__call__ = __call__
+
 # Make PublishableController export an X-Woost-Tags header during static
 # exports
 
@@ -28,3 +49,20 @@ def _produce_content(self, **kwargs):
 
 PublishableController._produce_content = _produce_content
 
+# Exported renders differ from the ones served to visitors (they carry the
+# header above and omit CSRF tokens), so they are cached under their own
+# keys. Successive exports of an unchanged page are then served from the
+# cache, until its cache tags are invalidated.
+
+base_get_content_cache_key = CachingPolicy.get_content_cache_key
+
+def get_content_cache_key(self, publishable, **context):
+
+    cache_key = base_get_content_cache_key(self, publishable, **context)
+
+    if app.x_staticpub_exporting:
+        cache_key = cache_key + ("x_staticpub_exporting",)
+
+    return cache_key
+
+CachingPolicy.get_content_cache_key = get_content_cache_key
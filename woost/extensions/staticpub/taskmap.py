@@ -0,0 +1,236 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Iterable, Optional, Tuple
+from collections.abc import Mapping, MutableMapping
+
+from persistent import Persistent
+from BTrees.IOBTree import IOBTree
+from BTrees.OIBTree import OIBTree
+from BTrees.Length import Length
+
+TASK_ACTIONS = ("post", "delete")
+TASK_STATES = ("pending", "failed", "success")
+TASK_FIELDS = ("item", "language", "action", "state", "error_message")
+
+TaskKey = Tuple[int, Optional[str]]
+
+
+class TaskBucket(Persistent):
+    """A block of consecutive tasks, stored as parallel arrays.
+
+    The items and languages of the tasks never change once added, so they
+    are kept apart from the fields that do change (see `TaskBucketStatus`);
+    updating the state of a task doesn't rewrite them.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.languages = []
+        self.status = TaskBucketStatus()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def append(self, item, language: Optional[str]):
+        self.items.append(item)
+        self.languages.append(language)
+        self.status.append()
+        self._p_changed = True
+
+
+class TaskBucketStatus(Persistent):
+    """The mutable fields of the tasks in a `TaskBucket`.
+
+    Actions and states are stored as indices into `TASK_ACTIONS` and
+    `TASK_STATES`, one byte per task. Error messages are rare, so they are
+    kept in a sparse dictionary.
+    """
+
+    def __init__(self):
+        self.actions = bytearray()
+        self.states = bytearray()
+        self.error_messages = {}
+
+    def append(self):
+        self.actions.append(0)
+        self.states.append(0)
+        self._p_changed = True
+
+
+class CompactTaskMap(Persistent):
+    """Stores the tasks of an export operation in a compact form.
+
+    Tasks used to be a persistent mapping each, which made large exports
+    create (and rewrite) hundreds of thousands of persistent objects. This
+    structure packs tasks into buckets of `bucket_size` tasks, addressed by
+    their insertion index, so that a change in the state of a task only
+    rewrites the status of the bucket that holds it, and the counters for
+    its old and new state. The counters resolve concurrent changes, rather
+    than raising conflicts.
+
+    The map behaves like a mapping of (item ID, language) tuples to tasks,
+    iterated in key order; tasks are `TaskView` objects, which read and
+    write their fields from the buckets.
+    """
+
+    bucket_size = 256
+
+    def __init__(self):
+        self._index = OIBTree()
+        self._buckets = IOBTree()
+        self._length = 0
+        self._state_counts = {state: Length() for state in TASK_STATES}
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __contains__(self, key: TaskKey) -> bool:
+        return self._normalize_key(key) in self._index
+
+    def __iter__(self) -> Iterable[TaskKey]:
+        return iter(self.keys())
+
+    def __getitem__(self, key: TaskKey) -> 'TaskView':
+        return TaskView(self, self._index[self._normalize_key(key)])
+
+    def get(self, key: TaskKey, default=None) -> 'TaskView':
+        index = self._index.get(self._normalize_key(key))
+        if index is None:
+            return default
+        return TaskView(self, index)
+
+    def keys(self) -> Iterable[TaskKey]:
+        for item_id, language in self._index.keys():
+            yield (item_id, language or None)
+
+    def values(self) -> Iterable['TaskView']:
+        for index in self._index.values():
+            yield TaskView(self, index)
+
+    def items(self) -> Iterable[Tuple[TaskKey, 'TaskView']]:
+        for (item_id, language), index in self._index.items():
+            yield (item_id, language or None), TaskView(self, index)
+
+    itervalues = values
+    iteritems = items
+
+    def add(
+            self,
+            item,
+            language: Optional[str],
+            action: str = "post") -> 'TaskView':
+        """Adds a task for the given item and language, or returns the
+        existing one.
+        """
+        key = self._normalize_key((item.id, language))
+        index = self._index.get(key)
+
+        if index is None:
+            index = self._length
+            bucket_id, offset = divmod(index, self.bucket_size)
+            bucket = self._buckets.get(bucket_id)
+            if bucket is None:
+                bucket = TaskBucket()
+                self._buckets[bucket_id] = bucket
+            bucket.append(item, language)
+            bucket.status.actions[offset] = TASK_ACTIONS.index(action)
+            self._index[key] = index
+            self._length += 1
+            self._state_counts["pending"].change(1)
+
+        return TaskView(self, index)
+
+    def count(self, state: str) -> int:
+        """The number of tasks in the given state."""
+        return self._state_counts[state]()
+
+    def get_field(self, index: int, field: str):
+        bucket, offset = self._locate(index)
+        if field == "item":
+            return bucket.items[offset]
+        elif field == "language":
+            return bucket.languages[offset]
+        elif field == "action":
+            return TASK_ACTIONS[bucket.status.actions[offset]]
+        elif field == "state":
+            return TASK_STATES[bucket.status.states[offset]]
+        elif field == "error_message":
+            return bucket.status.error_messages.get(offset)
+        raise KeyError(field)
+
+    def set_field(self, index: int, field: str, value):
+        bucket, offset = self._locate(index)
+        status = bucket.status
+        if field == "action":
+            status.actions[offset] = TASK_ACTIONS.index(value)
+        elif field == "state":
+            prev_state = TASK_STATES[status.states[offset]]
+            status.states[offset] = TASK_STATES.index(value)
+            if prev_state != value:
+                self._state_counts[prev_state].change(-1)
+                self._state_counts[value].change(1)
+        elif field == "error_message":
+            if value is None:
+                status.error_messages.pop(offset, None)
+            else:
+                status.error_messages[offset] = value
+        elif field in TASK_FIELDS:
+            raise TypeError(f"The {field} of a task can't be changed")
+        else:
+            raise KeyError(field)
+        status._p_changed = True
+
+    def _locate(self, index: int) -> Tuple[TaskBucket, int]:
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        bucket_id, offset = divmod(index, self.bucket_size)
+        return self._buckets[bucket_id], offset
+
+    def _normalize_key(self, key: TaskKey) -> Tuple[int, str]:
+        # Keys in the index must be comparable with each other
+        item_id, language = key
+        return (item_id, language or "")
+
+
+class TaskView(MutableMapping):
+    """Exposes a task stored in a `CompactTaskMap` as a dictionary."""
+
+    __slots__ = ("task_map", "index")
+
+    def __init__(self, task_map: CompactTaskMap, index: int):
+        self.task_map = task_map
+        self.index = index
+
+    def __getitem__(self, field: str):
+        return self.task_map.get_field(self.index, field)
+
+    def __setitem__(self, field: str, value):
+        self.task_map.set_field(self.index, field, value)
+
+    def __delitem__(self, field: str):
+        raise TypeError("Can't remove the fields of a task")
+
+    def __iter__(self):
+        return iter(TASK_FIELDS)
+
+    def __len__(self) -> int:
+        return len(TASK_FIELDS)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TaskView):
+            return (
+                self.task_map is other.task_map
+                and self.index == other.index
+            )
+        return isinstance(other, Mapping) and dict(self) == dict(other)
+
+    def __hash__(self) -> int:
+        return hash((id(self.task_map), self.index))
+
+    def __repr__(self) -> str:
+        return f"TaskView({dict(self)!r})"
+
+    def copy(self) -> dict:
+        return dict(self)
@@ -0,0 +1,124 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import Any, Iterable, List, Sequence
+from datetime import datetime
+
+from woost.models import Configuration
+
+_epoch = datetime.min
+
+
+class TaskOrdering:
+    """Decides the order in which an export job executes its tasks.
+
+    Export tasks are stored by item ID, which bears no relation to the
+    relevance of each item. Orderings put the content that visitors are more
+    likely to see first, so that it is refreshed early and an interrupted
+    export has already done the most important work.
+
+    Subclasses implement `get_sort_key`; tasks with lower keys go first.
+    """
+
+    def sort(self, tasks: Iterable[dict]) -> List[dict]:
+        self.prepare()
+        return sorted(tasks, key=self.get_sort_key)
+
+    def prepare(self):
+        """Gathers the state shared by all tasks, before they are sorted."""
+
+    def get_sort_key(self, task: dict) -> Any:
+        raise ValueError("Not implemented")
+
+
+class CompositeTaskOrdering(TaskOrdering):
+    """Sorts tasks by several criteria; each ordering breaks the ties left
+    by the previous ones.
+    """
+
+    def __init__(self, orderings: Sequence[TaskOrdering]):
+        self.orderings = list(orderings)
+
+    def prepare(self):
+        for ordering in self.orderings:
+            ordering.prepare()
+
+    def get_sort_key(self, task: dict) -> Any:
+        return tuple(
+            ordering.get_sort_key(task)
+            for ordering in self.orderings
+        )
+
+
+class WebsiteHomeFirst(TaskOrdering):
+    """Exports the home pages of all websites before anything else."""
+
+    def prepare(self):
+        self.home_ids = set(
+            website.home.id
+            for website in Configuration.instance.websites
+            if website.home is not None
+        )
+
+    def get_sort_key(self, task: dict) -> Any:
+        return task["item"].id not in self.home_ids
+
+
+class ExplicitPriority(TaskOrdering):
+    """Sorts tasks by the priority assigned to their items by editors (see
+    `x_staticpub_priority`); higher priorities go first.
+    """
+
+    def get_sort_key(self, task: dict) -> Any:
+        return -(task["item"].x_staticpub_priority or 0)
+
+
+class TreeDepth(TaskOrdering):
+    """Exports items closer to the root of the document tree (such as
+    section indexes) first.
+
+    Depths are memoised by item, so that sorting all the tasks of an export
+    visits each ancestor once, rather than once per descendant.
+    """
+
+    def prepare(self):
+        self.depths = {}
+
+    def get_sort_key(self, task: dict) -> Any:
+        return self.get_depth(task["item"])
+
+    def get_depth(self, item) -> int:
+
+        depths = self.depths
+        chain = []
+        depth = -1
+
+        while item is not None:
+            known_depth = depths.get(item.id)
+            if known_depth is not None:
+                depth = known_depth
+                break
+            chain.append(item)
+            item = item.parent
+
+        for item in reversed(chain):
+            depth += 1
+            depths[item.id] = depth
+
+        return depth
+
+
+class RecentlyModifiedFirst(TaskOrdering):
+    """Exports the most recently modified items first."""
+
+    def get_sort_key(self, task: dict) -> Any:
+        return _epoch - (task["item"].last_update_time or _epoch)
+
+
+default_task_ordering = CompositeTaskOrdering([
+    WebsiteHomeFirst(),
+    ExplicitPriority(),
+    TreeDepth(),
+    RecentlyModifiedFirst()
+])
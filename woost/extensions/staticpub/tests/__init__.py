@@ -0,0 +1,4 @@
+"""Test suite for the staticpub extension.
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
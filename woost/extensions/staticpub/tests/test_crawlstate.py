@@ -0,0 +1,145 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+import os
+import tempfile
+from unittest import TestCase
+
+
+class CrawlStateTests:
+
+    def create_state(self):
+        raise ValueError("Not implemented")
+
+    def setUp(self):
+        self.state = self.create_state()
+
+    def tearDown(self):
+        self.state.close()
+
+    def test_sets(self):
+
+        for url_set in (self.state.document_urls, self.state.dependencies):
+            self.assertFalse(url_set)
+            self.assertEqual(len(url_set), 0)
+
+            url_set.add("http://example.com/a")
+            url_set.add("http://example.com/b")
+            url_set.add("http://example.com/a")
+
+            self.assertTrue(url_set)
+            self.assertEqual(len(url_set), 2)
+            self.assertIn("http://example.com/a", url_set)
+            self.assertNotIn("http://example.com/c", url_set)
+
+            url_set.discard("http://example.com/a")
+            url_set.discard("http://example.com/c")
+
+            self.assertEqual(len(url_set), 1)
+            self.assertNotIn("http://example.com/a", url_set)
+            self.assertIn("http://example.com/b", url_set)
+
+    def test_sets_are_independent(self):
+        self.state.document_urls.add("http://example.com/a")
+        self.assertNotIn("http://example.com/a", self.state.dependencies)
+        self.assertNotIn(
+            "http://example.com/a",
+            self.state.pending_dependencies
+        )
+
+    def test_queue(self):
+
+        queue = self.state.pending_dependencies
+        urls = {
+            "http://example.com/a",
+            "http://example.com/b?x=1",
+            "http://example.com/c"
+        }
+
+        for url in urls:
+            queue.add(url)
+        queue.add("http://example.com/a")
+        queue.discard("http://example.com/c")
+
+        self.assertEqual(len(queue), 2)
+        self.assertIn("http://example.com/b?x=1", queue)
+
+        popped = {str(queue.pop()), str(queue.pop())}
+        self.assertEqual(popped, urls - {"http://example.com/c"})
+        self.assertFalse(queue)
+
+        with self.assertRaises(KeyError):
+            queue.pop()
+
+
+class MemoryCrawlStateTestCase(CrawlStateTests, TestCase):
+
+    def create_state(self):
+        from woost.extensions.staticpub.crawlstate import MemoryCrawlState
+        return MemoryCrawlState()
+
+
+class SQLiteCrawlStateTestCase(CrawlStateTests, TestCase):
+
+    def create_state(self):
+        from woost.extensions.staticpub.crawlstate import SQLiteCrawlState
+        return SQLiteCrawlState()
+
+    def test_temporary_file_is_removed(self):
+        path = self.state.path
+        self.assertTrue(os.path.exists(path))
+        self.state.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_previous_state_is_discarded(self):
+
+        from woost.extensions.staticpub.crawlstate import SQLiteCrawlState
+
+        with tempfile.TemporaryDirectory() as temp_folder:
+            path = os.path.join(temp_folder, "state.sqlite")
+
+            state = SQLiteCrawlState(path)
+            state.dependencies.add("http://example.com/a")
+            state.close()
+            self.assertTrue(os.path.exists(path))
+
+            state = SQLiteCrawlState(path)
+            try:
+                self.assertNotIn("http://example.com/a", state.dependencies)
+            finally:
+                state.close()
+
+
+class LRUCacheTestCase(TestCase):
+
+    def test_discards_least_recently_used_entries(self):
+
+        from woost.extensions.staticpub.crawlstate import LRUCache
+
+        cache = LRUCache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache["a"], 1)
+
+        cache["c"] = 3
+        self.assertEqual(len(cache), 2)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+
+        cache["a"] = 4
+        cache["d"] = 5
+        self.assertEqual(cache.get("a"), 4)
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.get("c", 0), 0)
+
+    def test_clear(self):
+
+        from woost.extensions.staticpub.crawlstate import LRUCache
+
+        cache = LRUCache(2)
+        cache["a"] = 1
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertNotIn("a", cache)
@@ -0,0 +1,162 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from unittest import TestCase
+
+
+class IterCSSReferencesTestCase(TestCase):
+
+    def assert_references(self, css, *expected):
+        from woost.extensions.staticpub.css import iter_css_references
+        self.assertEqual(
+            [(ref.url, ref.kind) for ref in iter_css_references(css)],
+            list(expected)
+        )
+
+    def test_url_functions(self):
+        self.assert_references(
+            """
+            a { background: url(a.png); }
+            b { background: URL( "b.png" ); }
+            c { background: url('c.png') no-repeat; }
+            """,
+            ("a.png", "url"),
+            ("b.png", "url"),
+            ("c.png", "url")
+        )
+
+    def test_url_spans(self):
+
+        from woost.extensions.staticpub.css import iter_css_references
+
+        css = "a { background: url( 'a.png' ) }"
+        ref, = iter_css_references(css)
+        self.assertEqual(css[ref.start:ref.end], "url( 'a.png' )")
+
+    def test_escapes(self):
+        self.assert_references(
+            r"""
+            a { background: url("a\"b.png"); }
+            b { background: url(c\)d.png); }
+            c { background: url("\66 oo.png"); }
+            """,
+            ('a"b.png', "url"),
+            ("c)d.png", "url"),
+            ("foo.png", "url")
+        )
+
+    def test_imports(self):
+        self.assert_references(
+            """
+            @import "a.css";
+            @import url(b.css) screen;
+            @IMPORT 'c.css';
+            """,
+            ("a.css", "import"),
+            ("b.css", "url"),
+            ("c.css", "import")
+        )
+
+    def test_image_sets(self):
+        self.assert_references(
+            """
+            a {
+                background: image-set("a.png" 1x, url(b.png) 2x);
+                content: "c.png";
+                background: -webkit-image-set('d.png' 1x);
+            }
+            """,
+            ("a.png", "image-set"),
+            ("b.png", "url"),
+            ("d.png", "image-set")
+        )
+
+    def test_comments_and_strings_are_skipped(self):
+        self.assert_references(
+            """
+            /* url(a.png) */
+            a { content: "url(b.png)"; background: url(c.png); }
+            """,
+            ("c.png", "url")
+        )
+
+    def test_functions_ending_in_url_are_ignored(self):
+        self.assert_references(
+            "a { background: my-url(a.png); mask: url(b.svg); }",
+            ("b.svg", "url")
+        )
+
+    def test_unclosed_url_function(self):
+        self.assert_references("a { background: url(a.png")
+
+
+class RewriteCSSTestCase(TestCase):
+
+    def test_rewrite(self):
+
+        from woost.extensions.staticpub.css import (
+            iter_css_references,
+            rewrite_css
+        )
+
+        css = (
+            '@import "a.css"; '
+            "b { background: url(b.png); } "
+            "c { background: image-set('c.png' 1x); } "
+            "d { background: url(d.png); }"
+        )
+
+        def replace(ref):
+            if ref.url == "d.png":
+                return None
+            return "/new/" + ref.url
+
+        self.assertEqual(
+            rewrite_css(css, list(iter_css_references(css)), replace),
+            '@import "/new/a.css"; '
+            "b { background: url('/new/b.png'); } "
+            "c { background: image-set('/new/c.png' 1x); } "
+            "d { background: url(d.png); }"
+        )
+
+    def test_rewrite_quotes_urls(self):
+
+        from woost.extensions.staticpub.css import (
+            iter_css_references,
+            rewrite_css
+        )
+
+        css = "a { background: url(a.png); }"
+        self.assertEqual(
+            rewrite_css(
+                css,
+                list(iter_css_references(css)),
+                lambda ref: "it's.png"
+            ),
+            r"a { background: url('it\'s.png'); }"
+        )
+
+    def test_unchanged_stylesheet(self):
+
+        from woost.extensions.staticpub.css import (
+            iter_css_references,
+            rewrite_css
+        )
+
+        css = "a { background: url(a.png); }"
+        refs = list(iter_css_references(css))
+        self.assertIs(rewrite_css(css, refs, lambda ref: None), css)
+
+
+class CSSURLIsRelativeTestCase(TestCase):
+
+    def test_relative_urls(self):
+
+        from woost.extensions.staticpub.css import css_url_is_relative
+
+        for url in ("a.png", "../a.png", " a.png", "a/b.png?x=1"):
+            self.assertTrue(css_url_is_relative(url), url)
+
+        for url in ("/a.png", "http://example.com/a.png", "data:image/png"):
+            self.assertFalse(css_url_is_relative(url), url)
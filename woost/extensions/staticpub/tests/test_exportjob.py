@@ -0,0 +1,124 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+import os
+import tempfile
+
+from woost.tests.models.basetestcase import BaseTestCase
+from woost.extensions.staticpub.benchmark import SyntheticSite
+
+
+class BrokenImageSite(SyntheticSite):
+    """A synthetic site whose pages embed an image that doesn't exist."""
+
+    missing_image_path = "/assets/images/missing.png"
+
+    def render_page(self, n, language):
+        return SyntheticSite.render_page(self, n, language).replace(
+            b"</body>",
+            f'<img src="{self.missing_image_path}"></body>'.encode("utf-8")
+        )
+
+
+class DependencyExportTestCase(BaseTestCase):
+
+    def export_site(self, site, **job_settings):
+
+        from cocktail.events import when
+        from woost.extensions.staticpub.benchmark import (
+            BenchmarkExportJob,
+            CommitCounter,
+            StubOrigin
+        )
+        from woost.extensions.staticpub.export import Export
+        from woost.extensions.staticpub.folderdestination import (
+            FolderDestination
+        )
+        from woost.extensions.staticpub.folderexporter import FolderExporter
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        temp_folder = tempfile.mkdtemp(dir=self._temp_dir)
+
+        with StubOrigin(site) as origin:
+
+            destination = FolderDestination()
+            destination.root_folder = temp_folder
+            destination.url = origin.get_url("/")
+
+            export = Export()
+            export.destination = destination
+            export.tasks = CompactTaskMap()
+
+            for page in site.iter_pages():
+                for language in site.languages:
+                    export.tasks.add(page, language)
+
+            job = BenchmarkExportJob(
+                export,
+                origin,
+                FolderExporter(temp_folder)
+            )
+            for key, value in job_settings.items():
+                setattr(job, key, value)
+
+            job.failed_dependencies = []
+
+            @when(job.dependency_transfer_failed)
+            def record_failure(e):
+                job.failed_dependencies.append(str(e.resource.source_url))
+
+            with CommitCounter() as commit_counter:
+                job.execute()
+
+        return origin, destination, export, job, commit_counter
+
+    def get_dependency_records(self, destination):
+        return {
+            url: record
+            for url, record in destination.iter_exported_files()
+            if record.get("kind") == "dependency"
+        }
+
+    def test_dependency_records_are_batched(self):
+
+        site = SyntheticSite(pages=5, images=30, image_size=64)
+        origin, destination, export, job, commit_counter = self.export_site(
+            site,
+            dependency_commit_size=10
+        )
+
+        dependency_count = len(job.dependencies)
+        self.assertEqual(
+            len(self.get_dependency_records(destination)),
+            dependency_count
+        )
+        self.assertEqual(job.failed_dependencies, [])
+        self.assertEqual(export.state, "completed")
+
+        # Dependencies are committed along with tasks, or in batches; never
+        # once per dependency
+        self.assertLess(
+            commit_counter.commits,
+            len(export.tasks) + dependency_count // 10 + 3
+        )
+
+    def test_error_responses_are_not_exported(self):
+
+        site = BrokenImageSite(pages=2, images=2, image_size=64)
+        origin, destination, export, job, commit_counter = self.export_site(
+            site
+        )
+
+        missing_url = str(origin.get_url(site.missing_image_path))
+        self.assertEqual(job.failed_dependencies, [missing_url])
+        self.assertNotIn(missing_url, self.get_dependency_records(destination))
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(
+                    destination.root_folder,
+                    *site.missing_image_path.strip("/").split("/")
+                )
+            )
+        )
+        self.assertEqual(export.tasks.count("failed"), 0)
@@ -0,0 +1,87 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from time import perf_counter
+from unittest import TestCase
+
+
+class IterJavaScriptStringsTestCase(TestCase):
+
+    def assert_strings(self, js, *expected):
+        from woost.extensions.staticpub.javascript import (
+            iter_javascript_strings
+        )
+        self.assertEqual(
+            [js[s.start:s.end] for s in iter_javascript_strings(js)],
+            list(expected)
+        )
+
+    def test_quoted_strings(self):
+        self.assert_strings(
+            """var a = "foo", b = 'bar', c = "";""",
+            "foo",
+            "bar",
+            ""
+        )
+
+    def test_escaped_delimiters(self):
+        self.assert_strings(
+            r"""x("a\"b", 'c\'d');""",
+            r"a\"b",
+            r"c\'d"
+        )
+
+    def test_unclosed_string_ends_at_line_break(self):
+        self.assert_strings('x = "foo\ny = "bar";', "foo", "bar")
+
+    def test_comments_are_skipped(self):
+        self.assert_strings(
+            """
+            // "line"
+            /* "block"
+               'comment' */
+            x = "code";
+            """,
+            "code"
+        )
+
+    def test_regexps_are_skipped(self):
+        self.assert_strings(
+            r"""x = /"[/"]\/'/g.test("a"); return /'/;""",
+            "a"
+        )
+
+    def test_division_is_not_a_regexp(self):
+        self.assert_strings(
+            """x = a / 2 + f() / "b" + c[0] / 'd';""",
+            "b",
+            "d"
+        )
+
+    def test_template_literals(self):
+        self.assert_strings(
+            """x = `a${ {k: "b"}["k"] + `c${"d"}e` }f`;""",
+            "a",
+            "b",
+            "k",
+            "c",
+            "d",
+            "e",
+            "f"
+        )
+
+    def test_unclosed_regexps_are_scanned_in_linear_time(self):
+
+        from woost.extensions.staticpub.javascript import (
+            iter_javascript_strings
+        )
+
+        js = "=/[" * 20000 + '\nx = "a";'
+
+        start = perf_counter()
+        strings = list(iter_javascript_strings(js))
+        duration = perf_counter() - start
+
+        self.assertEqual([js[s.start:s.end] for s in strings], ["a"])
+        self.assertLess(duration, 1)
@@ -0,0 +1,108 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from woost.tests.models.basetestcase import BaseTestCase
+
+
+class PreviewDestination:
+    """Stands in for the destination of a preview, deriving export URLs from
+    source URLs.
+    """
+
+    def get_export_url(self, source_url):
+        return f"export:{source_url}"
+
+
+class PreviewPaginationTestCase(BaseTestCase):
+
+    def setUp(self):
+
+        from woost.models import Publishable
+        from woost.extensions.staticpub.publicationcontroller import (
+            PublicationController
+        )
+
+        BaseTestCase.setUp(self)
+
+        self.items = []
+        for n in range(3):
+            item = Publishable()
+            item.insert()
+            self.items.append(item)
+
+        a, b, c = [item.id for item in self.items]
+        self.tasks = [
+            ("post", a, "ca"),
+            ("post", a, "en"),
+            ("post", a, "es"),
+            ("post", b, None),
+            ("delete", c, "en")
+        ]
+
+        class PreviewController(PublicationController):
+            destination = PreviewDestination()
+            pending_only = False
+            page = 0
+            page_size = 2
+
+        self.controller = PreviewController()
+
+    def get_page(self, page):
+        self.controller.page = page
+        return [
+            (
+                record["publishable"]["id"],
+                {
+                    language: entry["action"]
+                    for language, entry in record["languages"].items()
+                }
+            )
+            for record in self.controller.iter_preview_records(self.tasks)
+        ]
+
+    def test_summary(self):
+
+        summary = self.controller.get_preview_summary(self.tasks)
+
+        self.assertEqual(summary["task_count"], 5)
+        self.assertEqual(summary["page"], 0)
+        self.assertEqual(summary["page_size"], 2)
+        self.assertEqual(summary["page_count"], 3)
+        self.assertEqual(
+            summary["counts"],
+            {"post": {"ca": 1, "en": 1, "es": 1, "": 1}, "delete": {"en": 1}}
+        )
+
+    def test_summary_without_pagination(self):
+        self.controller.page_size = None
+        summary = self.controller.get_preview_summary(self.tasks)
+        self.assertEqual(summary["task_count"], 5)
+        self.assertNotIn("page_count", summary)
+
+    def test_pages(self):
+
+        a, b, c = [item.id for item in self.items]
+
+        self.assertEqual(
+            self.get_page(0),
+            [(a, {"ca": "post", "en": "post"})]
+        )
+
+        # Items are split at page boundaries
+        self.assertEqual(
+            self.get_page(1),
+            [(a, {"es": "post"}), (b, {"": "post"})]
+        )
+        self.assertEqual(self.get_page(2), [(c, {"en": "delete"})])
+        self.assertEqual(self.get_page(3), [])
+
+    def test_deleted_items_are_skipped(self):
+
+        a, b, c = [item.id for item in self.items]
+        self.items[1].delete()
+
+        self.assertEqual(
+            self.get_page(1),
+            [(a, {"es": "post"})]
+        )
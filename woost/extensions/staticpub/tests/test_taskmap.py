@@ -0,0 +1,145 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from unittest import TestCase
+
+
+class Item:
+
+    def __init__(self, id):
+        self.id = id
+
+
+class CompactTaskMapTestCase(TestCase):
+
+    def test_add(self):
+
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        tasks = CompactTaskMap()
+        item = Item(5)
+        task = tasks.add(item, "en", "delete")
+
+        self.assertEqual(len(tasks), 1)
+        self.assertIn((5, "en"), tasks)
+        self.assertNotIn((5, "ca"), tasks)
+        self.assertEqual(
+            dict(task),
+            {
+                "item": item,
+                "language": "en",
+                "action": "delete",
+                "state": "pending",
+                "error_message": None
+            }
+        )
+        self.assertEqual(tasks[(5, "en")], task)
+
+    def test_add_existing_task(self):
+
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        tasks = CompactTaskMap()
+        item = Item(1)
+        task = tasks.add(item, "en")
+        self.assertEqual(tasks.add(item, "en", "delete"), task)
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(task["action"], "post")
+
+    def test_tasks_without_language(self):
+
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        tasks = CompactTaskMap()
+        tasks.add(Item(1), None)
+        tasks.add(Item(1), "en")
+
+        self.assertIn((1, None), tasks)
+        self.assertIsNone(tasks[(1, None)]["language"])
+        self.assertEqual(list(tasks.keys()), [(1, None), (1, "en")])
+
+    def test_iteration_follows_key_order(self):
+
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        tasks = CompactTaskMap()
+        for item_id, language in [(3, "en"), (1, "es"), (2, "en"), (1, "ca")]:
+            tasks.add(Item(item_id), language)
+
+        expected = [(1, "ca"), (1, "es"), (2, "en"), (3, "en")]
+        self.assertEqual(list(tasks), expected)
+        self.assertEqual(
+            [(task["item"].id, task["language"]) for task in tasks.values()],
+            expected
+        )
+        self.assertEqual([key for key, task in tasks.items()], expected)
+
+    def test_tasks_span_several_buckets(self):
+
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        tasks = CompactTaskMap()
+        tasks.bucket_size = 4
+
+        for item_id in range(10):
+            tasks.add(Item(item_id), "en")
+
+        tasks[(9, "en")]["state"] = "success"
+        tasks[(9, "en")]["error_message"] = None
+
+        for item_id in range(10):
+            task = tasks[(item_id, "en")]
+            self.assertEqual(task["item"].id, item_id)
+            self.assertEqual(
+                task["state"],
+                "success" if item_id == 9 else "pending"
+            )
+
+    def test_state_counts(self):
+
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        tasks = CompactTaskMap()
+        a = tasks.add(Item(1), "en")
+        b = tasks.add(Item(2), "en")
+        tasks.add(Item(3), "en")
+
+        self.assertEqual(tasks.count("pending"), 3)
+        self.assertEqual(tasks.count("success"), 0)
+
+        a["state"] = "success"
+        b["state"] = "failed"
+        b["error_message"] = "Boom"
+        b["state"] = "failed"
+
+        self.assertEqual(tasks.count("pending"), 1)
+        self.assertEqual(tasks.count("failed"), 1)
+        self.assertEqual(tasks.count("success"), 1)
+        self.assertEqual(b["error_message"], "Boom")
+
+        b["state"] = "pending"
+        b["error_message"] = None
+
+        self.assertEqual(tasks.count("pending"), 2)
+        self.assertEqual(tasks.count("failed"), 0)
+        self.assertIsNone(b["error_message"])
+
+    def test_immutable_fields(self):
+
+        from woost.extensions.staticpub.taskmap import CompactTaskMap
+
+        tasks = CompactTaskMap()
+        task = tasks.add(Item(1), "en")
+
+        with self.assertRaises(TypeError):
+            task["item"] = Item(2)
+
+        with self.assertRaises(TypeError):
+            task["language"] = "es"
+
+        with self.assertRaises(KeyError):
+            task["foo"] = "bar"
+
+        with self.assertRaises(TypeError):
+            del task["state"]
@@ -0,0 +1,233 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from unittest import TestCase
+
+from woost.tests.models.basetestcase import BaseTestCase
+from woost.extensions.staticpub.exporter import Exporter, StoredFile
+
+
+class MemoryExporter(Exporter):
+    """An exporter for files held in memory, as a mapping of paths to
+    (size, digest) tuples.
+    """
+
+    def __init__(self, files):
+        self.files = files
+
+    def iter_stored_files(self, root):
+        for path, (size, digest) in self.files.items():
+            if path[:len(root)] == tuple(root):
+                yield StoredFile(path, size)
+
+    def remove_files(self, paths):
+        for path in paths:
+            del self.files[tuple(path)]
+
+    def get_stored_digest(self, stored_file):
+        return self.files[stored_file.path][1]
+
+
+class RecordedDestination:
+    """Stands in for a destination, providing only its export records."""
+
+    incremental = True
+
+    def __init__(self, records):
+        self.records = records
+
+    def iter_exported_files(self):
+        return self.records.items()
+
+    def get_export_root(self):
+        return ()
+
+
+class VerifyTestCase(TestCase):
+
+    def verify(self, records, files):
+        from woost.extensions.staticpub.verification import (
+            DestinationVerifier
+        )
+        verifier = DestinationVerifier(
+            RecordedDestination(records),
+            MemoryExporter(files)
+        )
+        return verifier.verify()
+
+    def test_matching_files(self):
+
+        report = self.verify(
+            {
+                "http://example.com/a": {
+                    "export_path": ("a.html",),
+                    "size": 10,
+                    "digest": "aaa"
+                },
+                "http://example.com/b": {
+                    "export_path": ("b.css",),
+                    "size": 20
+                },
+                "http://example.com/c": {
+                    "export_path": ("c.js",)
+                }
+            },
+            {
+                ("a.html",): (10, "aaa"),
+                ("b.css",): (20, None),
+                ("c.js",): (None, None)
+            }
+        )
+
+        self.assertFalse(report)
+        self.assertEqual(report.verified, 2)
+        self.assertEqual(report.unverified, 1)
+
+    def test_differences(self):
+
+        missing = ("http://example.com/a", {"export_path": ("a.html",)})
+        resized = (
+            "http://example.com/b",
+            {"export_path": ("b.html",), "size": 10, "digest": "bbb"}
+        )
+        modified = (
+            "http://example.com/c",
+            {"export_path": ("c.html",), "size": 10, "digest": "ccc"}
+        )
+
+        report = self.verify(
+            dict([missing, resized, modified]),
+            {
+                ("b.html",): (11, "bbb"),
+                ("c.html",): (10, "xxx"),
+                ("d.html",): (10, "ddd")
+            }
+        )
+
+        self.assertTrue(report)
+        self.assertEqual(report.missing, [missing])
+        self.assertEqual(
+            sorted(report.modified),
+            sorted([resized, modified])
+        )
+        self.assertEqual(
+            [stored_file.path for stored_file in report.extraneous],
+            [("d.html",)]
+        )
+        self.assertEqual(report.verified, 0)
+
+
+class PruneTestCase(TestCase):
+
+    def setUp(self):
+
+        from woost.extensions.staticpub.verification import (
+            DestinationVerifier
+        )
+
+        self.files = {
+            ("a.html",): (1, None),
+            ("old", "b.html"): (1, None),
+            ("old", "c", "d.html"): (1, None),
+            ("older", "e.html"): (1, None)
+        }
+        records = {
+            "http://example.com/a": {"export_path": ("a.html",)}
+        }
+        self.verifier = DestinationVerifier(
+            RecordedDestination(records),
+            MemoryExporter(self.files)
+        )
+        self.report = self.verifier.verify()
+
+    def test_prune_requires_confirmation_or_prefix(self):
+        with self.assertRaises(ValueError):
+            self.verifier.prune(self.report)
+        self.assertEqual(len(self.files), 4)
+
+    def test_prune_prefix(self):
+        self.verifier.prune(self.report, prefix=["old"])
+        self.assertEqual(
+            set(self.files),
+            {("a.html",), ("older", "e.html")}
+        )
+
+    def test_prune_all(self):
+        self.verifier.prune(self.report, confirmed=True)
+        self.assertEqual(set(self.files), {("a.html",)})
+
+
+class RepairTestCase(BaseTestCase):
+
+    def test_repair(self):
+
+        from woost.models import Publishable
+        from woost.extensions.staticpub.folderdestination import (
+            FolderDestination
+        )
+        from woost.extensions.staticpub.verification import (
+            DestinationVerifier,
+            VerificationReport
+        )
+
+        item = Publishable()
+        item.insert()
+
+        destination = FolderDestination()
+        destination.insert()
+
+        document = (
+            "http://example.com/a",
+            {
+                "export_path": ("a.html",),
+                "kind": "document",
+                "item": item.id,
+                "language": "en"
+            }
+        )
+        dependency = (
+            "http://example.com/b.css",
+            {"export_path": ("b.css",), "kind": "dependency"}
+        )
+        unchanged = (
+            "http://example.com/c.css",
+            {"export_path": ("c.css",), "kind": "dependency"}
+        )
+
+        for url, record in (document, dependency, unchanged):
+            destination.set_exported_file(url, record)
+
+        report = VerificationReport()
+        report.missing.append(document)
+        report.modified.append(dependency)
+
+        verifier = DestinationVerifier(destination, MemoryExporter({}))
+        export = verifier.repair(report)
+
+        self.assertEqual(export.destination, destination)
+        self.assertEqual(list(export.tasks.keys()), [(item.id, "en")])
+        self.assertEqual(
+            dict(export.iter_dependencies()),
+            {"http://example.com/b.css": "pending"}
+        )
+        self.assertEqual(
+            [url for url, record in destination.iter_exported_files()],
+            ["http://example.com/c.css"]
+        )
+
+    def test_nothing_to_repair(self):
+
+        from woost.extensions.staticpub.folderdestination import (
+            FolderDestination
+        )
+        from woost.extensions.staticpub.verification import (
+            DestinationVerifier,
+            VerificationReport
+        )
+
+        destination = FolderDestination()
+        destination.insert()
+
+        verifier = DestinationVerifier(destination, MemoryExporter({}))
+        self.assertIsNone(verifier.repair(VerificationReport()))
@@ -2,9 +2,13 @@
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
-from typing import Iterable, Tuple
+from typing import BinaryIO, Iterable, Tuple, Union
+from hashlib import md5
+from hmac import compare_digest
+from urllib.parse import urlsplit
 
 import cherrypy
+from cocktail.urls import URL
 from woost import app
 from woost.models import (
     PublishableObject,
@@ -26,11 +30,78 @@ def get_current_export() -> Export:
     export_id = cherrypy.request.headers.get(EXPORT_HEADER)
 
     if export_id:
-        return Export.get_instance(int(export_id))
+        try:
+            export_id = int(export_id)
+        except ValueError:
+            return None
+        return Export.get_instance(export_id)
     else:
         return None
 
 
+def is_export_request() -> bool:
+    """Determines if the current HTTP request was issued by a running
+    export.
+
+    Any client can send the export header, so requests are only trusted if
+    they also carry the authentication token of the export they claim to
+    belong to.
+    """
+    export = get_current_export()
+
+    if export is None or export.state != "running" or not export.auth_token:
+        return False
+
+    auth_token = cherrypy.request.headers.get(
+        app.authentication.AUTH_TOKEN_HEADER
+    )
+    return bool(auth_token) and compare_digest(auth_token, export.auth_token)
+
+
+def get_content_digest(content: Union[bytes, str], encoding="utf-8") -> str:
+    """Obtains a digest for the given exported content.
+
+    :param content: The content to evaluate.
+
+    :param encoding: The encoding to apply if `content` is a string.
+
+    :return: The hexadecimal MD5 digest of the content.
+    """
+    if isinstance(content, str):
+        content = content.encode(encoding)
+
+    return md5(content).hexdigest()
+
+
+class DigestReader:
+    """Wraps a readable binary stream, computing the digest of the data read
+    through it.
+
+    Produces the same digest as `get_content_digest` for the full content of
+    the stream.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.size = 0
+        self.__hash = md5()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.size += len(data)
+        self.__hash.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.__hash.hexdigest()
+
+
+def get_origin(url: Union[URL, str]) -> str:
+    """Obtains the origin (scheme, host and port) of the given URL."""
+    parts = urlsplit(str(url))
+    return f"{parts.scheme}://{parts.netloc}"
+
+
 def iter_exportable_languages(
         publishable: Publishable,
         user: User = None) -> Iterable[str]:
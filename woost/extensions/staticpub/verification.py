@@ -0,0 +1,262 @@
+"""
+
+.. moduleauthor:: Martí Congost <marti.congost@whads.com>
+"""
+from typing import List, Sequence, Tuple
+from concurrent import futures
+
+from cocktail.events import Event
+from cocktail.persistence import transaction
+from cocktail.urls import URL
+from woost import app
+from woost.models import Publishable, User
+
+from .destination import Destination
+from .export import Export
+from .exporter import Exporter, StoredFile
+from .utils import iter_exportable_languages
+
+ExportedFile = Tuple[str, dict]
+
+
+class VerificationReport:
+    """The differences found between a destination and the record of the
+    files exported to it.
+
+    :var missing: The exported files that can't be found at the destination,
+        as (url, record) tuples.
+    :var modified: The exported files whose content at the destination
+        doesn't match the exported content, as (url, record) tuples.
+    :var extraneous: Files found at the destination that weren't exported to
+        it (or were exported before export records were kept).
+    :var verified: The number of files that match their record.
+    :var unverified: The number of files that couldn't be checked, because
+        neither their size nor their digest were known.
+    """
+
+    def __init__(self):
+        self.missing: List[ExportedFile] = []
+        self.modified: List[ExportedFile] = []
+        self.extraneous: List[StoredFile] = []
+        self.verified = 0
+        self.unverified = 0
+
+    @property
+    def drifted(self) -> List[ExportedFile]:
+        """The exported files that must be exported again."""
+        return self.missing + self.modified
+
+    def __bool__(self) -> bool:
+        return bool(self.missing or self.modified or self.extraneous)
+
+
+class DestinationVerifier:
+    """Compares the files stored at a destination with the record of the
+    files exported to it, and repairs the differences.
+
+    :param destination: The destination to verify.
+
+    :param exporter: The exporter used to list and inspect the files at the
+        destination. Defaults to a new exporter for the destination.
+    """
+
+    workers = 8
+
+    file_verified = Event()
+
+    def __init__(self, destination: Destination, exporter: Exporter = None):
+
+        if not destination.incremental:
+            raise ValueError(
+                f"Can't verify {destination}, since it doesn't support "
+                "incremental exports"
+            )
+
+        self.destination = destination
+        self.exporter = exporter or destination.create_exporter()
+
+    def verify(self) -> VerificationReport:
+
+        report = VerificationReport()
+
+        with self.exporter:
+
+            records = {
+                tuple(record["export_path"]): (url, record)
+                for url, record in self.destination.iter_exported_files()
+            }
+
+            stored_files = {}
+            for stored_file in self.exporter.iter_stored_files(
+                self.destination.get_export_root()
+            ):
+                if stored_file.path in records:
+                    stored_files[stored_file.path] = stored_file
+                else:
+                    report.extraneous.append(stored_file)
+
+            for path, exported_file in records.items():
+                if path not in stored_files:
+                    report.missing.append(exported_file)
+
+            # Compare the content of the files in parallel; hashing local
+            # files and requesting metadata from remote stores is dominated by
+            # I/O
+            with futures.ThreadPoolExecutor(self.workers) as executor:
+                checks = {
+                    executor.submit(
+                        self.file_matches,
+                        stored_file,
+                        records[path][1]
+                    ): records[path]
+                    for path, stored_file in stored_files.items()
+                }
+                for future in futures.as_completed(checks):
+                    exported_file = checks[future]
+                    matches = future.result()
+                    if matches is None:
+                        report.unverified += 1
+                    elif matches:
+                        report.verified += 1
+                    else:
+                        report.modified.append(exported_file)
+                    self.file_verified(
+                        url=exported_file[0],
+                        record=exported_file[1],
+                        matches=matches
+                    )
+
+        return report
+
+    def file_matches(self, stored_file: StoredFile, record: dict) -> bool:
+        """Determines if a stored file matches its export record.
+
+        :return: True or False, or None if the file couldn't be checked.
+        """
+        size = record.get("size")
+        if size is not None:
+            size = self.exporter.get_stored_size(
+                size,
+                record.get("content_type")
+            )
+
+        if (
+            size is not None
+            and stored_file.size is not None
+            and size != stored_file.size
+        ):
+            return False
+
+        digest = record.get("digest")
+        if digest:
+            stored_digest = self.exporter.get_stored_digest(stored_file)
+            if stored_digest:
+                return stored_digest == digest
+
+        if size is not None and stored_file.size is not None:
+            return True
+
+        return None
+
+    def prune(
+            self,
+            report: VerificationReport,
+            prefix: Sequence[str] = None,
+            confirmed: bool = False):
+        """Removes the extraneous files found at the destination.
+
+        Files exported before export records were kept have no record, but
+        may still be in use; pruning must either be limited to a prefix or
+        be explicitly confirmed.
+
+        :param report: The differences found by `verify`.
+
+        :param prefix: If given, only extraneous files under this path are
+            removed.
+
+        :param confirmed: Must be set to True to remove all extraneous files.
+        """
+        if prefix is None and not confirmed:
+            raise ValueError(
+                "Pruning all extraneous files must be confirmed, or limited "
+                "to a prefix"
+            )
+
+        paths = [
+            stored_file.path
+            for stored_file in report.extraneous
+            if prefix is None
+            or stored_file.path[:len(prefix)] == tuple(prefix)
+        ]
+
+        if paths:
+            with self.exporter:
+                self.exporter.remove_files(paths)
+
+    def repair(
+            self,
+            report: VerificationReport,
+            user: User = None) -> Export:
+        """Prepares an export operation to restore the files that have been
+        removed or modified at the destination.
+
+        The records for the affected files are discarded, so that the export
+        transfers them in full, even if their content hasn't changed at the
+        source.
+
+        :param report: The differences to repair, as produced by `verify`.
+
+        :param user: The user that the export operation should be run as.
+
+        :return: The export operation that will restore the missing and
+            modified files, or None if there is nothing to restore.
+        """
+        if not report.drifted:
+            return None
+
+        def create_export():
+
+            export = Export.new(destination=self.destination)
+            export.user = user
+
+            for url, record in report.drifted:
+                self.destination.remove_exported_file(url)
+
+                if record.get("kind") == "dependency":
+                    export.set_dependency_state(url, "pending")
+                else:
+                    for item, language in self._get_document_tasks(
+                        url,
+                        record,
+                        user
+                    ):
+                        export.add_task("post", item, language)
+
+            return export
+
+        return transaction(create_export)
+
+    def _get_document_tasks(
+            self,
+            url: str,
+            record: dict,
+            user: User = None) -> Sequence[Tuple[Publishable, str]]:
+
+        item_id = record.get("item")
+        if item_id is not None:
+            item = Publishable.get_instance(item_id)
+            if item is None:
+                return ()
+            return [(item, record.get("language"))]
+
+        # Records written before documents were tracked by item: export all
+        # translations of the publishable at the URL
+        resolution = app.url_mapping.resolve(URL(url))
+        item = resolution and resolution.publishable
+        if item is None:
+            return ()
+
+        return [
+            (item, language)
+            for language in iter_exportable_languages(item, user=user)
+        ]
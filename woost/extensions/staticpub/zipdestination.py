@@ -2,6 +2,9 @@
 
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
+import os
+from woost import app
+
 from .destination import Destination
 from .zipexportjob import ZIPExportJob
 from .zipexporter import ZIPExporter
@@ -10,9 +13,19 @@ from .zipexporter import ZIPExporter
 class ZIPDestination(Destination):
 
     export_job_class = ZIPExportJob
+    incremental = False
     exporter_class = ZIPExporter
     state_ui_component = (
         "woost.extensions.staticpub.admin.ui."
         "ZIPPublicationState"
     )
 
+
+    def create_mirror_exporter(self, export):
+        folder = (
+            self.export_job_class.zip_folder
+            or app.path("x-staticpub-zip-files")
+        )
+        os.makedirs(folder, exist_ok=True)
+        filename = os.path.join(folder, f"{export.id}-{self.id}.zip")
+        return self.create_exporter(filename=filename)
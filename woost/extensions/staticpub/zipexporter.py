@@ -3,6 +3,8 @@
 .. moduleauthor:: Martí Congost <marti.congost@whads.com>
 """
 import os
+import shutil
+import time
 import zipfile
 
 from .exporter import Exporter
@@ -38,13 +40,46 @@ class ZIPExporter(Exporter):
             path: str,
             content: bytes,
             content_type: str = None) -> dict:
+        """Determines the options to apply when adding a member to the
+        archive.
 
+        :param content: The content of the member, or None if the member is
+            being written from a stream.
+        """
         return {}
 
-    def write_file(self, path, content, content_type=None):
+    def write_file(
+            self,
+            path,
+            content,
+            content_type=None,
+            cache_control=None):
         self._file.writestr(
             "/".join(path),
             content,
             **self.get_zip_options_for_path(path, content, content_type)
         )
 
+    def write_stream(
+            self,
+            path,
+            stream,
+            content_type=None,
+            cache_control=None):
+
+        options = self.get_zip_options_for_path(path, None, content_type)
+        info = zipfile.ZipInfo(
+            "/".join(path),
+            date_time=time.localtime(time.time())[:6]
+        )
+        info.external_attr = 0o600 << 16
+        info.compress_type = options.get(
+            "compress_type",
+            self._file.compression
+        )
+
+        # The size of the member isn't known in advance, so ZIP64 extensions
+        # must be enabled up front in case it exceeds 2 GB
+        with self._file.open(info, "w", force_zip64=True) as member:
+            shutil.copyfileobj(stream, member, self.stream_chunk_size)
+